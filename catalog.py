@@ -0,0 +1,94 @@
+# catalog.py
+import logging
+import threading
+import time
+
+from config import CATALOG_CHECK_INTERVAL
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogCache:
+    """Каталог товаров и вариантов в памяти процесса.
+
+    Загружается целиком одним обращением к БД и перечитывается только когда
+    меняется версия каталога. Версия сверяется не чаще раза в check_interval секунд.
+    """
+
+    def __init__(self, check_interval=30.0):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # (товары по названию, {product_id: товар}, {variant_id: вариант с product_name})
+        self._state = None
+        self._version = None
+        self._checked_at = 0.0
+
+    @staticmethod
+    def _fetch_version(cur):
+        # Счётчик увеличивают триггеры на products и product_variants (миграция 013)
+        cur.execute("SELECT version FROM catalog_version WHERE id = 1")
+        row = cur.fetchone()
+        return row['version'] if row else None
+
+    def _load(self, cur, version):
+        cur.execute("SELECT id, name, purchase_price_kg FROM products ORDER BY name, id")
+        products = [dict(p, variants=[]) for p in cur.fetchall()]
+        by_id = {p['id']: p for p in products}
+
+        cur.execute("SELECT * FROM product_variants ORDER BY sort_order, id")
+        variants = {}
+        for v in cur.fetchall():
+            product = by_id.get(v['product_id'])
+            if product is None:
+                continue
+            v['product_name'] = product['name']
+            v['purchase_price_kg'] = product['purchase_price_kg']
+            variants[v['id']] = v
+            product['variants'].append(v)
+
+        self._state = (products, by_id, variants)
+        self._version = version
+        logger.info(f"📚 Каталог загружен: товаров {len(products)}, вариантов {len(variants)}")
+
+    def _ensure_fresh(self):
+        state = self._state
+        if state is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return state
+        with self._lock:
+            if self._state is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._state
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    version = self._fetch_version(cur)
+                    if self._state is None or version != self._version:
+                        self._load(cur, version)
+            self._checked_at = time.monotonic()
+            return self._state
+
+    def invalidate(self):
+        """Заставляет перечитать каталог при следующем обращении"""
+        with self._lock:
+            self._version = None
+            self._checked_at = 0.0
+
+    def get_all_products(self):
+        products, _, _ = self._ensure_fresh()
+        return [dict(p, variants=[dict(v) for v in p['variants']]) for p in products]
+
+    def get_product_names(self):
+        products, _, _ = self._ensure_fresh()
+        return {p['id']: p['name'] for p in products}
+
+    def get_product_variants(self, product_id: int):
+        _, by_id, _ = self._ensure_fresh()
+        product = by_id.get(product_id)
+        return [dict(v) for v in product['variants']] if product else []
+
+    def get_variant(self, variant_id: int):
+        _, _, variants = self._ensure_fresh()
+        variant = variants.get(variant_id)
+        return dict(variant) if variant else None
+
+
+catalog = CatalogCache(check_interval=CATALOG_CHECK_INTERVAL)
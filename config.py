@@ -14,3 +14,67 @@ if not BOT_TOKEN or not DATABASE_URL:
 
 BASE_URL = os.getenv('RENDER_EXTERNAL_URL', 'https://skladbot-rhoo.onrender.com')
 WEBHOOK_URL = f"{BASE_URL}/webhook"
+
+# Несколько процессов под gunicorn (gunicorn.conf.py): общее состояние переезжает в БД,
+# лимиты отправки делятся между процессами
+WEB_CONCURRENCY = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+MULTIPROCESS = WEB_CONCURRENCY > 1
+
+# Подробный журнал остатков (до/после) по каждой операции со складом
+STOCK_AUDIT = os.getenv('STOCK_AUDIT', '0') == '1'
+
+# Кэш каталога: как часто (сек.) сверять версию каталога с БД
+CATALOG_CHECK_INTERVAL = float(os.getenv('CATALOG_CHECK_INTERVAL', 30))
+
+# Кэш справочника продавцов (сек.)
+SELLER_CACHE_TTL = float(os.getenv('SELLER_CACHE_TTL', 300))
+SELLER_NEGATIVE_TTL = float(os.getenv('SELLER_NEGATIVE_TTL', 600))  # для незнакомых telegram_id
+
+# Обработка входящих обновлений webhook
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))           # шардов: чат всегда обрабатывается одним потоком
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 250))   # на шард, больше — отвечаем 503
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv('WEBHOOK_DRAIN_TIMEOUT', 30))  # сек. на доработку очереди при остановке
+WEBHOOK_DEDUPE_SIZE = int(os.getenv('WEBHOOK_DEDUPE_SIZE', 10000))       # сколько последних update_id помнить
+WEBHOOK_DEDUPE_SHARED = os.getenv('WEBHOOK_DEDUPE_SHARED', '1' if MULTIPROCESS else '0') == '1'  # общий фильтр в таблице processed_updates
+# Токен для /dispatcher-stats (заголовок X-Stats-Token); без него эндпоинт отключён
+STATS_TOKEN = os.getenv('STATS_TOKEN')
+WEBHOOK_SHARED_QUEUE = os.getenv('WEBHOOK_SHARED_QUEUE', '1' if MULTIPROCESS else '0') == '1'  # общая очередь чатов в таблице chat_updates
+# Сколько запросов webhook Telegram шлёт одновременно. Порядок обновлений чата между
+# процессами держится только при 1: следующее обновление приходит после ответа на предыдущее
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 1 if MULTIPROCESS else 40))
+
+# Пул соединений с базой данных. При общей очереди (WEBHOOK_SHARED_QUEUE) каждый шард
+# держит соединение под блокировкой чата и берёт ещё одно для обработчика; сверху —
+# потоки запросов webhook (GUNICORN_THREADS), outbox и проверка chat_updates
+WEBHOOK_REQUEST_THREADS = int(os.getenv('GUNICORN_THREADS', 4))
+DB_POOL_NEEDED = (2 if WEBHOOK_SHARED_QUEUE else 1) * WEBHOOK_WORKERS + WEBHOOK_REQUEST_THREADS + 2
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', max(10, DB_POOL_NEEDED)))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))        # сек. ожидания свободного соединения
+DB_POOL_MAX_AGE = float(os.getenv('DB_POOL_MAX_AGE', 1800))      # сек. жизни соединения до пересоздания
+DB_POOL_CHECK_IDLE = float(os.getenv('DB_POOL_CHECK_IDLE', 30))  # проверять соединение, простоявшее дольше
+
+# Исходящие сообщения: лимиты Telegram
+# Лимиты заданы на бота целиком, каждый процесс получает свою долю
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30)) / WEB_CONCURRENCY  # сообщений в секунду на бота
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1)) / WEB_CONCURRENCY       # сообщений в секунду в один чат
+SEND_WORKERS = int(os.getenv('SEND_WORKERS', 4))
+
+# Отправка уведомлений из notification_outbox
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', 1))  # сек. между проверками новых уведомлений
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+
+# Пошаговые сессии пользователей (sessions.py)
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'postgres' if MULTIPROCESS else 'memory')  # memory | sqlite | postgres
+SESSION_TTL = float(os.getenv('SESSION_TTL', 3600))      # сек. с последнего действия пользователя
+SESSION_MAX = int(os.getenv('SESSION_MAX', 5000))        # сессий в памяти (для memory), давние вытесняются
+SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', 'sessions.db')
+
+# Остатки в боте выводятся страницами по столько позиций
+STOCK_PAGE_SIZE = int(os.getenv('STOCK_PAGE_SIZE', 30))
+
+# Кэш остатков продавцов (stock_cache.py)
+STOCK_CACHE_TTL = float(os.getenv('STOCK_CACHE_TTL', 300))               # сек. до перечитывания из БД
+STOCK_CACHE_MAX_SELLERS = int(os.getenv('STOCK_CACHE_MAX_SELLERS', 1000))
+STOCK_CACHE_SHARED = os.getenv('STOCK_CACHE_SHARED', '1' if MULTIPROCESS else '0') == '1'  # сброс через pg_notify
@@ -0,0 +1,79 @@
+# conversation.py
+import logging
+import threading
+
+from sessions import Session, session_store
+
+logger = logging.getLogger(__name__)
+
+
+class PendingStep(Session):
+    """Ожидаемый ответ чата: имя шага и его аргументы (только JSON-совместимые значения)"""
+    __slots__ = ('name', 'args')
+    DEFAULTS = {'args': list}
+
+
+class ConversationRegistry:
+    """Следующие шаги диалога вместо bot.register_next_step_handler_by_chat_id.
+
+    Шаг регистрируется под именем (@conversation.step('имя')), ожидание хранится
+    в хранилище сессий (config.SESSION_BACKEND) как имя плюс аргументы, поэтому
+    ответ может обработать любой процесс, в том числе после перезапуска. Ожидание
+    живёт SESSION_TTL секунд. Следующее текстовое сообщение чата забирает ожидание
+    атомарно и передаётся шагу как step(message, *args).
+    """
+
+    def __init__(self, bot, store):
+        self.bot = bot
+        self.store = store
+        self._steps = {}
+
+    def step(self, name):
+        """Декоратор: регистрирует функцию шага под именем name"""
+        def decorator(handler):
+            if name in self._steps:
+                raise ValueError(f"Шаг '{name}' уже зарегистрирован")
+            self._steps[name] = handler
+            return handler
+        return decorator
+
+    def expect(self, chat_id, name, *args):
+        """Следующее сообщение чата chat_id будет передано шагу name"""
+        if name not in self._steps:
+            raise KeyError(f"Неизвестный шаг '{name}'")
+        self.store.start(chat_id, name=name, args=list(args))
+
+    def cancel(self, chat_id):
+        self.store.pop(chat_id)
+
+    def claim(self, message) -> bool:
+        """Забирает ожидание чата; True — сообщение должен обработать шаг"""
+        pending = self.store.pop(message.chat.id)
+        if pending is None:
+            return False
+        handler = self._steps.get(pending.name)
+        if handler is None:
+            logger.warning(f"⚠️ Ожидался неизвестный шаг '{pending.name}' в чате {message.chat.id}")
+            return False
+        message.pending_step = (handler, pending.args)
+        return True
+
+    def handle(self, message):
+        handler, args = message.pending_step
+        handler(message, *args)
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_conversation(bot):
+    """Реестр шагов бота; при первом обращении подключает обработчик сообщений.
+    Вызывать до регистрации остальных message-обработчиков, чтобы ответ на шаг
+    не перехватили обработчики кнопок меню."""
+    with _registries_lock:
+        registry = _registries.get(id(bot))
+        if registry is None:
+            registry = _registries[id(bot)] = ConversationRegistry(bot, session_store('next_step', PendingStep))
+            bot.message_handler(func=registry.claim)(registry.handle)
+        return registry
@@ -1,6 +1,269 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
 import psycopg2
+from psycopg2 import extensions
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """Потокобезопасный пул соединений с PostgreSQL.
+
+    Держит не больше maxconn соединений, при выдаче проверяет соединение,
+    пересоздаёт соединения старше max_age и ждёт свободное не дольше timeout секунд.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=10.0, max_age=1800.0, check_idle=30.0):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_age = max_age
+        self.check_idle = check_idle
+        self._cond = threading.Condition()
+        self._idle = []      # [(conn, время возврата в пул)]
+        self._created = {}   # id(conn) -> время создания
+        self._size = 0
+        self._closed = False
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+            self._size += 1
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn, cursor_factory=RealDictCursor)
+        self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def _close(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - self._created.get(id(conn), now) > self.max_age:
+            logger.info("♻️ Соединение с БД устарело, пересоздаём")
+            return False
+        if now - returned_at > self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error as e:
+                logger.warning(f"⚠️ Соединение с БД не прошло проверку: {e}")
+                return False
+        return True
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError("Пул соединений закрыт")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    conn, returned_at = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError(f"Нет свободных соединений с БД (ожидание {self.timeout} с)")
+                self._cond.wait(remaining)
+
+        if conn is not None and self._is_healthy(conn, returned_at):
+            return conn
+        if conn is not None:
+            self._close(conn)
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+        with self._cond:
+            if discard or conn.closed or self._closed:
+                self._close(conn)
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._close(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'size': self._size, 'idle': len(self._idle), 'max': self.maxconn}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from config import (
+                    DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT,
+                    DB_POOL_MAX_AGE, DB_POOL_CHECK_IDLE
+                )
+                _pool = ConnectionPool(
+                    DATABASE_URL,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_age=DB_POOL_MAX_AGE,
+                    check_idle=DB_POOL_CHECK_IDLE
+                )
+    return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
 
+
+_local = threading.local()
+
+
+class _TransactionConnection:
+    """Соединение внутри transaction(): commit() откладывается до конца единицы работы"""
+    __slots__ = ('_conn',)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def commit(self):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def in_transaction():
+    return getattr(_local, 'conn', None) is not None
+
+
+def on_commit(callback):
+    """Вызывает callback после фиксации текущей transaction(); вне её — сразу
+    (get_db_connection() к этому моменту уже зафиксировал изменения). При откате
+    transaction() callback не вызывается."""
+    callbacks = getattr(_local, 'on_commit', None)
+    if in_transaction() and callbacks is not None:
+        callbacks.append(callback)
+    else:
+        callback()
+
+
+@contextmanager
 def get_db_connection():
-    from config import DATABASE_URL
-    return psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+    """Берёт соединение из пула: при успехе фиксирует транзакцию, при ошибке откатывает.
+    Внутри transaction() возвращает соединение текущей единицы работы."""
+    shared = getattr(_local, 'conn', None)
+    if shared is not None:
+        yield _TransactionConnection(shared)
+        return
+    pool = get_pool()
+    conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception as e:
+        discard = isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
+
+
+@contextmanager
+def transaction():
+    """Единица работы: все вызовы get_db_connection() внутри блока (в том числе
+    из функций models) идут через одно соединение и фиксируются одним commit.
+    Вложенный transaction() становится частью внешнего."""
+    shared = getattr(_local, 'conn', None)
+    if shared is not None:
+        yield _TransactionConnection(shared)
+        return
+    callbacks = []
+    with get_db_connection() as conn:
+        _local.conn = conn
+        _local.on_commit = callbacks
+        try:
+            yield conn
+        finally:
+            _local.conn = None
+            _local.on_commit = None
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.exception(f"Ошибка в обработчике после фиксации транзакции: {e}")
+
+
+# Пространства ключей для advisory_lock (первый аргумент pg_advisory_lock(int, int))
+LOCK_CHAT = 1
+
+
+def _int32(key):
+    """Приводит произвольный int к диапазону int4 (chat_id бывает больше 2**31)"""
+    return (key + 2 ** 31) % 2 ** 32 - 2 ** 31
+
+
+@contextmanager
+def try_advisory_lock(namespace, key):
+    """Сессионная advisory-блокировка Postgres на время блока без ожидания: блок
+    получает True, если блокировка взята, и False, если её держит другой поток или
+    процесс. Пока блокировка взята, держит соединение из пула; при обрыве соединения
+    блокировку снимает сервер."""
+    args = (namespace, _int32(key))
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s, %s) AS locked", args)
+            locked = cur.fetchone()['locked']
+        conn.commit()
+        if not locked:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s, %s)", args)
+            conn.commit()
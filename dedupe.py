@@ -0,0 +1,85 @@
+# dedupe.py
+import logging
+import threading
+from collections import OrderedDict
+
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator:
+    """Отсекает повторную доставку обновлений Telegram по update_id.
+
+    Последние capacity идентификаторов хранятся в памяти (LRU). При shared=True
+    идентификатор дополнительно записывается в processed_updates, чтобы повтор,
+    пришедший в другой процесс, тоже был отброшен. Записи старше retention секунд
+    удаляются раз в cleanup_every новых обновлений.
+    """
+
+    def __init__(self, capacity=10000, shared=False, retention=3600, cleanup_every=1000):
+        self.capacity = capacity
+        self.shared = shared
+        self.retention = retention
+        self.cleanup_every = cleanup_every
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._since_cleanup = 0
+        self.duplicates = 0
+
+    def is_duplicate(self, update_id) -> bool:
+        """Запоминает update_id; True — такое обновление уже принималось"""
+        with self._lock:
+            if update_id in self._seen:
+                self._seen.move_to_end(update_id)
+                self.duplicates += 1
+                return True
+            self._seen[update_id] = True
+            if len(self._seen) > self.capacity:
+                self._seen.popitem(last=False)
+        if self.shared:
+            try:
+                claimed = self._claim_shared(update_id)
+            except Exception:
+                # Иначе повтор от Telegram после ответа 500 был бы отброшен как дубликат
+                with self._lock:
+                    self._seen.pop(update_id, None)
+                raise
+            if not claimed:
+                with self._lock:
+                    self.duplicates += 1
+                return True
+        return False
+
+    def forget(self, update_id):
+        """Снимает отметку, если обновление не удалось принять в обработку"""
+        with self._lock:
+            self._seen.pop(update_id, None)
+        if self.shared:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("DELETE FROM processed_updates WHERE update_id = %s", (update_id,))
+                    conn.commit()
+
+    def _claim_shared(self, update_id) -> bool:
+        with self._lock:
+            self._since_cleanup += 1
+            cleanup = self._since_cleanup >= self.cleanup_every
+            if cleanup:
+                self._since_cleanup = 0
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO processed_updates (update_id) VALUES (%s)
+                    ON CONFLICT (update_id) DO NOTHING
+                    RETURNING update_id
+                """, (update_id,))
+                claimed = cur.fetchone() is not None
+                if cleanup:
+                    cur.execute(
+                        "DELETE FROM processed_updates WHERE received_at < NOW() - make_interval(secs => %s)",
+                        (self.retention,)
+                    )
+                    logger.info(f"🧹 Удалено старых update_id: {cur.rowcount}")
+                conn.commit()
+                return claimed
@@ -0,0 +1,268 @@
+# dispatcher.py
+import logging
+import queue
+import threading
+import time
+
+import telebot
+
+from database import get_db_connection, get_pool, try_advisory_lock, LOCK_CHAT
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+def update_chat_id(update):
+    """Чат, к которому относится обновление; None — если чат определить нельзя"""
+    for kind in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        message = getattr(update, kind, None)
+        if message is not None:
+            return message.chat.id
+    call = getattr(update, 'callback_query', None)
+    if call is not None:
+        if call.message is not None:
+            return call.message.chat.id
+        return call.from_user.id
+    for kind in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        event = getattr(update, kind, None)
+        if event is not None:
+            return event.from_user.id
+    return None
+
+
+class _Shard:
+    """Очередь и поток одного шарда со своими счётчиками"""
+
+    def __init__(self, index, queue_size):
+        self.index = index
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_wait = 0.0  # сек., самое долгое ожидание обновления в очереди
+
+
+class UpdateDispatcher:
+    """Очереди входящих обновлений Telegram, разложенные по чатам.
+
+    Webhook только кладёт обновление в очередь и сразу отвечает. Обновления одного
+    чата всегда попадают в один шард и обрабатываются строго по порядку (на этом
+    держатся next-step обработчики), разные чаты обрабатываются параллельно.
+    Если очередь шарда заполнена, submit() возвращает False, и webhook отвечает 503,
+    чтобы Telegram повторил доставку позже.
+
+    При нескольких процессах (shared_queue=True) обновление чата до ответа webhook
+    записывается в таблицу chat_updates, а в шард попадает только команда разобрать
+    очередь чата. Разбирает её тот, кто взял advisory-блокировку чата: строки
+    берутся по порядку update_id, пока очередь не опустеет. Процесс, не получивший
+    блокировку, не ждёт — его обновление заберёт владелец, который после снятия
+    блокировки ещё раз проверяет очередь. Порядок приёма обеспечивает webhook с
+    max_connections=1 (config.WEBHOOK_MAX_CONNECTIONS). Строки, оставшиеся после
+    сбоя процесса, раз в sweep_interval секунд подбирает фоновый поток.
+    В этом режиме шард занимает до двух соединений пула (блокировка и обработчик),
+    поэтому при запуске пул сверяется с pool_needed (config.DB_POOL_NEEDED).
+    """
+
+    def __init__(self, bot, workers=4, queue_size=1000, put_timeout=0.5, shared_queue=False, sweep_interval=30.0,
+                 pool_needed=None):
+        self.bot = bot
+        self.put_timeout = put_timeout
+        self.shared_queue = shared_queue
+        self.sweep_interval = sweep_interval
+        self._accepting = True
+        self._stopped = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._shards = [_Shard(i, queue_size) for i in range(workers)]
+        for shard in self._shards:
+            shard.thread = threading.Thread(target=self._run, args=(shard,), name=f"update-shard-{shard.index}", daemon=True)
+            shard.thread.start()
+        if shared_queue:
+            self._check_pool(workers, pool_needed or 2 * workers + 2)
+            threading.Thread(target=self._sweep, name="update-sweeper", daemon=True).start()
+        logger.info(f"📨 Диспетчер обновлений запущен: шардов {workers}, очередь шарда {queue_size}")
+
+    @staticmethod
+    def _check_pool(workers, needed):
+        pool = get_pool()
+        if pool.maxconn < needed:
+            raise ValueError(
+                f"Пул соединений мал для общей очереди: DB_POOL_MAX={pool.maxconn}, "
+                f"нужно не меньше {needed} (шардов {workers}); увеличьте DB_POOL_MAX или уменьшите WEBHOOK_WORKERS"
+            )
+
+    def _shard_for(self, key):
+        return self._shards[key % len(self._shards)]
+
+    def submit(self, update, payload=None) -> bool:
+        """Ставит обновление в очередь его чата. payload — исходный JSON обновления,
+        нужен для общей очереди (shared_queue). False — очередь переполнена или
+        диспетчер остановлен."""
+        if not self._accepting:
+            return False
+        chat_id = update_chat_id(update)
+        shard = self._shard_for(chat_id if chat_id is not None else update.update_id)
+        if self.shared_queue and chat_id is not None and payload is not None:
+            if shard.queue.full():
+                return self._reject(shard)
+            try:
+                self._store(update.update_id, chat_id, payload)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось записать обновление {update.update_id} в chat_updates: {e}")
+                return False
+            try:
+                shard.queue.put_nowait((time.monotonic(), None, chat_id))
+            except queue.Full:
+                # Обновление уже в chat_updates, его подберёт _sweep
+                logger.warning(f"⚠️ Очередь шарда {shard.index} заполнилась, чат {chat_id} разберёт фоновый поток")
+            return True
+        try:
+            shard.queue.put((time.monotonic(), update, None), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            return self._reject(shard)
+
+    def _reject(self, shard):
+        with self._stats_lock:
+            shard.rejected += 1
+        logger.warning(f"⚠️ Очередь шарда {shard.index} переполнена ({shard.queue.qsize()}), отвечаем 503")
+        return False
+
+    def _store(self, update_id, chat_id, payload):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO chat_updates (update_id, chat_id, payload) VALUES (%s, %s, %s)
+                    ON CONFLICT (update_id) DO NOTHING
+                """, (update_id, chat_id, payload))
+                conn.commit()
+
+    def _take(self, chat_id):
+        """Забирает самое раннее обновление чата из chat_updates; None — очередь пуста"""
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM chat_updates
+                    WHERE update_id = (
+                        SELECT update_id FROM chat_updates WHERE chat_id = %s ORDER BY update_id LIMIT 1
+                    )
+                    RETURNING payload
+                """, (chat_id,))
+                row = cur.fetchone()
+                conn.commit()
+        return telebot.types.Update.de_json(row['payload']) if row else None
+
+    def _has_pending(self, chat_id):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM chat_updates WHERE chat_id = %s LIMIT 1", (chat_id,))
+                return cur.fetchone() is not None
+
+    def _drain(self, shard, chat_id):
+        """Разбирает общую очередь чата, если её не разбирает другой процесс"""
+        while True:
+            with try_advisory_lock(LOCK_CHAT, chat_id) as locked:
+                if not locked:
+                    return
+                while True:
+                    update = self._take(chat_id)
+                    if update is None:
+                        break
+                    self._process(shard, update)
+            # Обновление, записанное пока блокировка была взята, мог не забрать никто
+            if not self._has_pending(chat_id):
+                return
+
+    def _process(self, shard, update):
+        try:
+            self.bot.process_new_updates([update])
+            with self._stats_lock:
+                shard.processed += 1
+        except Exception as e:
+            with self._stats_lock:
+                shard.failed += 1
+            logger.exception(f"Ошибка обработки обновления в шарде {shard.index}: {e}")
+
+    def _sweep(self):
+        """Подбирает чаты, чьи обновления задержались в chat_updates (сбой процесса, переполненный шард)"""
+        while not self._stopped.wait(self.sweep_interval):
+            try:
+                with get_db_connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "SELECT DISTINCT chat_id FROM chat_updates WHERE received_at < NOW() - make_interval(secs => %s)",
+                            (self.sweep_interval,)
+                        )
+                        chat_ids = [row['chat_id'] for row in cur.fetchall()]
+                for chat_id in chat_ids:
+                    try:
+                        self._shard_for(chat_id).queue.put_nowait((time.monotonic(), None, chat_id))
+                    except queue.Full:
+                        pass
+                if chat_ids:
+                    logger.info(f"🧹 Задержавшиеся обновления в chat_updates: чатов {len(chat_ids)}")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось проверить chat_updates: {e}")
+
+    def _run(self, shard):
+        while True:
+            item = shard.queue.get()
+            try:
+                if item is _STOP:
+                    return
+                queued_at, update, chat_id = item
+                with self._stats_lock:
+                    shard.max_wait = max(shard.max_wait, time.monotonic() - queued_at)
+                if update is None:
+                    self._drain(shard, chat_id)
+                else:
+                    self._process(shard, update)
+            except Exception as e:
+                with self._stats_lock:
+                    shard.failed += 1
+                logger.exception(f"Ошибка разбора очереди чата в шарде {shard.index}: {e}")
+            finally:
+                shard.queue.task_done()
+
+    def shutdown(self, timeout=30.0):
+        """Перестаёт принимать обновления и дорабатывает очереди, ожидая не дольше timeout секунд"""
+        if not self._accepting:
+            return
+        self._accepting = False
+        self._stopped.set()
+        queued = sum(shard.queue.qsize() for shard in self._shards)
+        logger.info(f"🛑 Останавливаем диспетчер, в очередях {queued} обновлений")
+        deadline = time.monotonic() + timeout
+        for shard in self._shards:
+            try:
+                shard.queue.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for shard in self._shards:
+            shard.thread.join(max(0.0, deadline - time.monotonic()))
+        alive = sum(1 for shard in self._shards if shard.thread.is_alive())
+        if alive:
+            logger.warning(f"⚠️ Диспетчер остановлен по таймауту, не завершено шардов: {alive}")
+
+    def stats(self):
+        with self._stats_lock:
+            shards = [
+                {
+                    'shard': shard.index,
+                    'queued': shard.queue.qsize(),
+                    'capacity': shard.queue.maxsize,
+                    'processed': shard.processed,
+                    'failed': shard.failed,
+                    'rejected': shard.rejected,
+                    'max_wait': round(shard.max_wait, 3),
+                }
+                for shard in self._shards
+            ]
+        return {
+            'queued': sum(s['queued'] for s in shards),
+            'processed': sum(s['processed'] for s in shards),
+            'failed': sum(s['failed'] for s in shards),
+            'rejected': sum(s['rejected'] for s in shards),
+            'shards': shards,
+        }
@@ -0,0 +1,37 @@
+# gunicorn.conf.py
+"""Запуск в несколько процессов:
+
+    python manage.py migrate
+    WEB_CONCURRENCY=4 gunicorn -c gunicorn.conf.py wsgi:app
+
+Webhook регистрируется один раз, в мастер-процессе до запуска воркеров (и под
+advisory-блокировкой, если одновременно стартует несколько экземпляров). Каждый
+воркер поднимает свой диспетчер, отправитель и outbox; сессии, шаги диалога и
+фильтр повторных обновлений при WEB_CONCURRENCY > 1 хранятся в Postgres
+(см. config.MULTIPROCESS). Обновления чатов проходят через общую очередь
+chat_updates и обрабатываются по порядку; для этого webhook ставится с
+max_connections=1 (WEBHOOK_MAX_CONNECTIONS) — не увеличивайте его при нескольких воркерах. Без gunicorn бот по-прежнему запускается как
+python stock_bot.py в одном процессе.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# Потоки диспетчера и отправителя запускаются при импорте приложения,
+# поэтому приложение грузится в каждом воркере, а не в мастере до fork
+preload_app = False
+# Воркеру даётся время доработать очередь обновлений и outbox (WEBHOOK_DRAIN_TIMEOUT)
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 45))
+timeout = 60
+
+
+def on_starting(server):
+    from database import close_pool
+    from webhook_setup import set_webhook_once
+    try:
+        set_webhook_once()
+    finally:
+        # Соединения мастера не должны достаться воркерам после fork
+        close_pool()
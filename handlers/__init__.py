@@ -6,9 +6,13 @@ from .payments import register_payment_handlers
 from .admin import register_admin_handlers
 from .direct_sale import register_direct_sale_handlers
 from .packing import register_packing_handlers
+from conversation import get_conversation
 
 def register_all_handlers(bot):
-    # Порядок важен! Сначала общие, потом остальные
+    # Порядок важен для message-обработчиков: сначала общие, потом остальные.
+    # Callback-кнопки разбирает router.CallbackRouter, для них порядок не важен.
+    # Ответы на шаги диалога перехватываются раньше всех остальных сообщений.
+    get_conversation(bot)
     register_common_handlers(bot)
     register_edit_handlers(bot)
     register_transfer_handlers(bot)  # Transfer должен быть здесь
@@ -3,23 +3,34 @@ import logging
 from datetime import datetime
 from telebot import types
 from models import (
-    get_seller_by_telegram_id, get_all_products, get_hub_stock,
+    get_seller_by_telegram_id, get_product_names, get_hub_stock,
     get_all_sellers_stock, get_pending_payments, get_payment_request,
-    update_payment_status, get_seller_debt, get_seller_profit,
+    get_seller_debt, get_seller_profit,
     create_purchase, get_purchases_history, get_purchase,
     get_total_payments_stats, HUB_SELLER_ID, get_seller_by_id,
-    get_all_pending_transfer_requests
+    get_all_pending_transfer_requests, get_all_sellers,
+    get_seller_stock_page, get_total_stock_page, STOCK_FILTERS
 )
-from config import ADMIN_ID
+from config import ADMIN_ID, STOCK_PAGE_SIZE
 from keyboards import admin_keyboard
-from notifications import send_negative_stock_warning
+from notifications import (
+    send_negative_stock_warning, format_stock_lines, stock_page_markup, edit_stock_page, confirm_payment
+)
 from database import get_db_connection
+from sender import get_sender, PRIORITY_LOW
+from sessions import session_store, PurchaseSession
+from router import get_router
+from conversation import get_conversation
 
 logger = logging.getLogger(__name__)
 
-purchase_sessions = {}
+purchase_sessions = session_store('purchase', PurchaseSession)
 
 def register_admin_handlers(bot):
+    sender = get_sender(bot)
+    router = get_router(bot)
+    conversation = get_conversation(bot)
+
     def is_admin(user_id):
         return user_id == ADMIN_ID
 
@@ -56,13 +67,14 @@ def register_admin_handlers(bot):
                 types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"admin_pay_confirm_{p['id']}"),
                 types.InlineKeyboardButton("✏️ Изменить", callback_data=f"admin_pay_edit_{p['id']}")
             )
-            bot.send_message(
+            sender.submit(
                 message.chat.id,
                 f"💸 *Запрос на выплату*\n\n"
                 f"Продавец: {p['seller_name']}\n"
                 f"Сумма: {p['amount']} руб.\n"
                 f"Дата: {date_str}\n\n"
                 f"Действие:",
+                priority=PRIORITY_LOW,
                 parse_mode='Markdown',
                 reply_markup=markup
             )
@@ -78,24 +90,29 @@ def register_admin_handlers(bot):
                 types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"transfer_approve_{req['id']}"),
                 types.InlineKeyboardButton("❌ Отклонить", callback_data=f"transfer_reject_{req['id']}")
             )
-            bot.send_message(
+            sender.submit(
                 message.chat.id,
                 f"📦 *Заявка на перемещение №{req['id']}*\n"
                 f"От: {req['from_seller_name']}\n"
                 f"Кому: {req['to_seller_name']}\n\n"
                 f"{items_text}",
+                priority=PRIORITY_LOW,
                 parse_mode='Markdown',
                 reply_markup=markup
             )
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('admin_pay_confirm_') and is_admin(call.from_user.id))
-    def admin_pay_confirm(call):
-        payment_id = int(call.data.split('_')[3])
+    @router.route('admin_pay_confirm_{payment_id:int}', guard=is_admin)
+    def admin_pay_confirm(call, payment_id):
         payment = get_payment_request(payment_id)
         if not payment or payment['status'] != 'pending':
             bot.answer_callback_query(call.id, "❌ Заявка уже обработана или не найдена")
             return
-        update_payment_status(payment_id, 'confirmed', confirmed_amount=payment['amount'])
+        try:
+            confirm_payment(bot, payment, payment['amount'])
+        except Exception as e:
+            logger.error(f"Ошибка при подтверждении выплаты: {e}")
+            bot.answer_callback_query(call.id, "❌ Ошибка базы данных", show_alert=True)
+            return
         bot.edit_message_text(
             f"✅ Выплата {payment['amount']} руб. подтверждена.",
             call.message.chat.id,
@@ -103,9 +120,8 @@ def register_admin_handlers(bot):
         )
         bot.answer_callback_query(call.id, "✅ Подтверждено")
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('admin_pay_edit_') and is_admin(call.from_user.id))
-    def admin_pay_edit(call):
-        payment_id = int(call.data.split('_')[3])
+    @router.route('admin_pay_edit_{payment_id:int}', guard=is_admin)
+    def admin_pay_edit(call, payment_id):
         payment = get_payment_request(payment_id)
         if not payment or payment['status'] != 'pending':
             bot.answer_callback_query(call.id, "❌ Заявка уже обработана или не найдена")
@@ -115,9 +131,10 @@ def register_admin_handlers(bot):
             call.message.chat.id,
             call.message.message_id
         )
-        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_admin_pay_edit, payment_id, call.message.chat.id)
+        conversation.expect(call.message.chat.id, 'admin_pay_edit', payment_id, call.message.chat.id)
         bot.answer_callback_query(call.id)
 
+    @conversation.step('admin_pay_edit')
     def process_admin_pay_edit(message, payment_id, original_chat_id):
         try:
             amount = int(message.text.strip())
@@ -130,29 +147,17 @@ def register_admin_handlers(bot):
         if not payment or payment['status'] != 'pending':
             bot.reply_to(message, "❌ Заявка уже обработана или не найдена")
             return
-        update_payment_status(payment_id, 'confirmed', confirmed_amount=amount)
-        seller = get_seller_by_id(payment['seller_id'])
-        debt, _, _, _ = get_seller_debt(payment['seller_id'])
         try:
-            bot.send_message(
-                seller['telegram_id'],
-                f"✅ Админ подтвердил получение *{amount} руб.*\n"
-                f"Ваш долг составляет *{debt} руб.*",
-                parse_mode='Markdown'
-            )
+            confirm_payment(bot, payment, amount)
         except Exception as e:
-            logger.error(f"Ошибка уведомления продавца: {e}")
+            logger.error(f"Ошибка при подтверждении выплаты: {e}")
+            bot.reply_to(message, "❌ Ошибка базы данных")
+            return
         bot.reply_to(message, f"✅ Вы подтвердили получение {amount} руб. от продавца.")
 
     @bot.message_handler(func=lambda m: m.text == "📦 Остатки" and is_admin(m.from_user.id))
     def handle_admin_stock(message):
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, name FROM sellers 
-                    ORDER BY name
-                """)
-                sellers = cur.fetchall()
+        sellers = get_all_sellers()
         if not sellers:
             bot.send_message(message.chat.id, "❌ Нет продавцов.")
             return
@@ -167,40 +172,32 @@ def register_admin_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('stock_seller_') and is_admin(call.from_user.id))
-    def stock_seller(call):
-        seller_id = int(call.data.split('_')[2])
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT name FROM sellers WHERE id = %s", (seller_id,))
-                seller_row = cur.fetchone()
-                seller_name = seller_row['name'] if seller_row else "Продавец"
-        from models import get_seller_stock
-        stocks = get_seller_stock(seller_id)
-        if not stocks:
-            bot.edit_message_text(
-                f"📦 У продавца {seller_name} нет товаров в каталоге.",
-                call.message.chat.id,
-                call.message.message_id
-            )
+    def seller_stock_page(seller_id, only, after):
+        seller_row = get_seller_by_id(seller_id)
+        seller_name = seller_row['name'] if seller_row else "Продавец"
+        rows, next_after = get_seller_stock_page(seller_id, after_variant_id=after, limit=STOCK_PAGE_SIZE, only=only)
+        if rows:
+            text = f"📦 *Остатки продавца {seller_name}:*\n\n" + format_stock_lines(rows)
+        elif only == 'all' and not after:
+            text = f"📦 У продавца {seller_name} нет товаров в каталоге."
+        else:
+            text = f"📦 У продавца {seller_name} нет позиций по выбранному фильтру."
+        return text, stock_page_markup(f"stockpg_{seller_id}", only, next_after, first_page=not after)
+
+    @router.route('stock_seller_{seller_id:int}', guard=is_admin)
+    def stock_seller(call, seller_id):
+        text, markup = seller_stock_page(seller_id, 'all', 0)
+        edit_stock_page(bot, call, text, markup)
+
+    @router.route('stockpg_{seller_id:int}_{only}_{after:int}', guard=is_admin)
+    def stock_seller_page(call, seller_id, only, after):
+        if only not in STOCK_FILTERS:
+            bot.answer_callback_query(call.id, "❌ Ошибка данных")
             return
-        lines = []
-        for row in stocks:
-            if row['quantity'] > 0:
-                lines.append(f"• {row['product_name']} ({row['variant_name']}): {row['quantity']} шт")
-            elif row['quantity'] < 0:
-                lines.append(f"• {row['product_name']} ({row['variant_name']}): {row['quantity']} шт (❗ минус)")
-            else:
-                lines.append(f"• {row['product_name']} ({row['variant_name']}): 0 шт")
-        bot.edit_message_text(
-            f"📦 *Остатки продавца {seller_name}:*\n\n" + "\n".join(lines),
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode='Markdown'
-        )
-        bot.answer_callback_query(call.id)
+        text, markup = seller_stock_page(seller_id, only, after)
+        edit_stock_page(bot, call, text, markup)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "stock_hub" and is_admin(call.from_user.id))
+    @router.route('stock_hub', guard=is_admin)
     def stock_hub(call):
         hub_stocks = get_hub_stock()
         if not hub_stocks:
@@ -221,59 +218,36 @@ def register_admin_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "stock_all" and is_admin(call.from_user.id))
-    def stock_all(call):
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT v.id, v.name as variant_name, p.id as product_id, p.name as product_name
-                    FROM product_variants v
-                    JOIN products p ON v.product_id = p.id
-                    WHERE v.name != 'Россыпь'
-                    ORDER BY p.name, v.sort_order
-                """)
-                all_variants = cur.fetchall()
-                cur.execute("""
-                    SELECT variant_id, SUM(quantity) as total
-                    FROM seller_stock
-                    GROUP BY variant_id
-                """)
-                totals = {row['variant_id']: row['total'] for row in cur.fetchall()}
+    def total_stock_page(only, after):
+        rows, next_after = get_total_stock_page(after_variant_id=after, limit=STOCK_PAGE_SIZE, only=only)
+        if rows:
+            text = "📊 *Общие остатки по всем продавцам:*\n\n" + format_stock_lines(rows)
+        else:
+            text = "📊 Нет позиций по выбранному фильтру."
+        return text, stock_page_markup("stockall", only, next_after, first_page=not after)
 
-        lines = []
-        for v in all_variants:
-            qty = totals.get(v['id'], 0)
-            if qty > 0:
-                lines.append(f"• {v['product_name']} ({v['variant_name']}): {qty} шт")
-            elif qty < 0:
-                lines.append(f"• {v['product_name']} ({v['variant_name']}): {qty} шт (❗ минус)")
-            else:
-                lines.append(f"• {v['product_name']} ({v['variant_name']}): 0 шт")
+    @router.route('stock_all', guard=is_admin)
+    def stock_all(call):
+        text, markup = total_stock_page('all', 0)
+        edit_stock_page(bot, call, text, markup)
 
-        bot.edit_message_text(
-            "📊 *Общие остатки по всем продавцам:*\n\n" + "\n".join(lines),
-            call.message.chat.id,
-            call.message.message_id,
-            parse_mode='Markdown'
-        )
-        bot.answer_callback_query(call.id)
+    @router.route('stockall_{only}_{after:int}', guard=is_admin)
+    def stock_all_page(call, only, after):
+        if only not in STOCK_FILTERS:
+            bot.answer_callback_query(call.id, "❌ Ошибка данных")
+            return
+        text, markup = total_stock_page(only, after)
+        edit_stock_page(bot, call, text, markup)
 
     @bot.message_handler(func=lambda m: m.text == "💰 Выплаты" and is_admin(m.from_user.id))
     def handle_payments_stats(message):
         logger.info("Вызван handle_payments_stats")
         try:
-            total_paid, total_debt = get_total_payments_stats()
+            total_paid, total_debt, breakdown = get_total_payments_stats()
         except Exception as e:
             logger.error(f"Ошибка в handle_payments_stats: {e}")
             bot.send_message(message.chat.id, "❌ Ошибка при загрузке статистики.")
             return
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("""
-                    SELECT id, name FROM sellers 
-                    ORDER BY name
-                """)
-                sellers = cur.fetchall()
         msg = (
             f"💰 *Финансовая сводка*\n\n"
             f"Всего выплачено продавцами: *{total_paid} руб.*\n"
@@ -281,18 +255,17 @@ def register_admin_handlers(bot):
             f"*Детали по продавцам:*"
         )
         markup = types.InlineKeyboardMarkup(row_width=2)
-        for s in sellers:
-            markup.add(types.InlineKeyboardButton(s['name'], callback_data=f"payments_seller_{s['id']}"))
+        for row in breakdown:
+            markup.add(types.InlineKeyboardButton(row['name'], callback_data=f"payments_seller_{row['seller_id']}"))
         bot.send_message(message.chat.id, msg, parse_mode='Markdown', reply_markup=markup)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('payments_seller_') and is_admin(call.from_user.id))
-    def payments_seller(call):
-        seller_id = int(call.data.split('_')[2])
+    @router.route('payments_seller_{seller_id:int}', guard=is_admin)
+    def payments_seller(call, seller_id):
         debt, total_sales, total_paid, total_direct = get_seller_debt(seller_id)
         profit, total_buyer, total_seller = get_seller_profit(seller_id)
-        seller = get_seller_by_id(seller_id)
+        seller_name = get_seller_by_id(seller_id)['name']
         msg = (
-            f"💰 *Продавец {seller['name']}*\n\n"
+            f"💰 *Продавец {seller_name}*\n\n"
             f"Долг перед админом: *{debt} руб.*\n"
             f"Выплачено админу: *{total_paid} руб.*\n"
             f"________________________________\n"
@@ -321,7 +294,7 @@ def register_admin_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data == "purchase_history" and is_admin(call.from_user.id))
+    @router.route('purchase_history', guard=is_admin)
     def purchase_history(call):
         user_id = call.from_user.id
         logger.info(f"📜 Вызвана история закупок пользователем {user_id}")
@@ -363,16 +336,10 @@ def register_admin_handlers(bot):
             )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('purchase_view_') and is_admin(call.from_user.id))
-    def purchase_view(call):
+    @router.route('purchase_view_{purchase_id:int}', guard=is_admin)
+    def purchase_view(call, purchase_id):
         logger.info(f"✅ Вызван purchase_view с data={call.data}")
         try:
-            parts = call.data.split('_')
-            if len(parts) < 3:
-                logger.error(f"Неверный формат callback: {call.data}")
-                bot.answer_callback_query(call.id, "❌ Ошибка данных")
-                return
-            purchase_id = int(parts[2])
             purchase = get_purchase(purchase_id)
             if not purchase:
                 logger.error(f"Закупка {purchase_id} не найдена")
@@ -397,7 +364,7 @@ def register_admin_handlers(bot):
             logger.error(f"Ошибка в purchase_view: {e}")
             bot.answer_callback_query(call.id, "❌ Внутренняя ошибка")
 
-    @bot.callback_query_handler(func=lambda call: call.data == "purchase_new" and is_admin(call.from_user.id))
+    @router.route('purchase_new', guard=is_admin)
     def purchase_new(call):
         user_id = call.from_user.id
         if user_id in purchase_sessions:
@@ -413,31 +380,23 @@ def register_admin_handlers(bot):
                 reply_markup=markup
             )
             return
-        purchase_sessions[user_id] = {
-            'items': [],
-            'message_id': call.message.message_id,
-            'chat_id': call.message.chat.id
-        }
+        purchase_sessions.start(user_id, message_id=call.message.message_id, chat_id=call.message.chat.id)
         show_product_list_for_purchase(user_id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "purchase_force_new" and is_admin(call.from_user.id))
+    @router.route('purchase_force_new', guard=is_admin)
     def purchase_force_new(call):
         user_id = call.from_user.id
-        purchase_sessions[user_id] = {
-            'items': [],
-            'message_id': call.message.message_id,
-            'chat_id': call.message.chat.id
-        }
+        purchase_sessions.start(user_id, message_id=call.message.message_id, chat_id=call.message.chat.id)
         show_product_list_for_purchase(user_id)
 
     def show_product_list_for_purchase(user_id):
         session = purchase_sessions.get(user_id)
         if not session:
             return
-        products = get_all_products()
+        products = get_product_names()
         markup = types.InlineKeyboardMarkup(row_width=2)
-        for p in products:
-            markup.add(types.InlineKeyboardButton(p['name'], callback_data=f"purchase_prod_{p['id']}"))
+        for product_id, name in products.items():
+            markup.add(types.InlineKeyboardButton(name, callback_data=f"purchase_prod_{product_id}"))
         markup.add(types.InlineKeyboardButton("🔙 Отмена", callback_data="purchase_abort"))
         bot.edit_message_text(
             "🛒 *Закупка товаров (в кг)*\n\nВыберите товар:",
@@ -447,10 +406,9 @@ def register_admin_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('purchase_prod_') and is_admin(call.from_user.id))
-    def purchase_select_product(call):
+    @router.route('purchase_prod_{product_id:int}', guard=is_admin)
+    def purchase_select_product(call, product_id):
         user_id = call.from_user.id
-        product_id = int(call.data.split('_')[2])
         session = purchase_sessions.get(user_id)
         if not session:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
@@ -471,6 +429,7 @@ def register_admin_handlers(bot):
             return
 
         session['purchase_price'] = purchase_price
+        purchase_sessions.save(user_id, session)
 
         bot.edit_message_text(
             f"Введите количество килограммов для *{product['name']}* (цена за кг: {purchase_price} руб.):",
@@ -478,9 +437,10 @@ def register_admin_handlers(bot):
             call.message.message_id,
             parse_mode='Markdown'
         )
-        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_purchase_quantity, user_id, product_id)
+        conversation.expect(call.message.chat.id, 'purchase_quantity', user_id, product_id)
         bot.answer_callback_query(call.id)
 
+    @conversation.step('purchase_quantity')
     def process_purchase_quantity(message, user_id, product_id):
         session = purchase_sessions.get(user_id)
         if not session:
@@ -506,6 +466,7 @@ def register_admin_handlers(bot):
             'quantity_kg': qty_kg,
             'price_per_kg': price_per_kg
         })
+        purchase_sessions.save(user_id, session)
         logger.info(f"✅ Добавлен товар {product_id} в закупку: {qty_kg} кг по {price_per_kg} руб.")
         show_purchase_summary(user_id)
 
@@ -513,8 +474,7 @@ def register_admin_handlers(bot):
         session = purchase_sessions.get(user_id)
         if not session:
             return
-        products = get_all_products()
-        product_dict = {p['id']: p['name'] for p in products}
+        product_dict = get_product_names()
         total = sum(item['quantity_kg'] * item['price_per_kg'] for item in session['items'])
         lines = []
         for item in session['items']:
@@ -534,17 +494,17 @@ def register_admin_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data == "purchase_add_item" and is_admin(call.from_user.id))
+    @router.route('purchase_add_item', guard=is_admin)
     def purchase_add_item(call):
         user_id = call.from_user.id
         session = purchase_sessions.get(user_id)
         if not session:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
             return
-        products = get_all_products()
+        products = get_product_names()
         markup = types.InlineKeyboardMarkup(row_width=2)
-        for p in products:
-            markup.add(types.InlineKeyboardButton(p['name'], callback_data=f"purchase_prod_{p['id']}"))
+        for product_id, name in products.items():
+            markup.add(types.InlineKeyboardButton(name, callback_data=f"purchase_prod_{product_id}"))
         markup.add(types.InlineKeyboardButton("🔙 Назад к сводке", callback_data="purchase_show_summary"))
         bot.edit_message_text(
             "🛒 *Добавление товара*\n\nВыберите товар:",
@@ -555,13 +515,13 @@ def register_admin_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "purchase_show_summary" and is_admin(call.from_user.id))
+    @router.route('purchase_show_summary', guard=is_admin)
     def purchase_show_summary(call):
         user_id = call.from_user.id
         show_purchase_summary(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "purchase_finish" and is_admin(call.from_user.id))
+    @router.route('purchase_finish', guard=is_admin)
     def purchase_finish(call):
         user_id = call.from_user.id
         session = purchase_sessions.pop(user_id, None)
@@ -585,7 +545,7 @@ def register_admin_handlers(bot):
         )
         bot.answer_callback_query(call.id, "✅ Закупка завершена")
 
-    @bot.callback_query_handler(func=lambda call: call.data == "purchase_abort" and is_admin(call.from_user.id))
+    @router.route('purchase_abort', guard=is_admin)
     def purchase_abort(call):
         user_id = call.from_user.id
         purchase_sessions.pop(user_id, None)
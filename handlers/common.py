@@ -2,18 +2,25 @@
 import logging
 from telebot import types
 from models import (
-    get_seller_by_telegram_id, get_order_by_number, get_all_products,
-    get_seller_stock, decrease_seller_stock, mark_order_as_processed,
-    get_negative_stock_summary, get_hub_stock, get_pending_transfer_requests_for_hub
+    get_seller_by_telegram_id, get_seller_stock_page, STOCK_FILTERS,
+    get_hub_stock, get_pending_transfer_requests_for_hub
 )
 from keyboards import main_keyboard, admin_keyboard
-from notifications import send_negative_stock_warning
-from config import ADMIN_ID, HUB_SELLER_ID
+from notifications import (
+    format_order_items, order_actions_markup,
+    format_stock_lines, stock_page_markup, edit_stock_page
+)
+from config import ADMIN_ID, HUB_SELLER_ID, STOCK_PAGE_SIZE
 from database import get_db_connection
+from sender import get_sender, PRIORITY_LOW
+from router import get_router
 
 logger = logging.getLogger(__name__)
 
 def register_common_handlers(bot):
+    sender = get_sender(bot)
+    router = get_router(bot)
+
     @bot.message_handler(commands=['start'])
     def handle_start(message):
         user_id = message.from_user.id
@@ -36,28 +43,38 @@ def register_common_handlers(bot):
         if not seller:
             bot.reply_to(message, "❌ У вас нет доступа к этому боту.")
             return
-        stocks = get_seller_stock(seller['id'])
-        if not stocks:
+        text, markup = own_stock_page(seller, 'all', 0)
+        bot.send_message(message.chat.id, text, parse_mode='Markdown', reply_markup=markup)
+
+    def own_stock_page(seller, only, after):
+        """Одна страница остатков продавца: текст и кнопки листания"""
+        rows, next_after = get_seller_stock_page(
+            seller['id'], after_variant_id=after, limit=STOCK_PAGE_SIZE, only=only
+        )
+        if rows:
+            text = "📦 *Ваши остатки:*\n" + format_stock_lines(rows)
+        elif only == 'all' and not after:
             text = "📦 У вас нет товаров на складе."
         else:
-            lines = []
-            for row in stocks:
-                if row['quantity'] > 0:
-                    lines.append(f"• {row['product_name']} ({row['variant_name']}): {row['quantity']} шт")
-                elif row['quantity'] < 0:
-                    lines.append(f"• {row['product_name']} ({row['variant_name']}): {row['quantity']} шт (❗ минус)")
-                else:
-                    lines.append(f"• {row['product_name']} ({row['variant_name']}): 0 шт")
-            text = "📦 *Ваши остатки:*\n" + "\n".join(lines)
-
-        markup = None
+            text = "📦 Нет позиций по выбранному фильтру."
+        markup = stock_page_markup('mystock', only, next_after, first_page=not after)
         if seller['id'] == HUB_SELLER_ID:
-            markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("📦 Остатки хаба (кг)", callback_data="show_hub_stock"))
+        return text, markup
 
-        bot.send_message(message.chat.id, text, parse_mode='Markdown', reply_markup=markup)
+    @router.route('mystock_{only}_{after:int}')
+    def my_stock_page(call, only, after):
+        seller = get_seller_by_telegram_id(call.from_user.id)
+        if not seller:
+            bot.answer_callback_query(call.id, "❌ У вас нет доступа к этому боту.")
+            return
+        if only not in STOCK_FILTERS:
+            bot.answer_callback_query(call.id, "❌ Ошибка данных")
+            return
+        text, markup = own_stock_page(seller, only, after)
+        edit_stock_page(bot, call, text, markup)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "show_hub_stock")
+    @router.route('show_hub_stock')
     def show_hub_stock_callback(call):
         user_id = call.from_user.id
         seller = get_seller_by_telegram_id(user_id)
@@ -105,24 +122,12 @@ def register_common_handlers(bot):
 
         for order in pending_orders:
             order_number = order['order_number']
-            items = order['items']
-            items_text_lines = []
-            for item in items:
-                if item.get('variantName'):
-                    items_text_lines.append(f"• {item['name']} ({item['variantName']}): {item['quantity']} шт")
-                else:
-                    items_text_lines.append(f"• {item['name']}: {item['quantity']} шт")
-            items_text = "\n".join(items_text_lines)
-            markup = types.InlineKeyboardMarkup()
-            markup.row(
-                types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_{order_number}"),
-                types.InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_{order_number}")
-            )
-            bot.send_message(
+            sender.submit(
                 message.chat.id,
-                f"📦 *Заказ {order_number}*\n\n{items_text}",
+                f"📦 *Заказ {order_number}*\n\n{format_order_items(order['items'])}",
+                priority=PRIORITY_LOW,
                 parse_mode='Markdown',
-                reply_markup=markup
+                reply_markup=order_actions_markup(order_number)
             )
 
         for transfer in pending_transfers:
@@ -137,9 +142,10 @@ def register_common_handlers(bot):
                 types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"transfer_approve_{transfer_id}"),
                 types.InlineKeyboardButton("❌ Отклонить", callback_data=f"transfer_reject_{transfer_id}")
             )
-            bot.send_message(
+            sender.submit(
                 message.chat.id,
                 f"📦 *Заявка на перемещение №{transfer_id}*\n\n{items_text}",
+                priority=PRIORITY_LOW,
                 parse_mode='Markdown',
                 reply_markup=markup
             )
@@ -2,17 +2,23 @@
 import logging
 from telebot import types
 from models import (
-    get_seller_by_telegram_id, get_all_products, get_product_variants,
-    get_seller_stock, decrease_seller_stock, create_direct_sale,
+    get_seller_by_telegram_id, get_product_names, get_product_variants,
+    get_seller_stock, apply_stock_deltas, create_direct_sale,
     get_negative_stock_summary, get_variant
 )
+from database import transaction
 from notifications import send_negative_stock_warning
+from sessions import session_store, CartSession
+from router import get_router
+from conversation import get_conversation
 
 logger = logging.getLogger(__name__)
 
-direct_sale_sessions = {}
+direct_sale_sessions = session_store('direct_sale', CartSession)
 
 def register_direct_sale_handlers(bot):
+    router = get_router(bot)
+    conversation = get_conversation(bot)
     @bot.message_handler(func=lambda m: m.text == "➕ Зафиксировать продажу")
     def handle_direct_sale(message):
         user_id = message.from_user.id
@@ -20,21 +26,18 @@ def register_direct_sale_handlers(bot):
         if not seller:
             bot.reply_to(message, "❌ У вас нет доступа.")
             return
-        direct_sale_sessions[user_id] = {
-            'seller_id': seller['id'],
-            'items': {},  # ключ variant_id -> {variant_id, product_id, variant_name, product_name, quantity, price, price_seller}
-            'chat_id': message.chat.id
-        }
+        # items: variant_id -> {variant_id, product_id, variant_name, product_name, quantity, price, price_seller}
+        direct_sale_sessions.start(user_id, seller_id=seller['id'], chat_id=message.chat.id)
         show_product_list(user_id)
 
     def show_product_list(user_id):
         session = direct_sale_sessions.get(user_id)
         if not session:
             return
-        products = get_all_products()
+        products = get_product_names()
         markup = types.InlineKeyboardMarkup(row_width=2)
-        for p in products:
-            markup.add(types.InlineKeyboardButton(p['name'], callback_data=f"ds_prod_{p['id']}"))
+        for product_id, name in products.items():
+            markup.add(types.InlineKeyboardButton(name, callback_data=f"ds_prod_{product_id}"))
         markup.add(types.InlineKeyboardButton("✅ Завершить", callback_data="ds_finish"))
         bot.send_message(
             session['chat_id'],
@@ -43,10 +46,9 @@ def register_direct_sale_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('ds_prod_'))
-    def select_product(call):
+    @router.route('ds_prod_{product_id:int}')
+    def select_product(call, product_id):
         user_id = call.from_user.id
-        product_id = int(call.data.split('_')[2])
         session = direct_sale_sessions.get(user_id)
         if not session:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
@@ -59,9 +61,9 @@ def register_direct_sale_handlers(bot):
             return
 
         # Сохраняем название товара в сессии
-        products = get_all_products()
-        product_name = next((p['name'] for p in products if p['id'] == product_id), "Товар")
+        product_name = get_product_names().get(product_id, "Товар")
         session['product_name'] = product_name
+        direct_sale_sessions.save(user_id, session)
 
         # Показываем кнопки выбора варианта
         markup = types.InlineKeyboardMarkup(row_width=2)
@@ -80,12 +82,9 @@ def register_direct_sale_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('ds_var_'))
-    def select_variant(call):
+    @router.route('ds_var_{product_id:int}_{variant_id:int}')
+    def select_variant(call, product_id, variant_id):
         user_id = call.from_user.id
-        parts = call.data.split('_')
-        product_id = int(parts[2])
-        variant_id = int(parts[3])
         session = direct_sale_sessions.get(user_id)
         if not session:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
@@ -100,6 +99,7 @@ def register_direct_sale_handlers(bot):
         session['current_variant'] = variant_id
         session['variant_name'] = variant_name
         session['product_name'] = product_name
+        direct_sale_sessions.save(user_id, session)
         
         bot.edit_message_text(
             f"Введите количество для *{product_name} ({variant_name})*:",
@@ -107,9 +107,10 @@ def register_direct_sale_handlers(bot):
             call.message.message_id,
             parse_mode='Markdown'
         )
-        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_quantity, user_id)
+        conversation.expect(call.message.chat.id, 'direct_sale_quantity', user_id)
         bot.answer_callback_query(call.id)
 
+    @conversation.step('direct_sale_quantity')
     def process_quantity(message, user_id):
         session = direct_sale_sessions.get(user_id)
         if not session:
@@ -149,6 +150,7 @@ def register_direct_sale_handlers(bot):
             'price': variant['price'],
             'price_seller': variant['price_seller']
         }
+        direct_sale_sessions.save(user_id, session)
         logger.info(f"✅ Позиция для варианта {variant_id} установлена: {qty} шт")
 
         # Показываем сводку после добавления
@@ -185,7 +187,7 @@ def register_direct_sale_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data == "ds_add")
+    @router.route('ds_add')
     def add_item(call):
         user_id = call.from_user.id
         # Удаляем сообщение с предыдущей сводкой
@@ -193,14 +195,14 @@ def register_direct_sale_handlers(bot):
         show_product_list(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "ds_back_to_products")
+    @router.route('ds_back_to_products')
     def back_to_products(call):
         user_id = call.from_user.id
         bot.delete_message(call.message.chat.id, call.message.message_id)
         show_product_list(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "ds_cancel")
+    @router.route('ds_cancel')
     def cancel(call):
         user_id = call.from_user.id
         direct_sale_sessions.pop(user_id, None)
@@ -211,7 +213,7 @@ def register_direct_sale_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "ds_confirm_sale")
+    @router.route('ds_confirm_sale')
     def confirm_sale(call):
         user_id = call.from_user.id
         session = direct_sale_sessions.pop(user_id, None)
@@ -225,28 +227,19 @@ def register_direct_sale_handlers(bot):
         seller_id = session['seller_id']
         total_buyer = sum(i['quantity'] * i['price'] for i in items)
 
+        # Списание и запись продажи — одной транзакцией
         try:
-            # Списываем товары со склада
-            for item in items:
-                decrease_seller_stock(
-                    seller_id=seller_id,
-                    variant_id=item['variant_id'],
-                    quantity=item['quantity'],
-                    reason='sale',
-                    order_id=None
+            with transaction():
+                apply_stock_deltas(
+                    seller_id,
+                    [(item['variant_id'], -item['quantity']) for item in items],
+                    reason='sale'
                 )
-                logger.info(f"✅ Списано {item['quantity']} ед. variant {item['variant_id']}")
-        except Exception as e:
-            logger.exception(f"Ошибка при списании: {e}")
-            bot.answer_callback_query(call.id, "❌ Ошибка при списании товаров", show_alert=True)
-            return
-
-        try:
-            sale_id = create_direct_sale(seller_id, items, total_buyer)
+                sale_id = create_direct_sale(seller_id, items, total_buyer)
             logger.info(f"✅ Продажа №{sale_id} сохранена")
         except Exception as e:
             logger.exception(f"Ошибка при сохранении продажи: {e}")
-            bot.answer_callback_query(call.id, "❌ Ошибка базы данных", show_alert=True)
+            bot.answer_callback_query(call.id, "❌ Ошибка при списании товаров", show_alert=True)
             return
 
         bot.edit_message_text(
@@ -261,7 +254,7 @@ def register_direct_sale_handlers(bot):
 
         bot.answer_callback_query(call.id, "✅ Продажа подтверждена")
 
-    @bot.callback_query_handler(func=lambda call: call.data == "ds_finish")
+    @router.route('ds_finish')
     def finish(call):
         user_id = call.from_user.id
         # Если нажали "Завершить" без товаров – просто выходим
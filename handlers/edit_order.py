@@ -2,21 +2,26 @@ import logging
 import json  # <-- Добавлен недостающий импорт
 from telebot import types
 from models import (
-    get_order_by_number, get_seller_by_telegram_id, get_all_products,
-    get_product_variants, decrease_seller_stock, mark_order_as_processed,
+    get_order_by_number, get_seller_by_telegram_id, get_product_names,
+    get_product_variants, apply_stock_deltas, mark_order_as_processed,
     get_negative_stock_summary, get_variant, update_order_total, get_db_connection
 )
+from database import transaction
 from notifications import send_negative_stock_warning
+from sessions import session_store, EditSession
+from router import get_router
+from conversation import get_conversation
 
 logger = logging.getLogger(__name__)
 
-edit_sessions = {}
+edit_sessions = session_store('edit_order', EditSession)
 
 def register_edit_handlers(bot):
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('confirm_'))
-    def handle_confirm(call):
+    router = get_router(bot)
+    conversation = get_conversation(bot)
+    @router.route('confirm_{order_num}')
+    def handle_confirm(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         logger.info(f"✅ Нажата кнопка подтверждения заказа {order_num}")
 
         order = get_order_by_number(order_num)
@@ -35,21 +40,30 @@ def register_edit_handlers(bot):
             return
 
         # Сумма не меняется, используем исходную
-        for item in order['items']:
-            variant_id = item.get('variantId')
-            if not variant_id:
-                logger.error(f"В заказе {order_num} отсутствует variantId")
-                bot.answer_callback_query(call.id, "❌ Ошибка данных заказа")
-                return
-            decrease_seller_stock(
-                seller_id=seller['id'],
-                variant_id=variant_id,
-                quantity=item['quantity'],
-                reason='sale',
-                order_id=order['id']
-            )
-
-        mark_order_as_processed(order['id'])
+        if any(not item.get('variantId') for item in order['items']):
+            logger.error(f"В заказе {order_num} отсутствует variantId")
+            bot.answer_callback_query(call.id, "❌ Ошибка данных заказа")
+            return
+        # Отметка о проведении и списание — одной транзакцией; отметка первой,
+        # чтобы повторное или параллельное подтверждение не списало остатки дважды
+        try:
+            with transaction():
+                processed = mark_order_as_processed(order['id'])
+                if processed:
+                    apply_stock_deltas(
+                        seller['id'],
+                        [(item['variantId'], -int(item['quantity'])) for item in order['items'] if int(item['quantity']) > 0],
+                        reason='sale',
+                        order_id=order['id']
+                    )
+        except ValueError as e:
+            # Позиции заказа не разобраны (line_item_errors): проводить нельзя, иначе долг не посчитается
+            logger.error(f"Заказ {order_num} не проведён: {e}")
+            bot.answer_callback_query(call.id, "❌ Ошибка данных заказа, сообщите администратору", show_alert=True)
+            return
+        if not processed:
+            bot.answer_callback_query(call.id, "✅ Заказ уже обработан")
+            return
         bot.answer_callback_query(call.id, "✅ Продажа зафиксирована")
         bot.edit_message_text(
             f"✅ Заказ {order_num} проведён.",
@@ -61,10 +75,9 @@ def register_edit_handlers(bot):
         if negatives:
             send_negative_stock_warning(bot, call.message.chat.id, seller['id'])
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('edit_'))
-    def handle_edit(call):
+    @router.route('edit_{order_num}')
+    def handle_edit(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         logger.info(f"✏️ Нажата кнопка редактирования заказа {order_num}")
 
         order = get_order_by_number(order_num)
@@ -81,19 +94,19 @@ def register_edit_handlers(bot):
             bot.answer_callback_query(call.id, "✅ Заказ уже обработан")
             return
 
-        products = get_all_products()
+        products = get_product_names()
         if not products:
             bot.answer_callback_query(call.id, "❌ Нет товаров в каталоге")
             return
 
-        edit_sessions[user_id] = {
-            'order_number': order_num,
-            'seller_id': seller['id'],
-            'order_id': order['id'],
-            'selected_items': {},  # ключ (product_id, variant_id) -> количество
-            'message_id': call.message.message_id,
-            'chat_id': call.message.chat.id
-        }
+        edit_sessions.start(
+            user_id,
+            order_number=order_num,
+            seller_id=seller['id'],
+            order_id=order['id'],
+            message_id=call.message.message_id,
+            chat_id=call.message.chat.id
+        )
         logger.info(f"✅ Сессия редактирования создана для заказа {order_num}")
 
         show_product_selection(user_id)
@@ -103,8 +116,7 @@ def register_edit_handlers(bot):
         if not session:
             return
 
-        products = get_all_products()
-        product_dict = {p['id']: p['name'] for p in products}
+        product_dict = get_product_names()
 
         selected_lines = []
         for (pid, vid), qty in session['selected_items'].items():
@@ -118,10 +130,10 @@ def register_edit_handlers(bot):
 
         markup = types.InlineKeyboardMarkup(row_width=2)
         buttons = []
-        for p in products:
+        for product_id, name in product_dict.items():
             buttons.append(types.InlineKeyboardButton(
-                p['name'],
-                callback_data=f"selprod_{session['order_number']}_{p['id']}"
+                name,
+                callback_data=f"selprod_{session['order_number']}_{product_id}"
             ))
         markup.add(*buttons)
         markup.row(types.InlineKeyboardButton("✅ Завершить", callback_data=f"finish_{session['order_number']}"))
@@ -140,12 +152,9 @@ def register_edit_handlers(bot):
         )
         logger.info(f"Показано меню выбора товара для заказа {session['order_number']}")
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('selprod_'))
-    def select_product(call):
+    @router.route('selprod_{order_num}_{product_id:int}')
+    def select_product(call, order_num, product_id):
         user_id = call.from_user.id
-        parts = call.data.split('_')
-        order_num = parts[1]
-        product_id = int(parts[2])
         logger.info(f"🔘 Выбран товар {product_id} для заказа {order_num}")
 
         session = edit_sessions.get(user_id)
@@ -160,8 +169,7 @@ def register_edit_handlers(bot):
             return
 
         markup = types.InlineKeyboardMarkup(row_width=2)
-        products = get_all_products()
-        product_name = next((p['name'] for p in products if p['id'] == product_id), "Товар")
+        product_name = get_product_names().get(product_id, "Товар")
         for v in variants:
             btn_text = f"{product_name} {v['name']}"
             markup.add(types.InlineKeyboardButton(
@@ -177,13 +185,9 @@ def register_edit_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('selvar_'))
-    def select_variant(call):
+    @router.route('selvar_{order_num}_{product_id:int}_{variant_id:int}')
+    def select_variant(call, order_num, product_id, variant_id):
         user_id = call.from_user.id
-        parts = call.data.split('_')
-        order_num = parts[1]
-        product_id = int(parts[2])
-        variant_id = int(parts[3])
         logger.info(f"🔘 Выбран вариант {variant_id} для товара {product_id} в заказе {order_num}")
 
         session = edit_sessions.get(user_id)
@@ -193,11 +197,11 @@ def register_edit_handlers(bot):
 
         session['current_product'] = product_id
         session['current_variant'] = variant_id
+        edit_sessions.save(user_id, session)
 
         variant = get_variant(variant_id)
         variant_name = variant['name'] if variant else "Неизвестный вариант"
-        products = get_all_products()
-        product_name = next((p['name'] for p in products if p['id'] == product_id), "Товар")
+        product_name = get_product_names().get(product_id, "Товар")
 
         bot.edit_message_text(
             f"Введите количество для *{product_name} ({variant_name})*:",
@@ -205,17 +209,16 @@ def register_edit_handlers(bot):
             session['message_id'],
             parse_mode='Markdown'
         )
-        bot.register_next_step_handler_by_chat_id(
+        conversation.expect(
             session['chat_id'],
-            process_quantity_input,
+            'edit_order_quantity',
             user_id, order_num, product_id, variant_id
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('backtoproducts_'))
-    def back_to_products(call):
+    @router.route('backtoproducts_{order_num}')
+    def back_to_products(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         session = edit_sessions.get(user_id)
         if not session or session['order_number'] != order_num:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
@@ -223,6 +226,7 @@ def register_edit_handlers(bot):
         show_product_selection(user_id)
         bot.answer_callback_query(call.id)
 
+    @conversation.step('edit_order_quantity')
     def process_quantity_input(message, user_id, order_num, product_id, variant_id):
         logger.info(f"📝 Ввод количества для товара {product_id}, вариант {variant_id}, заказ {order_num}")
         session = edit_sessions.get(user_id)
@@ -247,13 +251,13 @@ def register_edit_handlers(bot):
         else:
             session['selected_items'][key] = qty
             logger.info(f"✅ Количество для варианта {variant_id} установлено: {qty}")
+        edit_sessions.save(user_id, session)
 
         show_product_selection(user_id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('finish_'))
-    def finish_edit(call):
+    @router.route('finish_{order_num}')
+    def finish_edit(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         logger.info(f"🏁 Завершение редактирования заказа {order_num}")
 
         session = edit_sessions.get(user_id)
@@ -278,8 +282,7 @@ def register_edit_handlers(bot):
             bot.answer_callback_query(call.id)
             return
 
-        products = get_all_products()
-        product_dict = {p['id']: p['name'] for p in products}
+        product_dict = get_product_names()
         
         # Пересчитываем новую сумму заказа (по цене покупателя)
         new_total = 0
@@ -316,10 +319,9 @@ def register_edit_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('apply_'))
-    def apply_edit(call):
+    @router.route('apply_{order_num}')
+    def apply_edit(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         logger.info(f"✅ Применение изменений для заказа {order_num}")
 
         session = edit_sessions.pop(user_id, None)
@@ -374,44 +376,37 @@ def register_edit_handlers(bot):
                 bot.answer_callback_query(call.id, f"❌ Товар с variant_id {vid} не найден", show_alert=True)
                 return
 
-        # Обновляем поле total и items в заказе
+        # Обновление заказа, списание и отметка о проведении — одной транзакцией
         try:
-            with get_db_connection() as conn:
+            with transaction() as conn:
                 with conn.cursor() as cur:
-                    # Обновляем и сумму, и состав заказа
+                    # Обновляем и сумму, и состав заказа; строка заказа блокируется до конца
+                    # транзакции, поэтому параллельное проведение увидит stock_processed
                     cur.execute(
-                        "UPDATE orders SET total = %s, items = %s WHERE id = %s",
+                        "UPDATE orders SET total = %s, items = %s WHERE id = %s AND stock_processed IS NOT TRUE RETURNING id",
                         (new_total, json.dumps(updated_items), order['id'])
                     )
-                    conn.commit()
-            logger.info(f"✅ Обновлена сумма заказа {order_num}: {order['total']} -> {new_total}")
-            logger.info(f"✅ Обновлён состав заказа {order_num}")
-            
-            # Проверяем, что обновление действительно произошло
-            with get_db_connection() as conn:
-                with conn.cursor() as cur:
-                    cur.execute("SELECT total FROM orders WHERE id = %s", (order['id'],))
-                    updated = cur.fetchone()
-                    logger.info(f"✅ Проверка: в БД теперь total = {updated['total']}")
-                    
+                    processed = cur.fetchone() is not None
+                if processed:
+                    logger.info(f"✅ Обновлена сумма заказа {order_num}: {order['total']} -> {new_total}")
+                    logger.info(f"✅ Обновлён состав заказа {order_num}")
+                    # Суммы в seller_balances берутся из уже обновлённых позиций
+                    processed = mark_order_as_processed(order['id'])
+                if processed:
+                    # Списание всех выбранных вариантов одним запросом
+                    apply_stock_deltas(
+                        seller['id'],
+                        [(vid, -qty) for (pid, vid), qty in selected.items()],
+                        reason='sale',
+                        order_id=order['id']
+                    )
         except Exception as e:
             logger.error(f"Ошибка при обновлении заказа: {e}")
             bot.answer_callback_query(call.id, "❌ Ошибка обновления заказа", show_alert=True)
             return
-
-        # Списание по каждому выбранному варианту
-        for (pid, vid), qty in selected.items():
-            if qty > 0:
-                decrease_seller_stock(
-                    seller_id=seller['id'],
-                    variant_id=vid,
-                    quantity=qty,
-                    reason='sale',
-                    order_id=order['id']
-                )
-                logger.info(f"✅ Списано {qty} ед. товара variant {vid}")
-
-        mark_order_as_processed(order['id'])
+        if not processed:
+            bot.answer_callback_query(call.id, "✅ Заказ уже обработан")
+            return
         logger.info(f"✅ Заказ {order_num} обработан, списано товаров: {len(selected)}")
 
         bot.edit_message_text(
@@ -424,10 +419,9 @@ def register_edit_handlers(bot):
         if negatives:
             send_negative_stock_warning(bot, session['chat_id'], seller['id'])
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('nochanges_'))
-    def no_changes(call):
+    @router.route('nochanges_{order_num}')
+    def no_changes(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         logger.info(f"✅ Подтверждение заказа {order_num} без изменений")
 
         session = edit_sessions.pop(user_id, None)
@@ -450,21 +444,30 @@ def register_edit_handlers(bot):
             return
 
         # Сумма не меняется, используем исходную
-        for item in order['items']:
-            variant_id = item.get('variantId')
-            if not variant_id:
-                logger.error(f"В заказе {order_num} отсутствует variantId")
-                bot.answer_callback_query(call.id, "❌ Ошибка данных заказа")
-                return
-            decrease_seller_stock(
-                seller_id=seller['id'],
-                variant_id=variant_id,
-                quantity=item['quantity'],
-                reason='sale',
-                order_id=order['id']
-            )
-
-        mark_order_as_processed(order['id'])
+        if any(not item.get('variantId') for item in order['items']):
+            logger.error(f"В заказе {order_num} отсутствует variantId")
+            bot.answer_callback_query(call.id, "❌ Ошибка данных заказа")
+            return
+        # Отметка о проведении и списание — одной транзакцией; отметка первой,
+        # чтобы повторное или параллельное подтверждение не списало остатки дважды
+        try:
+            with transaction():
+                processed = mark_order_as_processed(order['id'])
+                if processed:
+                    apply_stock_deltas(
+                        seller['id'],
+                        [(item['variantId'], -int(item['quantity'])) for item in order['items'] if int(item['quantity']) > 0],
+                        reason='sale',
+                        order_id=order['id']
+                    )
+        except ValueError as e:
+            # Позиции заказа не разобраны (line_item_errors): проводить нельзя, иначе долг не посчитается
+            logger.error(f"Заказ {order_num} не проведён: {e}")
+            bot.answer_callback_query(call.id, "❌ Ошибка данных заказа, сообщите администратору", show_alert=True)
+            return
+        if not processed:
+            bot.answer_callback_query(call.id, "✅ Заказ уже обработан")
+            return
         
         bot.edit_message_text(
             f"✅ Заказ {order_num} проведён без изменений.\nСумма заказа: {order['total']} руб.",
@@ -476,10 +479,9 @@ def register_edit_handlers(bot):
         if negatives:
             send_negative_stock_warning(bot, session['chat_id'], seller['id'])
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('editagain_'))
-    def edit_again(call):
+    @router.route('editagain_{order_num}')
+    def edit_again(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         logger.info(f"✏️ Повторное редактирование заказа {order_num}")
 
         session = edit_sessions.get(user_id)
@@ -488,13 +490,13 @@ def register_edit_handlers(bot):
             return
 
         session['selected_items'] = {}
+        edit_sessions.save(user_id, session)
         show_product_selection(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('editcancel_'))
-    def edit_cancel(call):
+    @router.route('editcancel_{order_num}')
+    def edit_cancel(call, order_num):
         user_id = call.from_user.id
-        order_num = call.data.split('_')[1]
         logger.info(f"❌ Отмена редактирования заказа {order_num}")
 
         session = edit_sessions.pop(user_id, None)
@@ -2,16 +2,21 @@
 import logging
 from telebot import types
 from models import (
-    get_seller_by_telegram_id, get_all_products, get_product_variants,
+    get_seller_by_telegram_id, get_product_names, get_product_variants,
     create_packing_operation, get_hub_stock, get_variant
 )
 from config import HUB_SELLER_ID
+from sessions import session_store, CartSession
+from router import get_router
+from conversation import get_conversation
 
 logger = logging.getLogger(__name__)
 
-packing_sessions = {}
+packing_sessions = session_store('packing', CartSession)
 
 def register_packing_handlers(bot):
+    router = get_router(bot)
+    conversation = get_conversation(bot)
     @bot.message_handler(func=lambda m: m.text == "📦 Фасовка")
     def handle_packing(message):
         user_id = message.from_user.id
@@ -20,21 +25,17 @@ def register_packing_handlers(bot):
             bot.reply_to(message, "❌ У вас нет доступа к этому разделу.")
             return
 
-        packing_sessions[user_id] = {
-            'seller_id': seller['id'],
-            'items': {},
-            'chat_id': message.chat.id
-        }
+        packing_sessions.start(user_id, seller_id=seller['id'], chat_id=message.chat.id)
         show_product_list(user_id)
 
     def show_product_list(user_id):
         session = packing_sessions.get(user_id)
         if not session:
             return
-        products = get_all_products()
+        products = get_product_names()
         markup = types.InlineKeyboardMarkup(row_width=2)
-        for p in products:
-            markup.add(types.InlineKeyboardButton(p['name'], callback_data=f"pack_prod_{p['id']}"))
+        for product_id, name in products.items():
+            markup.add(types.InlineKeyboardButton(name, callback_data=f"pack_prod_{product_id}"))
         markup.add(types.InlineKeyboardButton("✅ Завершить", callback_data="pack_finish"))
         bot.send_message(
             session['chat_id'],
@@ -43,10 +44,9 @@ def register_packing_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('pack_prod_'))
-    def select_product(call):
+    @router.route('pack_prod_{product_id:int}')
+    def select_product(call, product_id):
         user_id = call.from_user.id
-        product_id = int(call.data.split('_')[2])
         session = packing_sessions.get(user_id)
         if not session:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
@@ -65,8 +65,7 @@ def register_packing_handlers(bot):
 
         # Показываем варианты фасовки и сообщаем о доступных кг
         markup = types.InlineKeyboardMarkup(row_width=2)
-        products = get_all_products()
-        product_name = next((p['name'] for p in products if p['id'] == product_id), "Товар")
+        product_name = get_product_names().get(product_id, "Товар")
         for v in pack_variants:
             btn_text = f"{product_name} {v['name']} ({v['weight_kg']} кг)"
             markup.add(types.InlineKeyboardButton(
@@ -84,30 +83,29 @@ def register_packing_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('pack_var_'))
-    def select_variant(call):
+    @router.route('pack_var_{product_id:int}_{variant_id:int}')
+    def select_variant(call, product_id, variant_id):
         user_id = call.from_user.id
-        parts = call.data.split('_')
-        product_id = int(parts[2])
-        variant_id = int(parts[3])
         session = packing_sessions.get(user_id)
         if not session:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
             return
         session['current_product'] = product_id
         session['current_variant'] = variant_id
+        packing_sessions.save(user_id, session)
         bot.edit_message_text(
             f"Введите количество упаковок:",
             call.message.chat.id,
             call.message.message_id
         )
-        bot.register_next_step_handler_by_chat_id(
+        conversation.expect(
             call.message.chat.id,
-            process_quantity,
+            'packing_quantity',
             user_id, product_id, variant_id
         )
         bot.answer_callback_query(call.id)
 
+    @conversation.step('packing_quantity')
     def process_quantity(message, user_id, product_id, variant_id):
         session = packing_sessions.get(user_id)
         if not session:
@@ -128,6 +126,7 @@ def register_packing_handlers(bot):
             'product_id': product_id,
             'quantity': qty
         }
+        packing_sessions.save(user_id, session)
         logger.info(f"✅ Добавлена позиция variant {variant_id}, qty {qty}")
 
         show_summary(user_id)
@@ -164,21 +163,21 @@ def register_packing_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data == "pack_add")
+    @router.route('pack_add')
     def pack_add(call):
         user_id = call.from_user.id
         bot.delete_message(call.message.chat.id, call.message.message_id)
         show_product_list(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "pack_back_to_products")
+    @router.route('pack_back_to_products')
     def pack_back_to_products(call):
         user_id = call.from_user.id
         bot.delete_message(call.message.chat.id, call.message.message_id)
         show_product_list(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "pack_cancel")
+    @router.route('pack_cancel')
     def pack_cancel(call):
         user_id = call.from_user.id
         packing_sessions.pop(user_id, None)
@@ -189,7 +188,7 @@ def register_packing_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "pack_confirm")
+    @router.route('pack_confirm')
     def pack_confirm(call):
         user_id = call.from_user.id
         session = packing_sessions.pop(user_id, None)
@@ -247,7 +246,7 @@ def register_packing_handlers(bot):
         )
         bot.answer_callback_query(call.id, "✅ Фасовка завершена")
 
-    @bot.callback_query_handler(func=lambda call: call.data == "pack_finish")
+    @router.route('pack_finish')
     def pack_finish(call):
         user_id = call.from_user.id
         packing_sessions.pop(user_id, None)
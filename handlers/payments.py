@@ -3,18 +3,20 @@ import logging
 from telebot import types
 from models import (
     get_seller_by_telegram_id, get_seller_by_id, get_seller_debt,
-    get_seller_profit, create_payment_request, get_payment_request,
-    update_payment_status
+    get_seller_profit, create_payment_request, get_payment_request
 )
 from config import ADMIN_ID
 from keyboards import main_keyboard
+from notifications import confirm_payment
+from router import get_router
+from conversation import get_conversation
 
 logger = logging.getLogger(__name__)
 
-payment_sessions = {}
-
 def register_payment_handlers(bot):
     logger.info("💰 Регистрация обработчиков выплат")
+    router = get_router(bot)
+    conversation = get_conversation(bot)
 
     @bot.message_handler(func=lambda m: m.text == "💰 Выплата админу")
     def handle_payment(message):
@@ -48,7 +50,7 @@ def register_payment_handlers(bot):
             logger.error(f"Ошибка при обработке выплаты: {e}")
             bot.reply_to(message, "❌ Произошла внутренняя ошибка.")
 
-    @bot.callback_query_handler(func=lambda call: call.data == "make_payment")
+    @router.route('make_payment')
     def make_payment(call):
         user_id = call.from_user.id
         logger.info(f"💳 Нажата кнопка 'Произвести выплату' пользователем {user_id}")
@@ -64,9 +66,10 @@ def register_payment_handlers(bot):
             call.message.message_id,
             parse_mode='Markdown'
         )
-        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_payment_amount, seller['id'], call.message.chat.id)
+        conversation.expect(call.message.chat.id, 'payment_amount', seller['id'], call.message.chat.id)
         bot.answer_callback_query(call.id)
 
+    @conversation.step('payment_amount')
     def process_payment_amount(message, seller_id, original_chat_id):
         user_id = message.from_user.id
         logger.info(f"💵 Ввод суммы выплаты пользователем {user_id}")
@@ -104,20 +107,13 @@ def register_payment_handlers(bot):
             return
         bot.reply_to(message, f"✅ Запрос на выплату {amount} руб. отправлен администратору. Ожидайте подтверждения.")
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('payment_confirm_'))
-    def payment_confirm(call):
+    @router.route('payment_confirm_{payment_id:int}_{amount:int}')
+    def payment_confirm(call, payment_id, amount):
         logger.info(f"✅ Вызван payment_confirm с data={call.data}")
         user_id = call.from_user.id
         if user_id != ADMIN_ID:
             bot.answer_callback_query(call.id, "❌ У вас нет прав.")
             return
-        parts = call.data.split('_')
-        if len(parts) < 4:
-            logger.error(f"Неверный формат callback: {call.data}")
-            bot.answer_callback_query(call.id, "❌ Ошибка данных")
-            return
-        payment_id = int(parts[2])
-        amount = int(parts[3])
         payment = get_payment_request(payment_id)
         if not payment:
             logger.error(f"Заявка {payment_id} не найдена")
@@ -128,21 +124,8 @@ def register_payment_handlers(bot):
             bot.answer_callback_query(call.id, f"✅ Заявка уже {payment['status']}")
             return
         try:
-            update_payment_status(payment_id, 'confirmed', confirmed_amount=amount)
+            seller = confirm_payment(bot, payment, amount)
             logger.info(f"Выплата {payment_id} подтверждена, сумма {amount}")
-            seller = get_seller_by_id(payment['seller_id'])
-            if seller:
-                debt, _, _, _ = get_seller_debt(payment['seller_id'])
-                try:
-                    bot.send_message(
-                        seller['telegram_id'],
-                        f"✅ Админ подтвердил получение *{amount} руб.*\n"
-                        f"Ваш долг составляет *{debt} руб.*",
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"Уведомление отправлено продавцу {seller['telegram_id']}")
-                except Exception as e:
-                    logger.error(f"Ошибка уведомления продавца: {e}")
         except Exception as e:
             logger.error(f"Ошибка при подтверждении выплаты: {e}")
             bot.answer_callback_query(call.id, "❌ Ошибка базы данных", show_alert=True)
@@ -154,14 +137,13 @@ def register_payment_handlers(bot):
         )
         bot.answer_callback_query(call.id, "✅ Подтверждено")
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('payment_edit_'))
-    def payment_edit(call):
+    @router.route('payment_edit_{payment_id:int}')
+    def payment_edit(call, payment_id):
         logger.info(f"✏️ Вызван payment_edit с data={call.data}")
         user_id = call.from_user.id
         if user_id != ADMIN_ID:
             bot.answer_callback_query(call.id, "❌ У вас нет прав.")
             return
-        payment_id = int(call.data.split('_')[2])
         payment = get_payment_request(payment_id)
         if not payment:
             logger.error(f"Заявка {payment_id} не найдена")
@@ -176,9 +158,10 @@ def register_payment_handlers(bot):
             call.message.chat.id,
             call.message.message_id
         )
-        bot.register_next_step_handler_by_chat_id(call.message.chat.id, process_edit_payment, payment_id, call.message.chat.id)
+        conversation.expect(call.message.chat.id, 'payment_edit_amount', payment_id, call.message.chat.id)
         bot.answer_callback_query(call.id)
 
+    @conversation.step('payment_edit_amount')
     def process_edit_payment(message, payment_id, original_chat_id):
         user_id = message.from_user.id
         logger.info(f"✏️ Ввод новой суммы админом {user_id}")
@@ -194,20 +177,8 @@ def register_payment_handlers(bot):
             bot.reply_to(message, "❌ Заявка не найдена")
             return
         try:
-            update_payment_status(payment_id, 'confirmed', confirmed_amount=amount)
+            seller = confirm_payment(bot, payment, amount)
             logger.info(f"Выплата {payment_id} подтверждена с изменённой суммой {amount}")
-            seller = get_seller_by_id(payment['seller_id'])
-            if seller:
-                debt, _, _, _ = get_seller_debt(payment['seller_id'])
-                try:
-                    bot.send_message(
-                        seller['telegram_id'],
-                        f"✅ Админ подтвердил получение *{amount} руб.*\n"
-                        f"Ваш долг составляет *{debt} руб.*",
-                        parse_mode='Markdown'
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка уведомления продавца: {e}")
         except Exception as e:
             logger.error(f"Ошибка при подтверждении выплаты: {e}")
             bot.reply_to(message, "❌ Ошибка базы данных")
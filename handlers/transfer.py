@@ -2,20 +2,29 @@
 import logging
 from telebot import types
 from models import (
-    get_seller_by_telegram_id, get_seller_by_id, get_all_products,
+    get_seller_by_telegram_id, get_seller_by_id, get_product_names,
     get_product_variants, get_seller_stock, get_variant,
     create_transfer_request, add_transfer_request_item,
     get_transfer_request_with_items, update_transfer_request_status,
-    decrease_seller_stock, increase_seller_stock,
+    apply_stock_deltas, enqueue_notification,
     get_seller_stock_with_check, update_transfer_request_status_atomic
 )
 from config import HUB_SELLER_ID, ADMIN_ID
+from database import transaction
+from outbox import get_relay
+from sessions import session_store, CartSession
+from router import get_router
+from conversation import get_conversation
 
 logger = logging.getLogger(__name__)
 
-transfer_sessions = {}
+transfer_sessions = session_store('transfer', CartSession)
 
 def register_transfer_handlers(bot):
+    relay = get_relay(bot)
+    router = get_router(bot)
+    conversation = get_conversation(bot)
+
     def is_admin(user_id):
         return user_id == ADMIN_ID
 
@@ -35,21 +44,17 @@ def register_transfer_handlers(bot):
             )
             return
 
-        transfer_sessions[user_id] = {
-            'seller_id': seller['id'],
-            'items': {},
-            'chat_id': message.chat.id
-        }
+        transfer_sessions.start(user_id, seller_id=seller['id'], chat_id=message.chat.id)
         show_product_list(user_id)
 
     def show_product_list(user_id):
         session = transfer_sessions.get(user_id)
         if not session:
             return
-        products = get_all_products()
+        products = get_product_names()
         markup = types.InlineKeyboardMarkup(row_width=2)
-        for p in products:
-            markup.add(types.InlineKeyboardButton(p['name'], callback_data=f"transfer_prod_{p['id']}"))
+        for product_id, name in products.items():
+            markup.add(types.InlineKeyboardButton(name, callback_data=f"transfer_prod_{product_id}"))
         markup.add(types.InlineKeyboardButton("✅ Завершить", callback_data="transfer_finish"))
         bot.send_message(
             session['chat_id'],
@@ -58,10 +63,9 @@ def register_transfer_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('transfer_prod_'))
-    def select_product(call):
+    @router.route('transfer_prod_{product_id:int}')
+    def select_product(call, product_id):
         user_id = call.from_user.id
-        product_id = int(call.data.split('_')[2])
         logger.info(f"🔘 Выбран товар {product_id} пользователем {user_id}")
         session = transfer_sessions.get(user_id)
         if not session:
@@ -75,9 +79,9 @@ def register_transfer_handlers(bot):
             return
 
         # Сохраняем название товара в сессии
-        products = get_all_products()
-        product_name = next((p['name'] for p in products if p['id'] == product_id), "Товар")
+        product_name = get_product_names().get(product_id, "Товар")
         session['product_name'] = product_name
+        transfer_sessions.save(user_id, session)
 
         markup = types.InlineKeyboardMarkup(row_width=2)
         for v in transfer_variants:
@@ -95,12 +99,9 @@ def register_transfer_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('transfer_var_'))
-    def select_variant(call):
+    @router.route('transfer_var_{product_id:int}_{variant_id:int}')
+    def select_variant(call, product_id, variant_id):
         user_id = call.from_user.id
-        parts = call.data.split('_')
-        product_id = int(parts[2])
-        variant_id = int(parts[3])
         session = transfer_sessions.get(user_id)
         if not session:
             bot.answer_callback_query(call.id, "❌ Сессия истекла")
@@ -115,6 +116,7 @@ def register_transfer_handlers(bot):
         session['current_variant'] = variant_id
         session['variant_name'] = variant_name
         session['product_name'] = product_name
+        transfer_sessions.save(user_id, session)
         
         bot.edit_message_text(
             f"Введите количество упаковок для *{product_name} ({variant_name})*:",
@@ -122,13 +124,14 @@ def register_transfer_handlers(bot):
             call.message.message_id,
             parse_mode='Markdown'
         )
-        bot.register_next_step_handler_by_chat_id(
+        conversation.expect(
             call.message.chat.id,
-            process_quantity,
+            'transfer_quantity',
             user_id, product_id, variant_id
         )
         bot.answer_callback_query(call.id)
 
+    @conversation.step('transfer_quantity')
     def process_quantity(message, user_id, product_id, variant_id):
         session = transfer_sessions.get(user_id)
         if not session:
@@ -151,6 +154,7 @@ def register_transfer_handlers(bot):
             'product_id': product_id,
             'quantity': qty
         }
+        transfer_sessions.save(user_id, session)
         logger.info(f"✅ Добавлена позиция variant {variant_id}, qty {qty}")
         show_summary(user_id)
 
@@ -185,21 +189,21 @@ def register_transfer_handlers(bot):
             reply_markup=markup
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data == "transfer_add")
+    @router.route('transfer_add')
     def transfer_add(call):
         user_id = call.from_user.id
         bot.delete_message(call.message.chat.id, call.message.message_id)
         show_product_list(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "transfer_back_to_products")
+    @router.route('transfer_back_to_products')
     def back_to_products(call):
         user_id = call.from_user.id
         bot.delete_message(call.message.chat.id, call.message.message_id)
         show_product_list(user_id)
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "transfer_cancel")
+    @router.route('transfer_cancel')
     def transfer_cancel(call):
         user_id = call.from_user.id
         transfer_sessions.pop(user_id, None)
@@ -210,7 +214,7 @@ def register_transfer_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data == "transfer_confirm")
+    @router.route('transfer_confirm')
     def transfer_confirm(call):
         user_id = call.from_user.id
         session = transfer_sessions.pop(user_id, None)
@@ -228,16 +232,6 @@ def register_transfer_handlers(bot):
             bot.answer_callback_query(call.id, "❌ Ошибка доступа")
             return
 
-        try:
-            request_id = create_transfer_request(HUB_SELLER_ID, seller['id'])
-            for item in items:
-                add_transfer_request_item(request_id, item['variant_id'], item['quantity'])
-            logger.info(f"✅ Заявка на перемещение {request_id} создана с {len(items)} позициями")
-        except Exception as e:
-            logger.exception(f"Ошибка при создании заявки: {e}")
-            bot.answer_callback_query(call.id, "❌ Не удалось создать заявку из-за внутренней ошибки.", show_alert=True)
-            return
-
         # Формируем текст для уведомлений
         lines = []
         for item in items:
@@ -245,47 +239,37 @@ def register_transfer_handlers(bot):
             if variant:
                 lines.append(f"• {variant['product_name']} ({variant['name']}): {item['quantity']} шт")
         items_text = "\n".join(lines)
-
-        # Уведомляем кладовщика
         hub_seller = get_seller_by_id(HUB_SELLER_ID)
-        if hub_seller:
-            markup = types.InlineKeyboardMarkup()
-            markup.row(
-                types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"transfer_approve_{request_id}"),
-                types.InlineKeyboardButton("❌ Отклонить", callback_data=f"transfer_reject_{request_id}")
-            )
-            try:
-                bot.send_message(
-                    hub_seller['telegram_id'],
+
+        # Заявка и уведомления о ней — одной транзакцией
+        try:
+            with transaction():
+                request_id = create_transfer_request(HUB_SELLER_ID, seller['id'])
+                for item in items:
+                    add_transfer_request_item(request_id, item['variant_id'], item['quantity'])
+
+                text = (
                     f"📦 *Новая заявка на перемещение №{request_id}*\n\n"
                     f"От: {seller['name']}\n"
-                    f"{items_text}",
-                    parse_mode='Markdown',
-                    reply_markup=markup
+                    f"{items_text}"
                 )
-                logger.info(f"Уведомление о заявке {request_id} отправлено кладовщику")
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления кладовщику: {e}")
-
-        # Уведомляем администратора
-        if ADMIN_ID and ADMIN_ID != hub_seller['telegram_id']:
-            try:
-                admin_markup = types.InlineKeyboardMarkup()
-                admin_markup.row(
+                markup = types.InlineKeyboardMarkup()
+                markup.row(
                     types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"transfer_approve_{request_id}"),
                     types.InlineKeyboardButton("❌ Отклонить", callback_data=f"transfer_reject_{request_id}")
                 )
-                bot.send_message(
-                    ADMIN_ID,
-                    f"📦 *Новая заявка на перемещение №{request_id}*\n\n"
-                    f"От: {seller['name']}\n"
-                    f"{items_text}",
-                    parse_mode='Markdown',
-                    reply_markup=admin_markup
-                )
-                logger.info(f"Уведомление о заявке {request_id} отправлено админу")
-            except Exception as e:
-                logger.error(f"Ошибка отправки уведомления админу: {e}")
+                # Уведомляем кладовщика
+                if hub_seller and hub_seller['telegram_id']:
+                    enqueue_notification(hub_seller['telegram_id'], text, parse_mode='Markdown', reply_markup=markup)
+                # Уведомляем администратора
+                if ADMIN_ID and (not hub_seller or ADMIN_ID != hub_seller['telegram_id']):
+                    enqueue_notification(ADMIN_ID, text, parse_mode='Markdown', reply_markup=markup)
+            logger.info(f"✅ Заявка на перемещение {request_id} создана с {len(items)} позициями")
+        except Exception as e:
+            logger.exception(f"Ошибка при создании заявки: {e}")
+            bot.answer_callback_query(call.id, "❌ Не удалось создать заявку из-за внутренней ошибки.", show_alert=True)
+            return
+        relay.wake()
 
         bot.edit_message_text(
             f"✅ Заявка на перемещение №{request_id} создана. Ожидайте подтверждения.",
@@ -294,7 +278,7 @@ def register_transfer_handlers(bot):
         )
         bot.answer_callback_query(call.id, "✅ Заявка создана")
 
-    @bot.callback_query_handler(func=lambda call: call.data == "transfer_finish")
+    @router.route('transfer_finish')
     def transfer_finish(call):
         user_id = call.from_user.id
         transfer_sessions.pop(user_id, None)
@@ -305,8 +289,8 @@ def register_transfer_handlers(bot):
         )
         bot.answer_callback_query(call.id)
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('transfer_approve_'))
-    def approve_transfer(call):
+    @router.route('transfer_approve_{request_id:int}')
+    def approve_transfer(call, request_id):
         user_id = call.from_user.id
         logger.info(f"🔥🔥🔥 approve_transfer сработал! User: {user_id}, Data: {call.data}")
         
@@ -318,26 +302,7 @@ def register_transfer_handlers(bot):
         )
         
         try:
-            # Проверяем формат данных
-            parts = call.data.split('_')
-            if len(parts) < 3:
-                error_msg = "❌ Ошибка формата данных"
-                logger.error(f"❌ Неверный формат callback_data: {call.data}")
-                bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
-                bot.answer_callback_query(call.id, error_msg, show_alert=True)
-                return
-            
-            # Извлекаем ID заявки
-            request_id_str = parts[2]
-            try:
-                request_id = int(request_id_str)
-                logger.info(f"✅ ID заявки: {request_id}")
-            except ValueError:
-                error_msg = "❌ Неверный ID заявки"
-                logger.error(f"❌ Не удалось преобразовать '{request_id_str}' в число")
-                bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
-                bot.answer_callback_query(call.id, error_msg, show_alert=True)
-                return
+            logger.info(f"✅ ID заявки: {request_id}")
 
             # Проверяем права
             seller = get_seller_by_telegram_id(user_id)
@@ -399,51 +364,10 @@ def register_transfer_handlers(bot):
                 bot.answer_callback_query(call.id, "❌ Недостаточно товара", show_alert=True)
                 return
 
-            # Атомарное обновление статуса
-            logger.info(f"🔄 Попытка атомарного обновления статуса заявки {request_id}")
-            if not update_transfer_request_status_atomic(request_id, 'approved'):
-                error_msg = "❌ Заявка уже обрабатывается или была обработана ранее."
-                logger.warning(f"❌ Не удалось обновить статус заявки {request_id}")
-                bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
-                bot.answer_callback_query(call.id, error_msg, show_alert=True)
-                return
-
-            logger.info(f"✅ Статус заявки {request_id} успешно обновлён")
-
             # Определяем, кто подтверждает
             completer_name = "Администратор" if is_admin(user_id) else seller['name']
             completer_display = completer_name
 
-            # Выполняем перемещение
-            try:
-                for item in request['items']:
-                    logger.info(f"🔄 Перемещение: кладовщик {HUB_SELLER_ID} -> продавец {request['to_seller_id']}, "
-                               f"variant {item['variant_id']}, quantity {item['quantity']}")
-                    
-                    decrease_seller_stock(
-                        seller_id=HUB_SELLER_ID,
-                        variant_id=item['variant_id'],
-                        quantity=item['quantity'],
-                        reason='transfer_out',
-                        order_id=None
-                    )
-                    increase_seller_stock(
-                        seller_id=request['to_seller_id'],
-                        variant_id=item['variant_id'],
-                        quantity=item['quantity'],
-                        reason='transfer_in',
-                        order_id=None
-                    )
-                
-                logger.info(f"✅ Заявка {request_id} подтверждена {completer_display}, перемещение выполнено")
-                
-            except Exception as e:
-                error_msg = f"❌ Ошибка при перемещении: {str(e)}"
-                logger.error(f"❌ Ошибка при перемещении: {e}")
-                bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
-                bot.answer_callback_query(call.id, "❌ Ошибка перемещения", show_alert=True)
-                return
-
             # Формируем детальное сообщение о полученных товарах
             items_received = []
             for item in request['items']:
@@ -464,49 +388,61 @@ def register_transfer_handlers(bot):
             # Получаем информацию о продавце, который получил товар
             seller_to = get_seller_by_id(request['to_seller_id'])
             seller_to_name = seller_to['name'] if seller_to else "Неизвестный продавец"
-
-            # Уведомление для продавца, который получил товар
-            if seller_to:
-                try:
-                    bot.send_message(
-                        seller_to['telegram_id'],
-                        f"✅ *Заявка на перемещение остатков №{request_id}*\n"
-                        f"Исполнена *{completer_display}*\n\n"
-                        f"Вы получили:\n{items_text}",
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"✅ Уведомление о подтверждении отправлено продавцу {seller_to['telegram_id']}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка уведомления продавца: {e}")
-
-            # Уведомление для кладовщика (всегда)
             hub_seller = get_seller_by_id(HUB_SELLER_ID)
-            if hub_seller:
-                try:
-                    bot.send_message(
-                        hub_seller['telegram_id'],
-                        f"✅ *Заявка на перемещение остатков №{request_id}*\n"
-                        f"Исполнена *{completer_display}*\n\n"
-                        f"Продавец *{seller_to_name}* получил:\n{items_text}",
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"✅ Уведомление о подтверждении отправлено кладовщику")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка уведомления кладовщика: {e}")
-
-            # Уведомление для администратора (всегда)
-            if ADMIN_ID:
-                try:
-                    bot.send_message(
-                        ADMIN_ID,
-                        f"✅ *Заявка на перемещение остатков №{request_id}*\n"
-                        f"Исполнена *{completer_display}*\n\n"
-                        f"Продавец *{seller_to_name}* получил:\n{items_text}",
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"✅ Уведомление о подтверждении отправлено администратору")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка уведомления администратора: {e}")
+
+            # Смена статуса, перемещение и уведомления — одной транзакцией: при ошибке ничего не применяется
+            logger.info(f"🔄 Попытка атомарного обновления статуса заявки {request_id}")
+            try:
+                with transaction():
+                    status_updated = update_transfer_request_status_atomic(request_id, 'approved')
+                    if status_updated:
+                        logger.info(f"🔄 Перемещение: кладовщик {HUB_SELLER_ID} -> продавец {request['to_seller_id']}, "
+                                   f"позиций {len(request['items'])}")
+                        apply_stock_deltas(
+                            HUB_SELLER_ID,
+                            [(item['variant_id'], -item['quantity']) for item in request['items']],
+                            reason='transfer_out'
+                        )
+                        apply_stock_deltas(
+                            request['to_seller_id'],
+                            [(item['variant_id'], item['quantity']) for item in request['items']],
+                            reason='transfer_in'
+                        )
+                        header = (
+                            f"✅ *Заявка на перемещение остатков №{request_id}*\n"
+                            f"Исполнена *{completer_display}*\n\n"
+                        )
+                        # Уведомление для продавца, который получил товар
+                        if seller_to and seller_to['telegram_id']:
+                            enqueue_notification(
+                                seller_to['telegram_id'],
+                                header + f"Вы получили:\n{items_text}",
+                                parse_mode='Markdown'
+                            )
+                        # Уведомление для кладовщика и администратора (всегда)
+                        for chat_id in (hub_seller['telegram_id'] if hub_seller else None, ADMIN_ID):
+                            if chat_id:
+                                enqueue_notification(
+                                    chat_id,
+                                    header + f"Продавец *{seller_to_name}* получил:\n{items_text}",
+                                    parse_mode='Markdown'
+                                )
+            except Exception as e:
+                error_msg = f"❌ Ошибка при перемещении: {str(e)}"
+                logger.error(f"❌ Ошибка при перемещении: {e}")
+                bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
+                bot.answer_callback_query(call.id, "❌ Ошибка перемещения", show_alert=True)
+                return
+
+            if not status_updated:
+                error_msg = "❌ Заявка уже обрабатывается или была обработана ранее."
+                logger.warning(f"❌ Не удалось обновить статус заявки {request_id}")
+                bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
+                bot.answer_callback_query(call.id, error_msg, show_alert=True)
+                return
+
+            relay.wake()
+            logger.info(f"✅ Заявка {request_id} подтверждена {completer_display}, перемещение выполнено")
 
             # Обновляем сообщение о процессе на успешное завершение
             success_msg = (
@@ -537,8 +473,8 @@ def register_transfer_handlers(bot):
             except:
                 pass
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith('transfer_reject_'))
-    def reject_transfer(call):
+    @router.route('transfer_reject_{request_id:int}')
+    def reject_transfer(call, request_id):
         user_id = call.from_user.id
         logger.info(f"❌ reject_transfer сработал! User: {user_id}, Data: {call.data}")
         
@@ -550,15 +486,6 @@ def register_transfer_handlers(bot):
         )
         
         try:
-            parts = call.data.split('_')
-            if len(parts) < 3:
-                error_msg = "❌ Ошибка формата данных"
-                logger.error(f"❌ Неверный формат callback_data: {call.data}")
-                bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
-                bot.answer_callback_query(call.id, error_msg, show_alert=True)
-                return
-            
-            request_id = int(parts[2])
             logger.info(f"✅ ID заявки: {request_id}")
 
             seller = get_seller_by_telegram_id(user_id)
@@ -585,63 +512,44 @@ def register_transfer_handlers(bot):
                 bot.answer_callback_query(call.id, error_msg, show_alert=True)
                 return
 
-            # Атомарное обновление статуса
-            if not update_transfer_request_status_atomic(request_id, 'rejected'):
+            completer_name = "Администратор" if is_admin(user_id) else seller['name']
+            completer_display = completer_name
+
+            seller_to = get_seller_by_id(request['to_seller_id'])
+            seller_to_name = seller_to['name'] if seller_to else "Неизвестный продавец"
+            hub_seller = get_seller_by_id(HUB_SELLER_ID)
+
+            # Атомарное обновление статуса вместе с уведомлениями
+            with transaction():
+                status_updated = update_transfer_request_status_atomic(request_id, 'rejected')
+                if status_updated:
+                    if seller_to and seller_to['telegram_id']:
+                        enqueue_notification(
+                            seller_to['telegram_id'],
+                            f"❌ *Заявка на перемещение №{request_id}*\n"
+                            f"Отклонена *{completer_display}*.",
+                            parse_mode='Markdown'
+                        )
+                    # Уведомление для кладовщика и администратора
+                    for chat_id in (hub_seller['telegram_id'] if hub_seller else None, ADMIN_ID):
+                        if chat_id:
+                            enqueue_notification(
+                                chat_id,
+                                f"❌ *Заявка на перемещение №{request_id}*\n"
+                                f"Отклонена *{completer_display}*.\n"
+                                f"Продавец: {seller_to_name}",
+                                parse_mode='Markdown'
+                            )
+            if not status_updated:
                 error_msg = "❌ Заявка уже обрабатывается или была обработана ранее."
                 logger.warning(f"❌ Не удалось обновить статус заявки {request_id}")
                 bot.edit_message_text(error_msg, call.message.chat.id, processing_msg.message_id)
                 bot.answer_callback_query(call.id, error_msg, show_alert=True)
                 return
 
-            completer_name = "Администратор" if is_admin(user_id) else seller['name']
-            completer_display = completer_name
-
+            relay.wake()
             logger.info(f"✅ Заявка {request_id} отклонена {completer_display}")
 
-            seller_to = get_seller_by_id(request['to_seller_id'])
-            seller_to_name = seller_to['name'] if seller_to else "Неизвестный продавец"
-
-            if seller_to:
-                try:
-                    bot.send_message(
-                        seller_to['telegram_id'],
-                        f"❌ *Заявка на перемещение №{request_id}*\n"
-                        f"Отклонена *{completer_display}*.",
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"✅ Уведомление об отклонении отправлено продавцу {seller_to['telegram_id']}")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка уведомления продавца: {e}")
-
-            # Уведомление для кладовщика
-            hub_seller = get_seller_by_id(HUB_SELLER_ID)
-            if hub_seller:
-                try:
-                    bot.send_message(
-                        hub_seller['telegram_id'],
-                        f"❌ *Заявка на перемещение №{request_id}*\n"
-                        f"Отклонена *{completer_display}*.\n"
-                        f"Продавец: {seller_to_name}",
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"✅ Уведомление об отклонении отправлено кладовщику")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка уведомления кладовщика: {e}")
-
-            # Уведомление для администратора
-            if ADMIN_ID:
-                try:
-                    bot.send_message(
-                        ADMIN_ID,
-                        f"❌ *Заявка на перемещение №{request_id}*\n"
-                        f"Отклонена *{completer_display}*.\n"
-                        f"Продавец: {seller_to_name}",
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"✅ Уведомление об отклонении отправлено администратору")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка уведомления администратора: {e}")
-
             # Обновляем сообщение о процессе
             success_msg = f"❌ *Заявка {request_id} отклонена {completer_display}*."
             bot.edit_message_text(
@@ -0,0 +1,121 @@
+# manage.py
+"""Служебные команды обслуживания базы.
+
+    python manage.py migrate
+    python manage.py check-schema
+    python manage.py rebuild-balances [--check] [--force]
+    python manage.py backfill-line-items [--batch-size N]
+    python manage.py seed-order-counters
+    python manage.py set-webhook [--force]
+
+Первый перенос истории: migrate → backfill-line-items → rebuild-balances.
+rebuild-balances считает заказы по order_items и без заполненных позиций
+обнулил бы суммы заказов, поэтому до backfill-line-items он отказывается работать.
+"""
+import argparse
+import logging
+import sys
+
+logging.basicConfig(level=logging.INFO)
+
+
+def cmd_migrate(args):
+    from schema import migrate
+    applied = migrate()
+    for version in applied:
+        print(f"Применена миграция {version}")
+    print(f"Применено миграций: {len(applied)}")
+    return 0
+
+
+def cmd_check_schema(args):
+    from schema import check_schema
+    pending, missing = check_schema()
+    for version in pending:
+        print(f"Не применена миграция {version}")
+    for name, table in missing:
+        print(f"Нет индекса {name} на {table}")
+    if pending or missing:
+        return 1
+    print("Схема в порядке")
+    return 0
+
+
+def cmd_rebuild_balances(args):
+    from models import rebuild_seller_balances, count_missing_line_items
+    missing = {table: count for table, count in count_missing_line_items().items() if count}
+    if missing:
+        for table, count in missing.items():
+            print(f"Нет строк в {table}: {count}")
+        if not args.force:
+            print("Сначала выполните python manage.py backfill-line-items (или --force, чтобы пересчитать всё равно)")
+            return 1
+        print("⚠️ Пересчёт без заполненных позиций: суммы этих заказов и продаж не войдут в балансы")
+    mismatches = rebuild_seller_balances(check_only=args.check)
+    for seller_id, stored, actual in mismatches:
+        print(f"Продавец {seller_id}: сохранено {stored}, по истории {actual}")
+    if args.check:
+        print(f"Расхождений: {len(mismatches)}")
+        return 1 if mismatches else 0
+    print(f"seller_balances пересчитаны, исправлено расхождений: {len(mismatches)}")
+    return 0
+
+
+def cmd_backfill_line_items(args):
+    from models import backfill_line_items
+    inserted = backfill_line_items(batch_size=args.batch_size)
+    for table, count in inserted.items():
+        print(f"{table}: добавлено строк {count}")
+    return 0
+
+
+def cmd_seed_order_counters(args):
+    from models import seed_order_counters
+    counters = seed_order_counters()
+    for prefix, last_number in sorted(counters.items()):
+        print(f"{prefix}: {last_number}")
+    print(f"Счётчиков номеров: {len(counters)}")
+    return 0
+
+
+def cmd_set_webhook(args):
+    from webhook_setup import set_webhook_once
+    if not set_webhook_once(force=args.force):
+        print("Webhook сейчас регистрирует другой процесс")
+        return 1
+    print("Webhook установлен")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Обслуживание базы складского бота")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('migrate', help="Применить новые миграции из migrations/").set_defaults(func=cmd_migrate)
+    commands.add_parser('check-schema', help="Показать неприменённые миграции и недостающие индексы").set_defaults(func=cmd_check_schema)
+
+    rebuild = commands.add_parser(
+        'rebuild-balances',
+        help="Пересчитать seller_balances по всей истории (после backfill-line-items)"
+    )
+    rebuild.add_argument('--check', action='store_true', help="Только сверить, ничего не меняя")
+    rebuild.add_argument('--force', action='store_true', help="Пересчитать, даже если не все позиции заполнены")
+    rebuild.set_defaults(func=cmd_rebuild_balances)
+
+    backfill = commands.add_parser('backfill-line-items', help="Заполнить order_items и direct_sale_items по истории (до rebuild-balances)")
+    backfill.add_argument('--batch-size', type=int, default=1000, help="Строк заказов за одну транзакцию")
+    backfill.set_defaults(func=cmd_backfill_line_items)
+
+    seed = commands.add_parser('seed-order-counters', help="Заполнить счётчики номеров заказов по существующим заказам")
+    seed.set_defaults(func=cmd_seed_order_counters)
+
+    webhook = commands.add_parser('set-webhook', help="Зарегистрировать webhook в Telegram")
+    webhook.add_argument('--force', action='store_true', help="Поставить заново, даже если адрес не изменился")
+    webhook.set_defaults(func=cmd_set_webhook)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
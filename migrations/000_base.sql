@@ -0,0 +1,124 @@
+-- Базовая схема складского бота: таблицы, с которыми работают models и обработчики.
+-- Таблица orders общая с ботом-магазином: здесь перечислены колонки, которые читает этот бот,
+-- остальные колонки магазин добавляет своими миграциями.
+-- На существующей базе ничего не меняет (IF NOT EXISTS).
+
+CREATE TABLE IF NOT EXISTS sellers (
+    id            SERIAL PRIMARY KEY,
+    name          VARCHAR(100) NOT NULL,
+    telegram_id   BIGINT UNIQUE,
+    seller_prefix VARCHAR(3)
+);
+
+CREATE TABLE IF NOT EXISTS products (
+    id                SERIAL PRIMARY KEY,
+    name              VARCHAR(200) NOT NULL,
+    purchase_price_kg NUMERIC(10, 2)
+);
+
+CREATE TABLE IF NOT EXISTS product_variants (
+    id             SERIAL PRIMARY KEY,
+    product_id     INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+    name           VARCHAR(100) NOT NULL,
+    price          INTEGER NOT NULL,
+    weight_kg      NUMERIC(10, 3) NOT NULL DEFAULT 0,
+    packaging_cost NUMERIC(10, 2) NOT NULL DEFAULT 0,
+    sort_order     INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id              SERIAL PRIMARY KEY,
+    order_number    VARCHAR(20) NOT NULL,
+    seller_id       INTEGER REFERENCES sellers(id),
+    items           JSONB NOT NULL DEFAULT '[]',
+    total           INTEGER NOT NULL DEFAULT 0,
+    contact         JSONB,
+    status          VARCHAR(20) NOT NULL DEFAULT 'new',
+    stock_processed BOOLEAN NOT NULL DEFAULT FALSE,
+    created_at      TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS seller_stock (
+    seller_id  INTEGER NOT NULL REFERENCES sellers(id),
+    product_id INTEGER NOT NULL REFERENCES products(id),
+    variant_id INTEGER NOT NULL REFERENCES product_variants(id),
+    quantity   INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (seller_id, product_id, variant_id)
+);
+
+CREATE TABLE IF NOT EXISTS stock_movements (
+    id              SERIAL PRIMARY KEY,
+    seller_id       INTEGER REFERENCES sellers(id),
+    product_id      INTEGER REFERENCES products(id),
+    variant_id      INTEGER REFERENCES product_variants(id),
+    quantity_change INTEGER NOT NULL,
+    reason          VARCHAR(50),
+    order_id        INTEGER,
+    created_at      TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS hub_stock (
+    product_id  INTEGER PRIMARY KEY REFERENCES products(id),
+    quantity_kg NUMERIC(12, 3) NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS purchases (
+    id            SERIAL PRIMARY KEY,
+    seller_id     INTEGER REFERENCES sellers(id),
+    total         NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    comment       TEXT,
+    purchase_date TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS purchase_items (
+    id           SERIAL PRIMARY KEY,
+    purchase_id  INTEGER NOT NULL REFERENCES purchases(id) ON DELETE CASCADE,
+    product_id   INTEGER NOT NULL REFERENCES products(id),
+    quantity_kg  NUMERIC(12, 3) NOT NULL,
+    price_per_kg NUMERIC(10, 2) NOT NULL,
+    total        NUMERIC(12, 2) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS packing_operations (
+    id             SERIAL PRIMARY KEY,
+    product_id     INTEGER NOT NULL REFERENCES products(id),
+    variant_id     INTEGER NOT NULL REFERENCES product_variants(id),
+    quantity_packs INTEGER NOT NULL,
+    weight_used    NUMERIC(12, 3) NOT NULL,
+    created_by     BIGINT,
+    created_at     TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS transfer_requests (
+    id             SERIAL PRIMARY KEY,
+    from_seller_id INTEGER NOT NULL REFERENCES sellers(id),
+    to_seller_id   INTEGER NOT NULL REFERENCES sellers(id),
+    status         VARCHAR(20) NOT NULL DEFAULT 'pending',
+    created_at     TIMESTAMP NOT NULL DEFAULT NOW(),
+    processed_at   TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS transfer_request_items (
+    id         SERIAL PRIMARY KEY,
+    request_id INTEGER NOT NULL REFERENCES transfer_requests(id) ON DELETE CASCADE,
+    variant_id INTEGER NOT NULL REFERENCES product_variants(id),
+    quantity   INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS seller_payments (
+    id               SERIAL PRIMARY KEY,
+    seller_id        INTEGER NOT NULL REFERENCES sellers(id),
+    amount           INTEGER NOT NULL,
+    confirmed_amount INTEGER,
+    status           VARCHAR(20) NOT NULL DEFAULT 'pending',
+    created_at       TIMESTAMP NOT NULL DEFAULT NOW(),
+    processed_at     TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS direct_sales (
+    id         SERIAL PRIMARY KEY,
+    seller_id  INTEGER NOT NULL REFERENCES sellers(id),
+    items      JSONB NOT NULL DEFAULT '[]',
+    total      INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,48 @@
+-- Цена продавца хранится в product_variants.price_seller и пересчитывается триггерами:
+-- price_seller = округление вверх до десятков ((price + purchase_price_kg * weight_kg + packaging_cost) / 2)
+-- Применение: python manage.py migrate
+
+ALTER TABLE product_variants ADD COLUMN IF NOT EXISTS price_seller INTEGER;
+
+CREATE OR REPLACE FUNCTION calc_price_seller(price NUMERIC, weight_kg NUMERIC, packaging_cost NUMERIC, purchase_price_kg NUMERIC)
+RETURNS INTEGER AS $$
+    SELECT (CEIL((price + COALESCE(purchase_price_kg, 0) * weight_kg + COALESCE(packaging_cost, 0)) / 20.0) * 10)::INTEGER
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Изменение варианта: пересчитываем его цену
+CREATE OR REPLACE FUNCTION product_variants_price_seller() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.price_seller := calc_price_seller(
+        NEW.price, NEW.weight_kg, NEW.packaging_cost,
+        (SELECT purchase_price_kg FROM products WHERE id = NEW.product_id)
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_product_variants_price_seller ON product_variants;
+CREATE TRIGGER trg_product_variants_price_seller
+    BEFORE INSERT OR UPDATE OF price, weight_kg, packaging_cost, product_id ON product_variants
+    FOR EACH ROW EXECUTE FUNCTION product_variants_price_seller();
+
+-- Изменение закупочной цены товара: пересчитываем все его варианты
+CREATE OR REPLACE FUNCTION products_price_seller() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE product_variants
+    SET price_seller = calc_price_seller(price, weight_kg, packaging_cost, NEW.purchase_price_kg)
+    WHERE product_id = NEW.id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_price_seller ON products;
+CREATE TRIGGER trg_products_price_seller
+    AFTER UPDATE OF purchase_price_kg ON products
+    FOR EACH ROW WHEN (OLD.purchase_price_kg IS DISTINCT FROM NEW.purchase_price_kg)
+    EXECUTE FUNCTION products_price_seller();
+
+-- Заполняем существующие варианты
+UPDATE product_variants v
+SET price_seller = calc_price_seller(v.price, v.weight_kg, v.packaging_cost, p.purchase_price_kg)
+FROM products p
+WHERE p.id = v.product_id;
@@ -0,0 +1,17 @@
+-- Накопительные суммы продавцов для расчёта долга и прибыли.
+-- Обновляются приложением при проведении заказа, прямой продаже и подтверждении выплаты.
+-- После применения заполнить строго по порядку (пересчёт читает order_items, до заполнения
+-- позиций суммы заказов получатся нулевыми):
+--   python manage.py migrate
+--   python manage.py backfill-line-items
+--   python manage.py rebuild-balances
+
+CREATE TABLE IF NOT EXISTS seller_balances (
+    seller_id     INTEGER PRIMARY KEY REFERENCES sellers(id),
+    orders_buyer  BIGINT NOT NULL DEFAULT 0,  -- проведённые заказы по цене покупателя
+    orders_seller BIGINT NOT NULL DEFAULT 0,  -- проведённые заказы по цене продавца
+    direct_buyer  BIGINT NOT NULL DEFAULT 0,  -- прямые продажи по цене покупателя
+    direct_seller BIGINT NOT NULL DEFAULT 0,  -- прямые продажи по цене продавца
+    paid          BIGINT NOT NULL DEFAULT 0,  -- подтверждённые выплаты
+    updated_at    TIMESTAMP NOT NULL DEFAULT NOW()
+);
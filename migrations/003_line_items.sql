@@ -0,0 +1,69 @@
+-- Позиции заказов и прямых продаж в обычных таблицах вместо разбора JSONB в каждом отчёте.
+-- orders.items и direct_sales.items остаются источником для бота-магазина и истории,
+-- строки таблиц позиций поддерживаются триггерами при любой записи items.
+-- После применения заполнить историю: python manage.py backfill-line-items,
+-- и только затем пересчитывать балансы (python manage.py rebuild-balances)
+
+CREATE TABLE IF NOT EXISTS order_items (
+    order_id     INTEGER NOT NULL REFERENCES orders(id) ON DELETE CASCADE,
+    line_no      INTEGER NOT NULL,
+    product_id   INTEGER,
+    variant_id   INTEGER,
+    quantity     INTEGER,
+    price        INTEGER,  -- цена покупателя
+    price_seller INTEGER,  -- цена продавца
+    PRIMARY KEY (order_id, line_no)
+);
+CREATE INDEX IF NOT EXISTS idx_order_items_variant ON order_items (variant_id);
+
+CREATE TABLE IF NOT EXISTS direct_sale_items (
+    sale_id      INTEGER NOT NULL REFERENCES direct_sales(id) ON DELETE CASCADE,
+    line_no      INTEGER NOT NULL,
+    product_id   INTEGER,
+    variant_id   INTEGER,
+    quantity     INTEGER,
+    price        INTEGER,
+    price_seller INTEGER,
+    PRIMARY KEY (sale_id, line_no)
+);
+CREATE INDEX IF NOT EXISTS idx_direct_sale_items_variant ON direct_sale_items (variant_id);
+
+-- В заказах магазина ключи productId/variantId, в прямых продажах product_id/variant_id
+CREATE OR REPLACE FUNCTION line_items_from_json(items JSONB)
+RETURNS TABLE (line_no INTEGER, product_id INTEGER, variant_id INTEGER, quantity INTEGER, price INTEGER, price_seller INTEGER) AS $$
+    SELECT i.ord::INTEGER,
+           COALESCE(i.item->>'productId', i.item->>'product_id')::INTEGER,
+           COALESCE(i.item->>'variantId', i.item->>'variant_id')::INTEGER,
+           (i.item->>'quantity')::INTEGER,
+           (i.item->>'price')::INTEGER,
+           (i.item->>'price_seller')::INTEGER
+    FROM jsonb_array_elements(COALESCE(items, '[]'::jsonb)) WITH ORDINALITY AS i(item, ord)
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION orders_sync_items() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM order_items WHERE order_id = NEW.id;
+    INSERT INTO order_items (order_id, line_no, product_id, variant_id, quantity, price, price_seller)
+    SELECT NEW.id, l.* FROM line_items_from_json(NEW.items) l;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_sync_items ON orders;
+CREATE TRIGGER trg_orders_sync_items
+    AFTER INSERT OR UPDATE OF items ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_sync_items();
+
+CREATE OR REPLACE FUNCTION direct_sales_sync_items() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM direct_sale_items WHERE sale_id = NEW.id;
+    INSERT INTO direct_sale_items (sale_id, line_no, product_id, variant_id, quantity, price, price_seller)
+    SELECT NEW.id, l.* FROM line_items_from_json(NEW.items) l;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_direct_sales_sync_items ON direct_sales;
+CREATE TRIGGER trg_direct_sales_sync_items
+    AFTER INSERT OR UPDATE OF items ON direct_sales
+    FOR EACH ROW EXECUTE FUNCTION direct_sales_sync_items();
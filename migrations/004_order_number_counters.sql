@@ -0,0 +1,8 @@
+-- Счётчики номеров заказов по префиксу: номер выдаётся одним UPDATE ... RETURNING
+-- вместо поиска последнего заказа по LIKE.
+-- После применения заполнить по существующим заказам: python manage.py seed-order-counters
+
+CREATE TABLE IF NOT EXISTS order_number_counters (
+    prefix      VARCHAR(3) PRIMARY KEY,
+    last_number INTEGER NOT NULL DEFAULT 0
+);
@@ -0,0 +1,34 @@
+-- Индексы под запросы models. Список имён продублирован в schema.REQUIRED_INDEXES,
+-- по нему python manage.py check-schema сообщает о недостающих индексах.
+
+-- Поиск заказа по номеру (подтверждение, редактирование, /api/order-completed)
+CREATE INDEX IF NOT EXISTS idx_orders_order_number ON orders (order_number);
+-- Заказы продавца по статусу и проведению (пересчёт балансов, отчёты)
+CREATE INDEX IF NOT EXISTS idx_orders_seller_status ON orders (seller_id, status, stock_processed);
+-- Непроведённые заказы: маленький индекс, растёт только очередь, а не история
+CREATE INDEX IF NOT EXISTS idx_orders_unprocessed ON orders (seller_id, created_at)
+    WHERE stock_processed = FALSE;
+
+-- Остаток варианта у продавца (get_seller_stock с variant_id, списания)
+CREATE INDEX IF NOT EXISTS idx_seller_stock_seller_variant ON seller_stock (seller_id, variant_id);
+-- Отрицательные остатки продавца
+CREATE INDEX IF NOT EXISTS idx_seller_stock_negative ON seller_stock (seller_id)
+    WHERE quantity < 0;
+
+-- Журнал движений по продавцу и варианту
+CREATE INDEX IF NOT EXISTS idx_stock_movements_seller_variant ON stock_movements (seller_id, variant_id);
+
+-- Очередь заявок на перемещение (для кладовщика и для админа)
+CREATE INDEX IF NOT EXISTS idx_transfer_requests_status ON transfer_requests (status, from_seller_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_transfer_requests_pending ON transfer_requests (from_seller_id, created_at DESC)
+    WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_transfer_request_items_request ON transfer_request_items (request_id);
+
+-- Выплаты продавца и очередь неподтверждённых выплат
+CREATE INDEX IF NOT EXISTS idx_seller_payments_seller_status ON seller_payments (seller_id, status);
+CREATE INDEX IF NOT EXISTS idx_seller_payments_pending ON seller_payments (created_at DESC)
+    WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS idx_direct_sales_seller ON direct_sales (seller_id);
+CREATE INDEX IF NOT EXISTS idx_product_variants_product ON product_variants (product_id, sort_order);
+CREATE INDEX IF NOT EXISTS idx_purchases_date ON purchases (purchase_date DESC);
@@ -0,0 +1,21 @@
+-- Исходящие уведомления: пишутся в той же транзакции, что и изменение данных,
+-- и доставляются фоновым отправителем (outbox.py) с повторами.
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id              BIGSERIAL PRIMARY KEY,
+    chat_id         BIGINT NOT NULL,
+    text            TEXT NOT NULL,
+    parse_mode      VARCHAR(20),
+    reply_markup    JSONB,
+    priority        SMALLINT NOT NULL DEFAULT 1,
+    status          VARCHAR(10) NOT NULL DEFAULT 'pending',  -- pending / sent / failed
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    locked_until    TIMESTAMP,  -- до этого времени строку отправляет взявший её процесс
+    last_error      TEXT,
+    created_at      TIMESTAMP NOT NULL DEFAULT NOW(),
+    sent_at         TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_pending ON notification_outbox (next_attempt_at)
+    WHERE status = 'pending';
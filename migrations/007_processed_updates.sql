@@ -0,0 +1,9 @@
+-- Недавно принятые update_id Telegram: общий фильтр повторной доставки для нескольких процессов.
+-- Старые строки удаляет сам бот (dedupe.UpdateDeduplicator).
+
+CREATE TABLE IF NOT EXISTS processed_updates (
+    update_id   BIGINT PRIMARY KEY,
+    received_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_processed_updates_received ON processed_updates (received_at);
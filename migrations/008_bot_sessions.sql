@@ -0,0 +1,12 @@
+-- Пошаговые сессии пользователей (SESSION_BACKEND=postgres): общие для нескольких процессов.
+-- Просроченные строки удаляет сам бот (sessions.SessionStore).
+
+CREATE TABLE IF NOT EXISTS bot_sessions (
+    kind       VARCHAR(32) NOT NULL,
+    user_id    BIGINT NOT NULL,
+    data       JSONB NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (kind, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_bot_sessions_expires ON bot_sessions (expires_at);
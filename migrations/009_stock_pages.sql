@@ -0,0 +1,3 @@
+-- Постраничные остатки: суммы по варианту для страницы общих остатков (models.get_total_stock_page)
+
+CREATE INDEX IF NOT EXISTS idx_seller_stock_variant ON seller_stock (variant_id);
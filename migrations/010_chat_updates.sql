@@ -0,0 +1,12 @@
+-- Общая очередь входящих обновлений (WEBHOOK_SHARED_QUEUE): при нескольких процессах
+-- обновления одного чата разбираются по порядку update_id тем процессом, который
+-- держит advisory-блокировку чата. Разобранные строки удаляет сам бот (dispatcher.UpdateDispatcher).
+
+CREATE TABLE IF NOT EXISTS chat_updates (
+    update_id   BIGINT PRIMARY KEY,
+    chat_id     BIGINT NOT NULL,
+    payload     TEXT NOT NULL,
+    received_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_updates_chat ON chat_updates (chat_id, update_id);
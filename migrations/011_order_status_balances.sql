@@ -0,0 +1,31 @@
+-- Смена статуса уже проведённого заказа (например, магазин отменил завершённый заказ)
+-- сразу поправляет seller_balances: суммы заказа вычитаются при уходе из 'completed'
+-- и добавляются обратно при возврате в него. Проведение заказа (stock_processed)
+-- по-прежнему учитывает models.mark_order_as_processed.
+
+CREATE OR REPLACE FUNCTION orders_status_balance() RETURNS TRIGGER AS $$
+DECLARE
+    direction INTEGER := CASE WHEN NEW.status = 'completed' THEN 1 ELSE -1 END;
+BEGIN
+    INSERT INTO seller_balances (seller_id, orders_buyer, orders_seller)
+    SELECT NEW.seller_id,
+           direction * COALESCE(SUM(i.price * i.quantity), 0),
+           direction * COALESCE(SUM(i.price_seller * i.quantity), 0)
+    FROM order_items i
+    WHERE i.order_id = NEW.id
+    ON CONFLICT (seller_id) DO UPDATE SET
+        orders_buyer = seller_balances.orders_buyer + EXCLUDED.orders_buyer,
+        orders_seller = seller_balances.orders_seller + EXCLUDED.orders_seller,
+        updated_at = NOW();
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_status_balance ON orders;
+CREATE TRIGGER trg_orders_status_balance
+    AFTER UPDATE OF status ON orders
+    FOR EACH ROW
+    WHEN (OLD.stock_processed IS TRUE AND NEW.stock_processed IS TRUE
+          AND NEW.seller_id IS NOT NULL
+          AND (COALESCE(OLD.status, '') = 'completed') <> (COALESCE(NEW.status, '') = 'completed'))
+    EXECUTE FUNCTION orders_status_balance();
@@ -0,0 +1,42 @@
+-- Цены в JSON позиций могут прийти дробными (бот-магазин пишет orders.items сам):
+-- разбираем их через NUMERIC с округлением до рубля, а не прямым ::INTEGER.
+-- Если позицию всё равно разобрать не удалось, триггер пишет предупреждение в лог
+-- сервера и не мешает записи заказа; такой заказ покажет
+-- python manage.py rebuild-balances --check (позиции не заполнены).
+
+CREATE OR REPLACE FUNCTION line_items_from_json(items JSONB)
+RETURNS TABLE (line_no INTEGER, product_id INTEGER, variant_id INTEGER, quantity INTEGER, price INTEGER, price_seller INTEGER) AS $$
+    SELECT i.ord::INTEGER,
+           COALESCE(i.item->>'productId', i.item->>'product_id')::INTEGER,
+           COALESCE(i.item->>'variantId', i.item->>'variant_id')::INTEGER,
+           (i.item->>'quantity')::INTEGER,
+           ROUND((i.item->>'price')::NUMERIC)::INTEGER,
+           ROUND((i.item->>'price_seller')::NUMERIC)::INTEGER
+    FROM jsonb_array_elements(COALESCE(items, '[]'::jsonb)) WITH ORDINALITY AS i(item, ord)
+$$ LANGUAGE SQL IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION orders_sync_items() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM order_items WHERE order_id = NEW.id;
+    BEGIN
+        INSERT INTO order_items (order_id, line_no, product_id, variant_id, quantity, price, price_seller)
+        SELECT NEW.id, l.* FROM line_items_from_json(NEW.items) l;
+    EXCEPTION WHEN data_exception THEN
+        RAISE WARNING 'order_items: не удалось разобрать позиции заказа %: %', NEW.id, SQLERRM;
+    END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION direct_sales_sync_items() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM direct_sale_items WHERE sale_id = NEW.id;
+    BEGIN
+        INSERT INTO direct_sale_items (sale_id, line_no, product_id, variant_id, quantity, price, price_seller)
+        SELECT NEW.id, l.* FROM line_items_from_json(NEW.items) l;
+    EXCEPTION WHEN data_exception THEN
+        RAISE WARNING 'direct_sale_items: не удалось разобрать позиции продажи %: %', NEW.id, SQLERRM;
+    END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,27 @@
+-- Версия каталога для catalog.CatalogCache: любой INSERT/UPDATE/DELETE/TRUNCATE
+-- в products и product_variants увеличивает её на единицу. Обновление строки
+-- версии сериализует правки, поэтому номер растёт в порядке фиксации транзакций.
+
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id      SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO catalog_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_catalog_version ON products;
+CREATE TRIGGER trg_products_catalog_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+
+DROP TRIGGER IF EXISTS trg_product_variants_catalog_version ON product_variants;
+CREATE TRIGGER trg_product_variants_catalog_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON product_variants
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
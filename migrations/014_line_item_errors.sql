@@ -0,0 +1,43 @@
+-- Заказы и прямые продажи, позиции которых триггер не смог разобрать (миграция 012).
+-- Такой заказ не проводится (models.mark_order_as_processed), пока позиции не исправлены;
+-- успешная повторная запись items удаляет строку отсюда.
+
+CREATE TABLE IF NOT EXISTS line_item_errors (
+    source      VARCHAR(20) NOT NULL,  -- orders | direct_sales
+    source_id   INTEGER NOT NULL,
+    error       TEXT NOT NULL,
+    recorded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (source, source_id)
+);
+
+CREATE OR REPLACE FUNCTION orders_sync_items() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM order_items WHERE order_id = NEW.id;
+    BEGIN
+        INSERT INTO order_items (order_id, line_no, product_id, variant_id, quantity, price, price_seller)
+        SELECT NEW.id, l.* FROM line_items_from_json(NEW.items) l;
+        DELETE FROM line_item_errors WHERE source = 'orders' AND source_id = NEW.id;
+    EXCEPTION WHEN data_exception THEN
+        RAISE WARNING 'order_items: не удалось разобрать позиции заказа %: %', NEW.id, SQLERRM;
+        INSERT INTO line_item_errors (source, source_id, error) VALUES ('orders', NEW.id, SQLERRM)
+        ON CONFLICT (source, source_id) DO UPDATE SET error = EXCLUDED.error, recorded_at = NOW();
+    END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION direct_sales_sync_items() RETURNS TRIGGER AS $$
+BEGIN
+    DELETE FROM direct_sale_items WHERE sale_id = NEW.id;
+    BEGIN
+        INSERT INTO direct_sale_items (sale_id, line_no, product_id, variant_id, quantity, price, price_seller)
+        SELECT NEW.id, l.* FROM line_items_from_json(NEW.items) l;
+        DELETE FROM line_item_errors WHERE source = 'direct_sales' AND source_id = NEW.id;
+    EXCEPTION WHEN data_exception THEN
+        RAISE WARNING 'direct_sale_items: не удалось разобрать позиции продажи %: %', NEW.id, SQLERRM;
+        INSERT INTO line_item_errors (source, source_id, error) VALUES ('direct_sales', NEW.id, SQLERRM)
+        ON CONFLICT (source, source_id) DO UPDATE SET error = EXCLUDED.error, recorded_at = NOW();
+    END;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -1,17 +1,15 @@
 # models.py
 import json
 import logging
-import math
 from datetime import datetime
-from database import get_db_connection
-from config import HUB_SELLER_ID, ADMIN_ID
+from database import get_db_connection, transaction, on_commit
+from config import HUB_SELLER_ID, ADMIN_ID, STOCK_AUDIT
+from catalog import catalog
+from seller_directory import sellers
+from stock_cache import stock_cache
 
 logger = logging.getLogger(__name__)
 
-def round_up_to_tens(value):
-    """Округляет число вверх до десятков"""
-    return math.ceil(value / 10) * 10
-
 # ========== Парсинг JSON ==========
 def parse_contact(contact_json):
     if isinstance(contact_json, dict):
@@ -31,244 +29,204 @@ def parse_items(items_json):
 
 # ========== Продавцы ==========
 def get_seller_by_telegram_id(telegram_id: int):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM sellers WHERE telegram_id = %s", (telegram_id,))
-            return cur.fetchone()
+    return sellers.get_by_telegram_id(telegram_id)
 
 def get_seller_by_id(seller_id: int):
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM sellers WHERE id = %s", (seller_id,))
-            return cur.fetchone()
+    return sellers.get_by_id(seller_id)
+
+def get_all_sellers():
+    """Все продавцы, отсортированные по имени"""
+    return sellers.get_all()
 
 # ========== Товары и варианты ==========
 def get_all_products():
-    """Возвращает список всех продуктов с их вариантами и рассчитанными ценами продавца"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT id, name, purchase_price_kg FROM products ORDER BY name")
-            products = cur.fetchall()
-            for p in products:
-                cur.execute("""
-                    SELECT 
-                        id, name, price, weight_kg, packaging_cost
-                    FROM product_variants
-                    WHERE product_id = %s
-                    ORDER BY sort_order
-                """, (p['id'],))
-                variants = cur.fetchall()
-                
-                # Рассчитываем price_seller для каждого варианта
-                for v in variants:
-                    base_cost = (p['purchase_price_kg'] * v['weight_kg']) + (v['packaging_cost'] or 0)
-                    avg_price = (v['price'] + base_cost) / 2
-                    v['price_seller'] = round_up_to_tens(avg_price)
-                
-                p['variants'] = variants
-            return products
+    """Возвращает список всех продуктов с их вариантами и ценами продавца"""
+    return catalog.get_all_products()
+
+def get_product_names():
+    """Возвращает {product_id: name} в порядке сортировки по названию"""
+    return catalog.get_product_names()
 
 def get_product_variants(product_id: int):
-    """Возвращает варианты товара с рассчитанными ценами продавца"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            # Получаем закупочную цену товара
-            cur.execute("SELECT purchase_price_kg FROM products WHERE id = %s", (product_id,))
-            product = cur.fetchone()
-            if not product:
-                return []
-            
-            purchase_price_kg = product['purchase_price_kg']
-            
-            cur.execute("""
-                SELECT id, name, price, weight_kg, packaging_cost
-                FROM product_variants
-                WHERE product_id = %s
-                ORDER BY sort_order
-            """, (product_id,))
-            variants = cur.fetchall()
-            
-            # Рассчитываем price_seller для каждого варианта
-            for v in variants:
-                base_cost = (purchase_price_kg * v['weight_kg']) + (v['packaging_cost'] or 0)
-                avg_price = (v['price'] + base_cost) / 2
-                v['price_seller'] = round_up_to_tens(avg_price)
-            
-            return variants
+    """Возвращает варианты товара с ценами продавца"""
+    return catalog.get_product_variants(product_id)
 
 def get_variant(variant_id: int):
-    """Возвращает информацию о варианте товара с рассчитанной ценой продавца"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 
-                    v.*, 
-                    p.name as product_name, 
-                    p.id as product_id,
-                    p.purchase_price_kg
-                FROM product_variants v
-                JOIN products p ON v.product_id = p.id
-                WHERE v.id = %s
-            """, (variant_id,))
-            variant = cur.fetchone()
-            
-            if variant:
-                # Рассчитываем price_seller
-                base_cost = (variant['purchase_price_kg'] * variant['weight_kg']) + (variant['packaging_cost'] or 0)
-                avg_price = (variant['price'] + base_cost) / 2
-                variant['price_seller'] = round_up_to_tens(avg_price)
-            
-            return variant
+    """Возвращает информацию о варианте товара с ценой продавца"""
+    return catalog.get_variant(variant_id)
 
 # ========== Остатки продавцов (в упаковках) ==========
 def get_seller_stock(seller_id: int, variant_id: int = None):
     """Если variant_id не указан, возвращает все варианты (в том числе с нулевым остатком)"""
+    if variant_id:
+        return stock_cache.quantity(seller_id, variant_id)
+    seller = sellers.get_by_id(seller_id)
+    seller_name = seller['name'] if seller else None
+    return [dict(row, seller_name=seller_name) for row in _seller_stock_rows(seller_id)]
+
+def _seller_stock_rows(seller_id: int):
+    """Все варианты (кроме россыпи) с остатком продавца в порядке (товар, вариант): из кэшей каталога и остатков"""
+    stock = stock_cache.quantities(seller_id)
+    rows = []
+    for product in catalog.get_all_products():
+        for v in product['variants']:
+            if v['name'] == 'Россыпь':
+                continue
+            rows.append({
+                'variant_id': v['id'],
+                'variant_name': v['name'],
+                'product_id': product['id'],
+                'product_name': product['name'],
+                'sort_order': v['sort_order'],
+                'price': v['price'],
+                'price_seller': v['price_seller'],
+                'quantity': stock.get(v['id'], 0),
+            })
+    rows.sort(key=_stock_row_key)
+    return rows
+
+def _stock_row_key(row):
+    return (row['product_name'], row['sort_order'], row['variant_id'])
+
+# Фильтры страниц остатков: условие на количество в SQL и для строк в памяти
+STOCK_FILTERS = {
+    'all': ("TRUE", lambda qty: True),
+    'nonzero': ("{qty} <> 0", lambda qty: qty != 0),
+    'negative': ("{qty} < 0", lambda qty: qty < 0),
+}
+
+def _stock_page(select_sql, qty_sql, params, after_variant_id, limit, only, product_id):
+    """Общая часть постраничных запросов остатков: ключ страницы (p.name, v.sort_order, v.id)"""
+    if only not in STOCK_FILTERS:
+        raise ValueError(f"Неизвестный фильтр остатков: {only}")
+    conditions = ["v.name != 'Россыпь'", STOCK_FILTERS[only][0].format(qty=qty_sql)]
+    params = list(params)
+    if product_id:
+        conditions.append("p.id = %s")
+        params.append(product_id)
+    if after_variant_id:
+        conditions.append("""(p.name, v.sort_order, v.id) > (
+            SELECT ap.name, av.sort_order, av.id
+            FROM product_variants av JOIN products ap ON ap.id = av.product_id
+            WHERE av.id = %s
+        )""")
+        params.append(after_variant_id)
+    params.append(limit + 1)
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            if variant_id:
-                cur.execute("""
-                    SELECT quantity FROM seller_stock
-                    WHERE seller_id = %s AND variant_id = %s
-                """, (seller_id, variant_id))
-                row = cur.fetchone()
-                return row['quantity'] if row else 0
-            else:
-                # Получаем все варианты (кроме россыпи) и их остатки
-                cur.execute("""
-                    SELECT 
-                        v.id as variant_id, 
-                        v.name as variant_name,
-                        p.id as product_id, 
-                        p.name as product_name,
-                        p.purchase_price_kg,
-                        v.price,
-                        v.weight_kg,
-                        v.packaging_cost,
-                        COALESCE(ss.quantity, 0) as quantity,
-                        s.name as seller_name
-                    FROM product_variants v
-                    JOIN products p ON v.product_id = p.id
-                    LEFT JOIN seller_stock ss ON ss.variant_id = v.id AND ss.seller_id = %s
-                    LEFT JOIN sellers s ON s.id = %s
-                    WHERE v.name != 'Россыпь'
-                    ORDER BY p.name, v.sort_order
-                """, (seller_id, seller_id))
-                
-                stocks = cur.fetchall()
-                
-                # Добавляем рассчитанную цену продавца
-                for row in stocks:
-                    base_cost = (row['purchase_price_kg'] * row['weight_kg']) + (row['packaging_cost'] or 0)
-                    avg_price = (row['price'] + base_cost) / 2
-                    row['price_seller'] = round_up_to_tens(avg_price)
-                
-                return stocks
+            cur.execute(
+                select_sql + " WHERE " + " AND ".join(conditions) +
+                " ORDER BY p.name, v.sort_order, v.id LIMIT %s",
+                params
+            )
+            rows = cur.fetchall()
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['variant_id']
+    return rows, None
+
+def get_seller_stock_page(seller_id: int, after_variant_id: int = None, limit: int = 30,
+                          only: str = 'all', product_id: int = None):
+    """Страница остатков продавца в порядке (товар, вариант).
+       after_variant_id — последний вариант предыдущей страницы, only: all | nonzero | negative.
+       Возвращает (строки, after_variant_id следующей страницы или None).
+       Собирается в памяти из кэшей каталога и остатков, без запроса к БД."""
+    if only not in STOCK_FILTERS:
+        raise ValueError(f"Неизвестный фильтр остатков: {only}")
+    matches = STOCK_FILTERS[only][1]
+    after_key = None
+    if after_variant_id:
+        after = catalog.get_variant(after_variant_id)
+        if after:
+            after_key = (after['product_name'], after['sort_order'], after['id'])
+    rows = [
+        row for row in _seller_stock_rows(seller_id)
+        if matches(row['quantity'])
+        and (not product_id or row['product_id'] == product_id)
+        and (after_key is None or _stock_row_key(row) > after_key)
+    ]
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['variant_id']
+    return rows, None
+
+def get_total_stock_page(after_variant_id: int = None, limit: int = 30,
+                         only: str = 'all', product_id: int = None):
+    """Страница суммарных остатков всех продавцов по вариантам, параметры как у get_seller_stock_page"""
+    return _stock_page("""
+        SELECT v.id as variant_id, v.name as variant_name,
+               p.id as product_id, p.name as product_name,
+               COALESCE(t.total, 0) as quantity
+        FROM product_variants v
+        JOIN products p ON v.product_id = p.id
+        LEFT JOIN LATERAL (
+            SELECT SUM(quantity) as total FROM seller_stock WHERE variant_id = v.id
+        ) t ON TRUE
+    """, "COALESCE(t.total, 0)", (), after_variant_id, limit, only, product_id)
 
 def get_seller_stock_with_check(seller_id: int, variant_id: int) -> int:
-    """Возвращает текущий остаток и проверяет наличие записи"""
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT quantity FROM seller_stock 
-                WHERE seller_id = %s AND variant_id = %s
-            """, (seller_id, variant_id))
-            row = cur.fetchone()
-            return row['quantity'] if row else 0
+    """Возвращает текущий остаток (0, если записи нет) для проверки наличия"""
+    return stock_cache.quantity(seller_id, variant_id)
 
 def decrease_seller_stock(seller_id: int, variant_id: int, quantity: int, reason: str, order_id: int = None):
     """Уменьшает остаток товара у продавца (списание)"""
     if quantity <= 0:
         return
-    variant = get_variant(variant_id)
-    if not variant:
-        raise ValueError(f"Variant {variant_id} not found")
-    product_id = variant['product_id']
-
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            # Проверяем текущий остаток перед списанием (для логирования)
-            cur.execute(
-                "SELECT quantity FROM seller_stock WHERE seller_id = %s AND product_id = %s AND variant_id = %s",
-                (seller_id, product_id, variant_id)
-            )
-            current = cur.fetchone()
-            current_qty = current['quantity'] if current else 0
-            
-            logger.info(f"💰 decrease_seller_stock: seller={seller_id}, variant={variant_id}, "
-                       f"product={product_id}, current={current_qty}, decrease_by={quantity}, reason={reason}")
-            
-            # Пытаемся обновить существующую запись
-            cur.execute(
-                "UPDATE seller_stock SET quantity = quantity - %s WHERE seller_id = %s AND product_id = %s AND variant_id = %s",
-                (quantity, seller_id, product_id, variant_id)
-            )
-            # Если запись не существовала, создаём с отрицательным значением
-            if cur.rowcount == 0:
-                logger.info(f"💰 decrease_seller_stock: создаём новую запись с отрицательным значением -{quantity}")
-                cur.execute("""
-                    INSERT INTO seller_stock (seller_id, product_id, variant_id, quantity)
-                    VALUES (%s, %s, %s, %s)
-                """, (seller_id, product_id, variant_id, -quantity))
-
-            # Записываем движение (отрицательное изменение)
-            cur.execute("""
-                INSERT INTO stock_movements (product_id, variant_id, quantity_change, reason, order_id, seller_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (product_id, variant_id, -quantity, reason, order_id, seller_id))
-            conn.commit()
-            
-            # Проверяем результат после списания
-            cur.execute(
-                "SELECT quantity FROM seller_stock WHERE seller_id = %s AND product_id = %s AND variant_id = %s",
-                (seller_id, product_id, variant_id)
-            )
-            new = cur.fetchone()
-            new_qty = new['quantity'] if new else 0
-            logger.info(f"💰 decrease_seller_stock: после операции new_quantity={new_qty}")
+    apply_stock_deltas(seller_id, [(variant_id, -quantity)], reason, order_id)
 
 def increase_seller_stock(seller_id: int, variant_id: int, quantity: int, reason: str, order_id: int = None):
     """Увеличивает остаток товара у продавца (поступление)"""
     if quantity <= 0:
         return
-    variant = get_variant(variant_id)
-    if not variant:
-        raise ValueError(f"Variant {variant_id} not found")
-    product_id = variant['product_id']
+    apply_stock_deltas(seller_id, [(variant_id, quantity)], reason, order_id)
+
+def apply_stock_deltas(seller_id: int, deltas, reason: str, order_id: int = None):
+    """Применяет пачку изменений остатков продавца одним запросом.
+       deltas: список пар (variant_id, delta), delta < 0 — списание, > 0 — поступление.
+       Возвращает словарь {variant_id: новый остаток}.
+    """
+    totals = {}
+    for variant_id, delta in deltas:
+        totals[variant_id] = totals.get(variant_id, 0) + delta
+    totals = {vid: delta for vid, delta in totals.items() if delta != 0}
+    if not totals:
+        return {}
+    variant_ids = list(totals)
 
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Проверяем текущий остаток перед добавлением (для логирования)
-            cur.execute(
-                "SELECT quantity FROM seller_stock WHERE seller_id = %s AND product_id = %s AND variant_id = %s",
-                (seller_id, product_id, variant_id)
-            )
-            current = cur.fetchone()
-            current_qty = current['quantity'] if current else 0
-            
-            logger.info(f"💰 increase_seller_stock: seller={seller_id}, variant={variant_id}, "
-                       f"product={product_id}, current={current_qty}, increase_by={quantity}, reason={reason}")
-            
+            # Движения и остатки пишутся одним запросом по всем позициям
             cur.execute("""
+                WITH deltas AS (
+                    SELECT d.variant_id, v.product_id, d.delta
+                    FROM UNNEST(%s::int[], %s::int[]) AS d(variant_id, delta)
+                    JOIN product_variants v ON v.id = d.variant_id
+                ), movements AS (
+                    INSERT INTO stock_movements (product_id, variant_id, quantity_change, reason, order_id, seller_id)
+                    SELECT product_id, variant_id, delta, %s, %s, %s FROM deltas
+                )
                 INSERT INTO seller_stock (seller_id, product_id, variant_id, quantity)
-                VALUES (%s, %s, %s, %s)
+                SELECT %s, product_id, variant_id, delta FROM deltas
                 ON CONFLICT (seller_id, product_id, variant_id)
                 DO UPDATE SET quantity = seller_stock.quantity + EXCLUDED.quantity
-            """, (seller_id, product_id, variant_id, quantity))
-            
-            cur.execute("""
-                INSERT INTO stock_movements (product_id, variant_id, quantity_change, reason, order_id, seller_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (product_id, variant_id, quantity, reason, order_id, seller_id))
+                RETURNING variant_id, quantity
+            """, (variant_ids, [totals[vid] for vid in variant_ids], reason, order_id, seller_id, seller_id))
+            quantities = {row['variant_id']: row['quantity'] for row in cur.fetchall()}
+
+            missing = [vid for vid in variant_ids if vid not in quantities]
+            if missing:
+                raise ValueError(f"Variants {missing} not found")
+            stock_cache.notify(cur, seller_id)
             conn.commit()
-            
-            # Проверяем результат после добавления
-            cur.execute(
-                "SELECT quantity FROM seller_stock WHERE seller_id = %s AND product_id = %s AND variant_id = %s",
-                (seller_id, product_id, variant_id)
-            )
-            new = cur.fetchone()
-            new_qty = new['quantity'] if new else 0
-            logger.info(f"💰 increase_seller_stock: после операции new_quantity={new_qty}")
+    on_commit(lambda: stock_cache.invalidate(seller_id))
+
+    # Остаток до операции восстанавливается из RETURNING: new - delta
+    if STOCK_AUDIT:
+        for vid in variant_ids:
+            logger.info(f"💰 stock audit: seller={seller_id}, variant={vid}, current={quantities[vid] - totals[vid]}, "
+                        f"change={totals[vid]}, new_quantity={quantities[vid]}, reason={reason}, order={order_id}")
+    else:
+        logger.debug(f"💰 apply_stock_deltas: seller={seller_id}, reason={reason}, order={order_id}, "
+                     f"позиций={len(variant_ids)}")
+    return quantities
 
 def get_negative_stock_summary(seller_id: int):
     with get_db_connection() as conn:
@@ -336,11 +294,75 @@ def get_order_by_number(order_number: str):
                 order['items'] = parse_items(order['items'])
             return order
 
-def mark_order_as_processed(order_id: int):
+def get_orders_by_numbers(order_numbers: list):
+    """Заказы по списку номеров одним запросом вместе с telegram_id продавца.
+       Возвращает {order_number: заказ}; ненайденных номеров в словаре нет.
+    """
+    if not order_numbers:
+        return {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT o.*, s.telegram_id as seller_telegram_id
+                FROM orders o
+                LEFT JOIN sellers s ON s.id = o.seller_id
+                WHERE o.order_number = ANY(%s)
+                ORDER BY o.id
+            """, (list(order_numbers),))
+            orders = {}
+            for order in cur.fetchall():
+                order['contact'] = parse_contact(order['contact'])
+                order['items'] = parse_items(order['items'])
+                orders[order['order_number']] = order
+            return orders
+
+def _check_line_items(cur, source: str, source_id: int):
+    """ValueError, если триггер не смог разобрать позиции (строка в line_item_errors):
+       без order_items / direct_sale_items суммы в seller_balances получились бы нулевыми"""
+    cur.execute(
+        "SELECT error FROM line_item_errors WHERE source = %s AND source_id = %s",
+        (source, source_id)
+    )
+    row = cur.fetchone()
+    if row:
+        raise ValueError(f"Позиции {source} {source_id} не разобраны: {row['error']}")
+
+def mark_order_as_processed(order_id: int) -> bool:
+    """Отмечает заказ проведённым и добавляет его суммы в seller_balances (однократно).
+       Возвращает False, если заказ уже был проведён: вызывать первым в транзакции
+       проведения и списывать остатки только при True. ValueError, если позиции заказа
+       не разобраны в order_items. Дальнейшую смену статуса проведённого заказа
+       учитывает триггер trg_orders_status_balance (миграция 011).
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            cur.execute("UPDATE orders SET stock_processed = TRUE WHERE id = %s", (order_id,))
+            _check_line_items(cur, 'orders', order_id)
+            cur.execute("""
+                WITH processed AS (
+                    UPDATE orders SET stock_processed = TRUE
+                    WHERE id = %s AND stock_processed IS NOT TRUE
+                    RETURNING id, seller_id, status
+                ), totals AS (
+                    SELECT p.seller_id,
+                           COALESCE(SUM(i.price * i.quantity), 0) as orders_buyer,
+                           COALESCE(SUM(i.price_seller * i.quantity), 0) as orders_seller
+                    FROM processed p
+                    JOIN order_items i ON i.order_id = p.id
+                    WHERE p.status = 'completed'
+                    GROUP BY p.seller_id
+                ), balances AS (
+                    INSERT INTO seller_balances (seller_id, orders_buyer, orders_seller)
+                    SELECT seller_id, orders_buyer, orders_seller FROM totals
+                    ON CONFLICT (seller_id) DO UPDATE SET
+                        orders_buyer = seller_balances.orders_buyer + EXCLUDED.orders_buyer,
+                        orders_seller = seller_balances.orders_seller + EXCLUDED.orders_seller,
+                        updated_at = NOW()
+                )
+                SELECT id FROM processed
+            """, (order_id,))
+            processed = cur.fetchone() is not None
             conn.commit()
+            return processed
 
 def update_order_total(order_id: int, new_total: int):
     """Обновляет общую сумму заказа"""
@@ -355,46 +377,64 @@ def update_order_total(order_id: int, new_total: int):
 # ========== Генерация номера заказа ==========
 def generate_order_number(seller_id: int, delivery_type: str = None) -> str:
     """Генерирует номер заказа на основе префикса продавца (макс. 3 символа)"""
+    # Если это доставка, используем префикс 'D'
+    if delivery_type == 'courier':
+        prefix = 'D'
+    else:
+        # Для самовывоза - берем префикс продавца
+        seller = get_seller_by_id(seller_id)
+        if not seller or not seller.get('seller_prefix'):
+            # Если префикс не задан, используем первую букву имени
+            prefix = seller['name'][0].upper()
+        else:
+            prefix = seller['seller_prefix']
+
+    # Обрезаем до 3 символов, если нужно
+    if len(prefix) > 3:
+        prefix = prefix[:3]
+
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Если это доставка, используем префикс 'D'
-            if delivery_type == 'courier':
-                prefix = 'D'
-            else:
-                # Для самовывоза - берем префикс продавца
-                cur.execute("SELECT seller_prefix FROM sellers WHERE id = %s", (seller_id,))
-                result = cur.fetchone()
-                
-                if not result or not result['seller_prefix']:
-                    # Если префикс не задан, используем первую букву имени
-                    cur.execute("SELECT name FROM sellers WHERE id = %s", (seller_id,))
-                    name = cur.fetchone()['name']
-                    prefix = name[0].upper()
-                else:
-                    prefix = result['seller_prefix']
-            
-            # Обрезаем до 3 символов, если нужно
-            if len(prefix) > 3:
-                prefix = prefix[:3]
-            
-            # Получаем последний номер для этого префикса
+            # Строка счётчика блокируется только до конца транзакции, номера не повторяются
             cur.execute("""
-                SELECT order_number FROM orders 
-                WHERE order_number LIKE %s 
-                ORDER BY id DESC LIMIT 1
-            """, (prefix + '%',))
-            
-            last = cur.fetchone()
-            if last:
-                num_str = last['order_number'][len(prefix):]
-                if num_str.isdigit():
-                    new_num = int(num_str) + 1
-                else:
-                    new_num = 1
-            else:
-                new_num = 1
-            
-            return f"{prefix}{new_num}"
+                UPDATE order_number_counters SET last_number = last_number + 1
+                WHERE prefix = %s
+                RETURNING last_number
+            """, (prefix,))
+            row = cur.fetchone()
+            if not row:
+                # Первый номер для префикса: продолжаем нумерацию существующих заказов
+                cur.execute("""
+                    INSERT INTO order_number_counters (prefix, last_number)
+                    SELECT %s, COALESCE(MAX(substring(order_number FROM %s)::int), 0) + 1
+                    FROM orders
+                    WHERE left(order_number, %s) = %s
+                      AND substring(order_number FROM %s) ~ '^[0-9]+$'
+                    ON CONFLICT (prefix) DO UPDATE SET last_number = order_number_counters.last_number + 1
+                    RETURNING last_number
+                """, (prefix, len(prefix) + 1, len(prefix), prefix, len(prefix) + 1))
+                row = cur.fetchone()
+            conn.commit()
+            return f"{prefix}{row['last_number']}"
+
+def seed_order_counters():
+    """Выставляет счётчики номеров по максимальным номерам существующих заказов.
+       Счётчик никогда не уменьшается. Возвращает {префикс: последний номер}.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO order_number_counters (prefix, last_number)
+                SELECT m[1], MAX(m[2]::int)
+                FROM orders, regexp_match(order_number, '^([^0-9]{1,3})([0-9]+)$') m
+                GROUP BY m[1]
+                ON CONFLICT (prefix) DO UPDATE
+                    SET last_number = GREATEST(order_number_counters.last_number, EXCLUDED.last_number)
+                RETURNING prefix, last_number
+            """)
+            counters = {row['prefix']: row['last_number'] for row in cur.fetchall()}
+            conn.commit()
+            return counters
 
 # ========== Заявки на перемещение (с поддержкой нескольких позиций) ==========
 
@@ -553,107 +593,183 @@ def get_all_pending_transfer_requests():
             return list(requests.values())
 
 # ========== Расчёты с продавцами ==========
-def get_seller_debt(seller_id: int):
-    """Долг продавца перед админом.
-       Для обычных продавцов: (продажи по цене продавца) + (прямые продажи по цене продавца) - выплаты.
-       Для кладовщика (HUB_SELLER_ID): (продажи по цене покупателя) + (прямые продажи по цене покупателя) - выплаты.
-    """
+def _add_to_seller_balance(cur, seller_id: int, orders_buyer=0, orders_seller=0,
+                           direct_buyer=0, direct_seller=0, paid=0):
+    """Прибавляет суммы к накопительному балансу продавца (в текущей транзакции)"""
+    cur.execute("""
+        INSERT INTO seller_balances (seller_id, orders_buyer, orders_seller, direct_buyer, direct_seller, paid)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        ON CONFLICT (seller_id) DO UPDATE SET
+            orders_buyer = seller_balances.orders_buyer + EXCLUDED.orders_buyer,
+            orders_seller = seller_balances.orders_seller + EXCLUDED.orders_seller,
+            direct_buyer = seller_balances.direct_buyer + EXCLUDED.direct_buyer,
+            direct_seller = seller_balances.direct_seller + EXCLUDED.direct_seller,
+            paid = seller_balances.paid + EXCLUDED.paid,
+            updated_at = NOW()
+    """, (seller_id, orders_buyer, orders_seller, direct_buyer, direct_seller, paid))
+
+def get_seller_balance(seller_id: int):
+    """Накопительные суммы продавца из seller_balances (нули, если записи нет)"""
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            if seller_id == HUB_SELLER_ID:
-                price_field_orders = "(i->>'price')::int"
-                price_field_direct = "(i->>'price')::int"
-            else:
-                price_field_orders = "(i->>'price_seller')::int"
-                price_field_direct = "(i->>'price_seller')::int"
-
-            # Продажи через заказы
-            cur.execute(f"""
-                SELECT COALESCE(SUM({price_field_orders} * (i->>'quantity')::int), 0) as total_sales
-                FROM orders o, jsonb_array_elements(o.items) i
-                WHERE o.seller_id = %s AND o.status = 'completed' AND o.stock_processed = TRUE
+            cur.execute("""
+                SELECT orders_buyer, orders_seller, direct_buyer, direct_seller, paid
+                FROM seller_balances WHERE seller_id = %s
             """, (seller_id,))
-            total_sales = cur.fetchone()['total_sales']
+            row = cur.fetchone()
+    if not row:
+        return {'orders_buyer': 0, 'orders_seller': 0, 'direct_buyer': 0, 'direct_seller': 0, 'paid': 0}
+    return {key: int(value) for key, value in row.items()}
 
-            # Прямые продажи
-            cur.execute(f"""
-                SELECT COALESCE(SUM({price_field_direct} * (i->>'quantity')::int), 0) as total_direct
-                FROM direct_sales ds, jsonb_array_elements(ds.items) i
-                WHERE ds.seller_id = %s
-            """, (seller_id,))
-            total_direct = cur.fetchone()['total_direct']
+def _debt_from_balance(seller_id: int, balance: dict):
+    if seller_id == HUB_SELLER_ID:
+        total_sales, total_direct = balance['orders_buyer'], balance['direct_buyer']
+    else:
+        total_sales, total_direct = balance['orders_seller'], balance['direct_seller']
+    total_paid = balance['paid']
+    debt = total_sales + total_direct - total_paid
+    return debt, total_sales, total_paid, total_direct
 
-            # Выплаты
-            cur.execute("""
-                SELECT COALESCE(SUM(confirmed_amount), 0) as total_paid
-                FROM seller_payments
-                WHERE seller_id = %s AND status = 'confirmed'
-            """, (seller_id,))
-            total_paid = cur.fetchone()['total_paid']
+def _profit_from_balance(seller_id: int, balance: dict):
+    total_buyer = balance['orders_buyer'] + balance['direct_buyer']
+    if seller_id == HUB_SELLER_ID:
+        # Для кладовщика считаем только продажи по цене покупателя
+        return 0, total_buyer, 0
+    total_seller = balance['orders_seller'] + balance['direct_seller']
+    return total_buyer - total_seller, total_buyer, total_seller
 
-            debt = total_sales + total_direct - total_paid
-            return debt, total_sales, total_paid, total_direct
+def get_seller_debt(seller_id: int):
+    """Долг продавца перед админом.
+       Для обычных продавцов: (продажи по цене продавца) + (прямые продажи по цене продавца) - выплаты.
+       Для кладовщика (HUB_SELLER_ID): (продажи по цене покупателя) + (прямые продажи по цене покупателя) - выплаты.
+    """
+    return _debt_from_balance(seller_id, get_seller_balance(seller_id))
 
 def get_seller_profit(seller_id: int):
     """Прибыль продавца = сумма продаж по цене покупателя - сумма продаж по цене продавца.
        Учитываются ВСЕ продажи (и заказы, и прямые продажи).
     """
-    with get_db_connection() as conn:
-        with conn.cursor() as cur:
-            if seller_id == HUB_SELLER_ID:
-                # Для кладовщика считаем только продажи по цене покупателя
-                cur.execute("""
-                    SELECT COALESCE(SUM((i->>'price')::int * (i->>'quantity')::int), 0) as total_buyer
-                    FROM orders o, jsonb_array_elements(o.items) i
-                    WHERE o.seller_id = %s AND o.status = 'completed' AND o.stock_processed = TRUE
-                """, (seller_id,))
-                total_buyer = cur.fetchone()['total_buyer']
+    profit, total_buyer, total_seller = _profit_from_balance(seller_id, get_seller_balance(seller_id))
+    logger.debug(f"💰 get_seller_profit для продавца {seller_id}: buyer={total_buyer}, seller={total_seller}, profit={profit}")
+    return profit, total_buyer, total_seller
 
-                cur.execute("""
-                    SELECT COALESCE(SUM((i->>'price')::int * (i->>'quantity')::int), 0) as direct_buyer
-                    FROM direct_sales ds, jsonb_array_elements(ds.items) i
-                    WHERE ds.seller_id = %s
-                """, (seller_id,))
-                direct_buyer = cur.fetchone()['direct_buyer']
-                total_buyer += direct_buyer
-                return 0, total_buyer, 0
-
-            # Для обычных продавцов - считаем ВСЕ продажи
-            # Сначала через direct_sales
-            cur.execute("""
-                SELECT 
-                    COALESCE(SUM((i->>'price')::int * (i->>'quantity')::int), 0) as direct_buyer,
-                    COALESCE(SUM((i->>'price_seller')::int * (i->>'quantity')::int), 0) as direct_seller
-                FROM direct_sales ds, jsonb_array_elements(ds.items) i
-                WHERE ds.seller_id = %s
-            """, (seller_id,))
-            direct_row = cur.fetchone()
-            
-            # Затем через заказы
+def rebuild_seller_balances(check_only: bool = False):
+    """Пересчитывает seller_balances по всей истории.
+       Возвращает список расхождений [(seller_id, сохранено, по истории)] до пересчёта.
+       При check_only=True только сверяет, ничего не меняя.
+    """
+    columns = ('orders_buyer', 'orders_seller', 'direct_buyer', 'direct_seller', 'paid')
+    with transaction() as conn:
+        with conn.cursor() as cur:
+            cur.execute("LOCK TABLE seller_balances IN EXCLUSIVE MODE")
             cur.execute("""
-                SELECT 
-                    COALESCE(SUM((i->>'price')::int * (i->>'quantity')::int), 0) as orders_buyer,
-                    COALESCE(SUM((i->>'price_seller')::int * (i->>'quantity')::int), 0) as orders_seller
-                FROM orders o, jsonb_array_elements(o.items) i
-                WHERE o.seller_id = %s AND o.status = 'completed' AND o.stock_processed = TRUE
-            """, (seller_id,))
-            orders_row = cur.fetchone()
+                SELECT s.id as seller_id,
+                       COALESCE(o.buyer, 0) as orders_buyer, COALESCE(o.seller, 0) as orders_seller,
+                       COALESCE(d.buyer, 0) as direct_buyer, COALESCE(d.seller, 0) as direct_seller,
+                       COALESCE(p.paid, 0) as paid
+                FROM sellers s
+                LEFT JOIN (
+                    SELECT o.seller_id,
+                           SUM(i.price * i.quantity) as buyer,
+                           SUM(i.price_seller * i.quantity) as seller
+                    FROM orders o
+                    JOIN order_items i ON i.order_id = o.id
+                    WHERE o.status = 'completed' AND o.stock_processed = TRUE
+                    GROUP BY o.seller_id
+                ) o ON o.seller_id = s.id
+                LEFT JOIN (
+                    SELECT ds.seller_id,
+                           SUM(i.price * i.quantity) as buyer,
+                           SUM(i.price_seller * i.quantity) as seller
+                    FROM direct_sales ds
+                    JOIN direct_sale_items i ON i.sale_id = ds.id
+                    GROUP BY ds.seller_id
+                ) d ON d.seller_id = s.id
+                LEFT JOIN (
+                    SELECT seller_id, SUM(confirmed_amount) as paid
+                    FROM seller_payments
+                    WHERE status = 'confirmed'
+                    GROUP BY seller_id
+                ) p ON p.seller_id = s.id
+            """)
+            actual = {row['seller_id']: tuple(int(row[c]) for c in columns) for row in cur.fetchall()}
 
-            total_buyer = direct_row['direct_buyer'] + orders_row['orders_buyer']
-            total_seller = direct_row['direct_seller'] + orders_row['orders_seller']
+            cur.execute(f"SELECT seller_id, {', '.join(columns)} FROM seller_balances")
+            stored = {row['seller_id']: tuple(int(row[c]) for c in columns) for row in cur.fetchall()}
 
-            # Логируем для отладки
-            logger.info(f"💰 get_seller_profit для продавца {seller_id}:")
-            logger.info(f"   direct_buyer = {direct_row['direct_buyer']}")
-            logger.info(f"   direct_seller = {direct_row['direct_seller']}")
-            logger.info(f"   orders_buyer = {orders_row['orders_buyer']}")
-            logger.info(f"   orders_seller = {orders_row['orders_seller']}")
-            logger.info(f"   total_buyer = {total_buyer}")
-            logger.info(f"   total_seller = {total_seller}")
-            logger.info(f"   profit = {total_buyer - total_seller}")
+            zero = (0,) * len(columns)
+            mismatches = [
+                (seller_id, stored.get(seller_id, zero), actual.get(seller_id, zero))
+                for seller_id in sorted(set(actual) | set(stored))
+                if stored.get(seller_id, zero) != actual.get(seller_id, zero)
+            ]
+            if check_only:
+                return mismatches
 
-            profit = total_buyer - total_seller
-            return profit, total_buyer, total_seller
+            cur.execute("DELETE FROM seller_balances")
+            for seller_id, values in actual.items():
+                _add_to_seller_balance(cur, seller_id, *values)
+    logger.info(f"💰 seller_balances пересчитаны, расхождений: {len(mismatches)}")
+    return mismatches
+
+def count_missing_line_items():
+    """Сколько заказов и прямых продаж с позициями в JSON ещё не имеют строк в
+       order_items / direct_sale_items (не выполнен backfill_line_items).
+       Возвращает {таблица: количество}.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT
+                    (SELECT count(*) FROM orders o
+                     WHERE jsonb_array_length(COALESCE(o.items, '[]'::jsonb)) > 0
+                       AND NOT EXISTS (SELECT 1 FROM order_items i WHERE i.order_id = o.id)) as order_items,
+                    (SELECT count(*) FROM direct_sales ds
+                     WHERE jsonb_array_length(COALESCE(ds.items, '[]'::jsonb)) > 0
+                       AND NOT EXISTS (SELECT 1 FROM direct_sale_items i WHERE i.sale_id = ds.id)) as direct_sale_items
+            """)
+            row = cur.fetchone()
+            return {'order_items': row['order_items'], 'direct_sale_items': row['direct_sale_items']}
+
+def backfill_line_items(batch_size: int = 1000):
+    """Заполняет order_items и direct_sale_items по JSON истории.
+       Идёт пачками по id, каждая пачка — своя короткая транзакция; повторный запуск безопасен.
+       Возвращает {таблица: добавлено строк}.
+    """
+    sources = (
+        ('orders', 'order_items', 'order_id'),
+        ('direct_sales', 'direct_sale_items', 'sale_id'),
+    )
+    inserted = {}
+    for source, target, key in sources:
+        last_id = 0
+        inserted[target] = 0
+        while True:
+            with get_db_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(f"""
+                        WITH batch AS (
+                            SELECT id, items FROM {source}
+                            WHERE id > %s
+                            ORDER BY id
+                            LIMIT %s
+                        ), ins AS (
+                            INSERT INTO {target} ({key}, line_no, product_id, variant_id, quantity, price, price_seller)
+                            SELECT b.id, l.* FROM batch b, line_items_from_json(b.items) l
+                            ON CONFLICT DO NOTHING
+                            RETURNING 1
+                        )
+                        SELECT (SELECT max(id) FROM batch) as last_id,
+                               (SELECT count(*) FROM ins) as inserted
+                    """, (last_id, batch_size))
+                    row = cur.fetchone()
+                    conn.commit()
+            if row['last_id'] is None:
+                break
+            last_id = row['last_id']
+            inserted[target] += row['inserted']
+            logger.info(f"🧾 {target}: обработано до id {last_id}, добавлено {inserted[target]}")
+    return inserted
 
 def create_payment_request(seller_id: int, amount: int) -> int:
     with get_db_connection() as conn:
@@ -676,16 +792,32 @@ def get_payment_request(payment_id: int):
 def update_payment_status(payment_id: int, status: str, confirmed_amount: int = None):
     with get_db_connection() as conn:
         with conn.cursor() as cur:
+            # Прежнее состояние нужно, чтобы поправить баланс на разницу
+            cur.execute(
+                "SELECT seller_id, status, confirmed_amount FROM seller_payments WHERE id = %s FOR UPDATE",
+                (payment_id,)
+            )
+            old = cur.fetchone()
+            if not old:
+                return
             if confirmed_amount is not None:
                 cur.execute("""
                     UPDATE seller_payments SET status = %s, confirmed_amount = %s, processed_at = %s
                     WHERE id = %s
+                    RETURNING status, confirmed_amount
                 """, (status, confirmed_amount, datetime.utcnow().isoformat(), payment_id))
             else:
                 cur.execute("""
                     UPDATE seller_payments SET status = %s, processed_at = %s
                     WHERE id = %s
+                    RETURNING status, confirmed_amount
                 """, (status, datetime.utcnow().isoformat(), payment_id))
+            new = cur.fetchone()
+
+            old_paid = (old['confirmed_amount'] or 0) if old['status'] == 'confirmed' else 0
+            new_paid = (new['confirmed_amount'] or 0) if new['status'] == 'confirmed' else 0
+            if new_paid != old_paid:
+                _add_to_seller_balance(cur, old['seller_id'], paid=new_paid - old_paid)
             conn.commit()
 
 # ========== Прямые продажи ==========
@@ -699,6 +831,17 @@ def create_direct_sale(seller_id: int, items: list, total: int) -> int:
                 RETURNING id
             """, (seller_id, items_json, total))
             sale_id = cur.fetchone()['id']
+            _check_line_items(cur, 'direct_sales', sale_id)
+            # Суммы берутся из direct_sale_items, заполненных триггером, — как и в rebuild_seller_balances
+            cur.execute("""
+                INSERT INTO seller_balances (seller_id, direct_buyer, direct_seller)
+                SELECT %s, COALESCE(SUM(price * quantity), 0), COALESCE(SUM(price_seller * quantity), 0)
+                FROM direct_sale_items WHERE sale_id = %s
+                ON CONFLICT (seller_id) DO UPDATE SET
+                    direct_buyer = seller_balances.direct_buyer + EXCLUDED.direct_buyer,
+                    direct_seller = seller_balances.direct_seller + EXCLUDED.direct_seller,
+                    updated_at = NOW()
+            """, (seller_id, sale_id))
             conn.commit()
             return sale_id
 
@@ -708,7 +851,8 @@ def create_purchase(seller_id: int, items: list, total: int, comment: str = "")
     items: список словарей с полями:
         product_id, quantity_kg (сколько кг закуплено), price_per_kg
     """
-    with get_db_connection() as conn:
+    # Одна транзакция на закупку: increase_hub_stock работает в том же соединении
+    with transaction() as conn:
         with conn.cursor() as cur:
             cur.execute("""
                 INSERT INTO purchases (seller_id, total, comment)
@@ -783,6 +927,7 @@ def create_packing_operation(product_id: int, variant_id: int, quantity_packs: i
                 ON CONFLICT (seller_id, product_id, variant_id)
                 DO UPDATE SET quantity = seller_stock.quantity + EXCLUDED.quantity
             """, (HUB_SELLER_ID, product_id, variant_id, quantity_packs))
+            stock_cache.notify(cur, HUB_SELLER_ID)
 
             # Записываем операцию
             cur.execute("""
@@ -792,7 +937,8 @@ def create_packing_operation(product_id: int, variant_id: int, quantity_packs: i
             """, (product_id, variant_id, quantity_packs, weight_used, created_by))
             op_id = cur.fetchone()['id']
             conn.commit()
-            return op_id
+    on_commit(lambda: stock_cache.invalidate(HUB_SELLER_ID))
+    return op_id
 
 # ========== Расширенные функции для админа ==========
 def get_all_sellers_stock():
@@ -813,23 +959,49 @@ def get_all_sellers_stock():
             return cur.fetchall()
 
 def get_total_payments_stats():
+    """Финансовая сводка одним запросом.
+       Возвращает (всего выплачено, общий долг продавцов, детали по продавцам).
+       Детали — список словарей с долгом и прибылью каждого продавца в порядке имён.
+    """
     with get_db_connection() as conn:
         with conn.cursor() as cur:
-            # Все подтверждённые выплаты
-            cur.execute("SELECT COALESCE(SUM(confirmed_amount), 0) as total_paid FROM seller_payments WHERE status = 'confirmed'")
-            total_paid = cur.fetchone()['total_paid']
-            
-            # Общий долг всех продавцов (сумма их долгов)
-            # Сначала получаем всех продавцов (кроме администратора)
-            cur.execute("SELECT id FROM sellers WHERE id != %s", (ADMIN_ID,))
-            sellers = cur.fetchall()
-            
-            total_debt = 0
-            for seller in sellers:
-                debt, _, _, _ = get_seller_debt(seller['id'])
-                total_debt += debt
-            
-            return total_paid, total_debt
+            cur.execute("""
+                SELECT s.id as seller_id, s.name,
+                       COALESCE(b.orders_buyer, 0) as orders_buyer,
+                       COALESCE(b.orders_seller, 0) as orders_seller,
+                       COALESCE(b.direct_buyer, 0) as direct_buyer,
+                       COALESCE(b.direct_seller, 0) as direct_seller,
+                       COALESCE(b.paid, 0) as paid
+                FROM sellers s
+                LEFT JOIN seller_balances b ON b.seller_id = s.id
+                ORDER BY s.name
+            """)
+            rows = cur.fetchall()
+
+    total_paid = 0
+    total_debt = 0
+    breakdown = []
+    for row in rows:
+        balance = {key: int(row[key]) for key in ('orders_buyer', 'orders_seller', 'direct_buyer', 'direct_seller', 'paid')}
+        debt, total_sales, seller_paid, total_direct = _debt_from_balance(row['seller_id'], balance)
+        profit, total_buyer, total_seller = _profit_from_balance(row['seller_id'], balance)
+        # Все подтверждённые выплаты
+        total_paid += seller_paid
+        # Общий долг всех продавцов (кроме администратора)
+        if row['seller_id'] != ADMIN_ID:
+            total_debt += debt
+        breakdown.append({
+            'seller_id': row['seller_id'],
+            'name': row['name'],
+            'debt': debt,
+            'total_sales': total_sales,
+            'total_paid': seller_paid,
+            'total_direct': total_direct,
+            'profit': profit,
+            'total_buyer': total_buyer,
+            'total_seller': total_seller
+        })
+    return total_paid, total_debt, breakdown
 
 def get_pending_payments():
     with get_db_connection() as conn:
@@ -846,3 +1018,47 @@ def get_pending_payments():
                 if row['created_at']:
                     row['created_at'] = str(row['created_at'])
             return rows
+
+# ========== Исходящие уведомления ==========
+def enqueue_notification(chat_id: int, text: str, parse_mode: str = None, reply_markup=None, priority: int = 1) -> int:
+    """Ставит уведомление в notification_outbox.
+       Внутри transaction() запись фиксируется вместе с остальными изменениями,
+       отправляет её outbox.OutboxRelay. reply_markup — клавиатура telebot или dict.
+    """
+    return enqueue_notifications([{
+        'chat_id': chat_id, 'text': text, 'parse_mode': parse_mode,
+        'reply_markup': reply_markup, 'priority': priority
+    }])[0]
+
+def enqueue_notifications(notifications: list) -> list:
+    """Ставит пачку уведомлений одним INSERT. notifications — словари с ключами
+       chat_id, text и необязательными parse_mode, reply_markup, priority.
+       Возвращает id в том же порядке.
+    """
+    if not notifications:
+        return []
+    markups = []
+    for n in notifications:
+        markup = n.get('reply_markup')
+        if markup is not None and hasattr(markup, 'to_dict'):
+            markup = markup.to_dict()
+        markups.append(json.dumps(markup) if markup is not None else None)
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO notification_outbox (chat_id, text, parse_mode, reply_markup, priority)
+                SELECT n.chat_id, n.text, n.parse_mode, n.reply_markup::jsonb, n.priority
+                FROM UNNEST(%s::bigint[], %s::text[], %s::text[], %s::text[], %s::smallint[])
+                     WITH ORDINALITY AS n(chat_id, text, parse_mode, reply_markup, priority, ord)
+                ORDER BY n.ord
+                RETURNING id
+            """, (
+                [n['chat_id'] for n in notifications],
+                [n['text'] for n in notifications],
+                [n.get('parse_mode') for n in notifications],
+                markups,
+                [n.get('priority', 1) for n in notifications]
+            ))
+            ids = [row['id'] for row in cur.fetchall()]
+            conn.commit()
+            return ids
@@ -1,4 +1,5 @@
 from telebot import types
+from telebot.apihelper import ApiTelegramException
 
 def send_negative_stock_warning(bot, chat_id, seller_id):
     from models import get_negative_stock_summary
@@ -14,3 +15,96 @@ def send_negative_stock_warning(bot, chat_id, seller_id):
         f"Сейчас ваши остатки ушли в минус:\n{summary}",
         parse_mode='Markdown'
     )
+
+def format_order_items(items):
+    lines = []
+    for item in items:
+        if item.get('variantName'):
+            lines.append(f"• {item['name']} ({item['variantName']}): {item['quantity']} шт")
+        else:
+            lines.append(f"• {item['name']}: {item['quantity']} шт")
+    return "\n".join(lines)
+
+def order_actions_markup(order_number):
+    markup = types.InlineKeyboardMarkup()
+    markup.row(
+        types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_{order_number}"),
+        types.InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_{order_number}")
+    )
+    return markup
+
+# Подписи кнопок фильтра на страницах остатков (ключи — models.STOCK_FILTERS)
+STOCK_FILTER_LABELS = {'all': "Все", 'nonzero': "Не нули", 'negative': "Минус"}
+
+def format_stock_lines(rows):
+    lines = []
+    for row in rows:
+        if row['quantity'] > 0:
+            lines.append(f"• {row['product_name']} ({row['variant_name']}): {row['quantity']} шт")
+        elif row['quantity'] < 0:
+            lines.append(f"• {row['product_name']} ({row['variant_name']}): {row['quantity']} шт (❗ минус)")
+        else:
+            lines.append(f"• {row['product_name']} ({row['variant_name']}): 0 шт")
+    return "\n".join(lines)
+
+def stock_page_markup(prefix, only, next_after, first_page):
+    """Фильтры и листание страницы остатков; callback_data: {prefix}_{фильтр}_{после какого варианта}"""
+    markup = types.InlineKeyboardMarkup()
+    markup.row(*[
+        types.InlineKeyboardButton(("✅ " if key == only else "") + label, callback_data=f"{prefix}_{key}_0")
+        for key, label in STOCK_FILTER_LABELS.items()
+    ])
+    nav = []
+    if not first_page:
+        nav.append(types.InlineKeyboardButton("⏮ В начало", callback_data=f"{prefix}_{only}_0"))
+    if next_after:
+        nav.append(types.InlineKeyboardButton("Далее ▶️", callback_data=f"{prefix}_{only}_{next_after}"))
+    if nav:
+        markup.row(*nav)
+    return markup
+
+def edit_stock_page(bot, call, text, markup):
+    """Показывает страницу остатков в том же сообщении"""
+    try:
+        bot.edit_message_text(
+            text, call.message.chat.id, call.message.message_id,
+            parse_mode='Markdown', reply_markup=markup
+        )
+    except ApiTelegramException as e:
+        # Повторное нажатие текущего фильтра: содержимое не изменилось
+        if 'message is not modified' not in str(e):
+            raise
+    bot.answer_callback_query(call.id)
+
+def order_completed_notification(order, chat_id):
+    """Уведомление продавцу о завершённом заказе для enqueue_notification(s)"""
+    return {
+        'chat_id': chat_id,
+        'text': (
+            f"📦 *Заказ {order['order_number']} завершён!*\n\n"
+            f"{format_order_items(order['items'])}\n\n"
+            "Зафиксируйте продажу:"
+        ),
+        'parse_mode': 'Markdown',
+        'reply_markup': order_actions_markup(order['order_number'])
+    }
+
+def confirm_payment(bot, payment, amount):
+    """Подтверждает выплату и ставит уведомление продавцу в той же транзакции"""
+    from models import get_seller_by_id, get_seller_debt, update_payment_status, enqueue_notification
+    from database import transaction
+    from outbox import get_relay
+    seller = get_seller_by_id(payment['seller_id'])
+    with transaction():
+        update_payment_status(payment['id'], 'confirmed', confirmed_amount=amount)
+        # Продавец без Telegram: уведомлять некого, а NULL в chat_id откатил бы подтверждение
+        if seller and seller['telegram_id']:
+            debt, _, _, _ = get_seller_debt(payment['seller_id'])
+            enqueue_notification(
+                seller['telegram_id'],
+                f"✅ Админ подтвердил получение *{amount} руб.*\n"
+                f"Ваш долг составляет *{debt} руб.*",
+                parse_mode='Markdown'
+            )
+    get_relay(bot).wake()
+    return seller
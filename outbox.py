@@ -0,0 +1,200 @@
+# outbox.py
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Ошибки Telegram, после которых повторять бесполезно (бот заблокирован, чат не найден)
+PERMANENT_ERROR_CODES = {400, 403}
+
+
+class OutboxRelay:
+    """Доставляет уведомления из notification_outbox через MessageSender.
+
+    Поток забирает пачку готовых строк с арендой (FOR UPDATE SKIP LOCKED), поэтому
+    несколько процессов не отправят одно уведомление дважды. В очереди отправки
+    одновременно не больше batch_size уведомлений; пока они ждут своей очереди
+    (в один чат — не чаще SEND_CHAT_RATE), аренда продлевается каждые lease/3 секунд,
+    иначе её могли бы перехватить другой процесс или этот же поток. Результаты
+    отправки копятся и записываются пачкой; неудачные попытки повторяются с растущей
+    паузой, после max_attempts уведомление помечается failed.
+    """
+
+    def __init__(self, sender, batch_size=50, poll_interval=1.0, lease=120, max_attempts=8):
+        self.sender = sender
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._results = deque()  # (id, ok, ошибка, окончательно)
+        self._in_flight = set()  # id уведомлений, переданных в MessageSender
+        self._renewed_at = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+        self._thread.start()
+        logger.info("📮 Отправка уведомлений из outbox запущена")
+
+    def wake(self):
+        """Проверить outbox, не дожидаясь очередного интервала"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self._flush_results()
+                self._renew_lease()
+                with self._lock:
+                    free = self.batch_size - len(self._in_flight)
+                    in_flight = list(self._in_flight)
+                if free > 0:
+                    claimed = self._claim(free, in_flight)
+                    for row in claimed:
+                        self._submit(row)
+                    if len(claimed) == free:
+                        continue
+            except Exception as e:
+                logger.exception(f"Ошибка отправки уведомлений из outbox: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+        self._flush_results()
+
+    def _claim(self, limit, in_flight):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE notification_outbox
+                    SET locked_until = NOW() + make_interval(secs => %s), attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT id FROM notification_outbox
+                        WHERE status = 'pending' AND next_attempt_at <= NOW()
+                          AND (locked_until IS NULL OR locked_until < NOW())
+                          AND id <> ALL(%s::bigint[])
+                        ORDER BY priority, id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, chat_id, text, parse_mode, reply_markup, priority, attempts
+                """, (self.lease, in_flight, limit))
+                rows = cur.fetchall()
+                conn.commit()
+        rows.sort(key=lambda row: row['id'])
+        return rows
+
+    def _renew_lease(self):
+        """Продлевает аренду уведомлений, которые ещё ждут в очереди отправки"""
+        now = time.monotonic()
+        if now - self._renewed_at < self.lease / 3:
+            return
+        self._renewed_at = now
+        with self._lock:
+            in_flight = list(self._in_flight)
+        if not in_flight:
+            return
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE notification_outbox
+                    SET locked_until = NOW() + make_interval(secs => %s)
+                    WHERE id = ANY(%s::bigint[]) AND status = 'pending'
+                """, (self.lease, in_flight))
+                conn.commit()
+
+    def _submit(self, row):
+        kwargs = {}
+        if row['parse_mode']:
+            kwargs['parse_mode'] = row['parse_mode']
+        if row['reply_markup'] is not None:
+            kwargs['reply_markup'] = json.dumps(row['reply_markup'])
+
+        def on_done(ok, result):
+            final = ok or row['attempts'] >= self.max_attempts or (
+                isinstance(result, ApiTelegramException) and result.error_code in PERMANENT_ERROR_CODES
+            )
+            with self._lock:
+                self._in_flight.discard(row['id'])
+                self._results.append((row['id'], ok, None if ok else str(result), final))
+            self._wakeup.set()
+
+        with self._lock:
+            self._in_flight.add(row['id'])
+        if not self.sender.submit(row['chat_id'], row['text'], priority=row['priority'], callback=on_done, **kwargs):
+            on_done(False, "очередь отправки переполнена")
+
+    def _flush_results(self):
+        with self._lock:
+            results = list(self._results)
+            self._results.clear()
+        if not results:
+            return
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE notification_outbox o
+                    SET status = CASE WHEN r.ok THEN 'sent' WHEN r.final THEN 'failed' ELSE 'pending' END,
+                        sent_at = CASE WHEN r.ok THEN NOW() END,
+                        last_error = r.error,
+                        locked_until = NULL,
+                        next_attempt_at = CASE WHEN r.ok OR r.final THEN o.next_attempt_at
+                                          ELSE NOW() + make_interval(secs => LEAST(POWER(2, o.attempts), 600)) END
+                    FROM UNNEST(%s::bigint[], %s::bool[], %s::text[], %s::bool[]) AS r(id, ok, error, final)
+                    WHERE o.id = r.id
+                """, (
+                    [r[0] for r in results], [r[1] for r in results],
+                    [r[2] for r in results], [r[3] for r in results]
+                ))
+                conn.commit()
+        failed = sum(1 for r in results if not r[1])
+        if failed:
+            logger.warning(f"⚠️ Не доставлено уведомлений: {failed} из {len(results)}")
+
+    def stop(self, timeout=10.0):
+        """Перестаёт брать новые уведомления, досылает уже взятые и сохраняет результаты"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.sender.shutdown(timeout)
+        self._flush_results()
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': len(self._in_flight), 'unsaved_results': len(self._results)}
+
+
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def get_relay(bot):
+    """Общий отправитель outbox процесса, запускается при первом обращении"""
+    global _relay
+    if _relay is None:
+        with _relay_lock:
+            if _relay is None:
+                from config import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL, OUTBOX_MAX_ATTEMPTS
+                from sender import get_sender
+                _relay = OutboxRelay(
+                    get_sender(bot),
+                    batch_size=OUTBOX_BATCH_SIZE,
+                    poll_interval=OUTBOX_POLL_INTERVAL,
+                    max_attempts=OUTBOX_MAX_ATTEMPTS
+                )
+                _relay.start()
+    return _relay
+
+
+def stop_relay(timeout=10.0):
+    if _relay is not None:
+        _relay.stop(timeout)
@@ -0,0 +1,130 @@
+# router.py
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Типы параметров в шаблоне: {имя:тип}
+_CONVERTERS = {
+    'int': int,
+    'str': str,
+}
+_PARAM = re.compile(r'^\{(\w+)(?::(\w+))?\}$')
+_INT_TOKEN = re.compile(r'^-?\d+$')
+# '_' внутри {имя} не разделяет токены
+_SEPARATOR = re.compile(r'_(?![^{]*\})')
+
+
+class RouteConflict(ValueError):
+    """Шаблон callback_data пересекается с уже зарегистрированным"""
+
+
+class _Node:
+    __slots__ = ('literals', 'int_param', 'str_param', 'route')
+
+    def __init__(self):
+        self.literals = {}     # токен -> _Node
+        self.int_param = None  # (имя, _Node)
+        self.str_param = None  # (имя, _Node)
+        self.route = None      # (шаблон, обработчик, guard)
+
+
+class CallbackRouter:
+    """Маршрутизация callback_data по дереву токенов вместо перебора лямбд.
+
+    Шаблон — токены через '_': литералы и параметры {имя:int} / {имя:str}, например
+    'selvar_{order_num}_{product_id:int}_{variant_id:int}'. callback_data разбирается
+    один раз, обработчик вызывается как handler(call, **параметры). Пересекающиеся
+    шаблоны (одинаковые, два параметра на одной позиции, строковый параметр рядом
+    с литералом) отклоняются при регистрации.
+    """
+
+    def __init__(self, bot, deny_text="❌ У вас нет прав."):
+        self.bot = bot
+        self.deny_text = deny_text
+        self._root = _Node()
+        self._lock = threading.Lock()
+
+    def route(self, pattern, guard=None):
+        """Декоратор обработчика. guard(user_id) -> bool проверяет доступ."""
+        def decorator(handler):
+            self.add(pattern, handler, guard)
+            return handler
+        return decorator
+
+    def add(self, pattern, handler, guard=None):
+        with self._lock:
+            node = self._root
+            for token in _SEPARATOR.split(pattern):
+                match = _PARAM.match(token)
+                if not match:
+                    if node.str_param is not None:
+                        raise RouteConflict(f"'{pattern}': литерал '{token}' совпадает со строковым параметром")
+                    if _INT_TOKEN.match(token) and node.int_param is not None:
+                        raise RouteConflict(f"'{pattern}': литерал '{token}' совпадает с числовым параметром")
+                    node = node.literals.setdefault(token, _Node())
+                    continue
+                name, kind = match.group(1), match.group(2) or 'str'
+                if kind not in _CONVERTERS:
+                    raise ValueError(f"'{pattern}': неизвестный тип параметра '{kind}'")
+                slot = 'int_param' if kind == 'int' else 'str_param'
+                other = node.str_param if kind == 'int' else node.int_param
+                if other is not None or (kind == 'str' and node.literals):
+                    raise RouteConflict(f"'{pattern}': параметр {{{name}}} неоднозначен на этой позиции")
+                if getattr(node, slot) is None:
+                    setattr(node, slot, (name, _Node()))
+                elif getattr(node, slot)[0] != name:
+                    raise RouteConflict(f"'{pattern}': параметр {{{name}}} уже называется {{{getattr(node, slot)[0]}}}")
+                node = getattr(node, slot)[1]
+            if node.route is not None:
+                raise RouteConflict(f"'{pattern}' уже зарегистрирован как '{node.route[0]}'")
+            node.route = (pattern, handler, guard)
+
+    def resolve(self, data):
+        """(обработчик, guard, параметры) или None, если callback_data не подходит ни под один шаблон"""
+        node = self._root
+        params = {}
+        for token in data.split('_'):
+            child = node.literals.get(token)
+            if child is not None:
+                node = child
+            elif node.int_param is not None and _INT_TOKEN.match(token):
+                name, node = node.int_param
+                params[name] = int(token)
+            elif node.str_param is not None and token:
+                name, node = node.str_param
+                params[name] = token
+            else:
+                return None
+        if node.route is None:
+            return None
+        _, handler, guard = node.route
+        return handler, guard, params
+
+    def dispatch(self, call):
+        resolved = self.resolve(call.data or '')
+        if resolved is None:
+            logger.warning(f"⚠️ Неизвестный callback: {call.data}")
+            self.bot.answer_callback_query(call.id)
+            return
+        handler, guard, params = resolved
+        if guard is not None and not guard(call.from_user.id):
+            logger.warning(f"❌ Нет прав на {call.data} у пользователя {call.from_user.id}")
+            self.bot.answer_callback_query(call.id, self.deny_text)
+            return
+        handler(call, **params)
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(bot):
+    """Маршрутизатор бота; при первом обращении подключается как единственный обработчик callback"""
+    with _routers_lock:
+        router = _routers.get(id(bot))
+        if router is None:
+            router = _routers[id(bot)] = CallbackRouter(bot)
+            bot.callback_query_handler(func=lambda call: True)(router.dispatch)
+        return router
@@ -0,0 +1,105 @@
+# schema.py
+"""Версионированная схема базы: SQL-миграции из каталога migrations/.
+
+Файлы применяются по порядку имён (NNN_описание.sql), каждый в своей транзакции,
+применённые версии записываются в schema_migrations. Все миграции идемпотентны,
+поэтому на базе, где часть из них уже применялась вручную, повторный прогон безопасен.
+"""
+import logging
+import os
+
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Произвольная константа для pg_advisory_xact_lock: миграции не идут параллельно из двух процессов
+MIGRATION_LOCK_ID = 741852963
+
+# Индексы, на которые рассчитаны запросы models: имя -> таблица
+REQUIRED_INDEXES = {
+    'idx_orders_order_number': 'orders',
+    'idx_orders_seller_status': 'orders',
+    'idx_orders_unprocessed': 'orders',
+    'idx_seller_stock_seller_variant': 'seller_stock',
+    'idx_seller_stock_negative': 'seller_stock',
+    'idx_seller_stock_variant': 'seller_stock',
+    'idx_stock_movements_seller_variant': 'stock_movements',
+    'idx_transfer_requests_status': 'transfer_requests',
+    'idx_transfer_requests_pending': 'transfer_requests',
+    'idx_transfer_request_items_request': 'transfer_request_items',
+    'idx_seller_payments_seller_status': 'seller_payments',
+    'idx_seller_payments_pending': 'seller_payments',
+    'idx_direct_sales_seller': 'direct_sales',
+    'idx_product_variants_product': 'product_variants',
+    'idx_purchases_date': 'purchases',
+    'idx_order_items_variant': 'order_items',
+    'idx_direct_sale_items_variant': 'direct_sale_items',
+    'idx_notification_outbox_pending': 'notification_outbox',
+    'idx_processed_updates_received': 'processed_updates',
+    'idx_bot_sessions_expires': 'bot_sessions',
+    'idx_chat_updates_chat': 'chat_updates',
+}
+
+
+def list_migrations():
+    """[(версия, путь)] по порядку применения"""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        if filename.endswith('.sql'):
+            migrations.append((filename[:-4], os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    VARCHAR(100) PRIMARY KEY,
+            applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """)
+
+
+def get_applied_versions():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            _ensure_migrations_table(cur)
+            cur.execute("SELECT version FROM schema_migrations")
+            return {row['version'] for row in cur.fetchall()}
+
+
+def migrate():
+    """Применяет ещё не применённые миграции. Возвращает список применённых версий."""
+    applied = []
+    for version, path in list_migrations():
+        with open(path, encoding='utf-8') as f:
+            sql = f.read()
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                _ensure_migrations_table(cur)
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+                cur.execute("SELECT 1 FROM schema_migrations WHERE version = %s", (version,))
+                if cur.fetchone():
+                    continue
+                logger.info(f"🛠 Применяем миграцию {version}")
+                cur.execute(sql)
+                cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (version,))
+                conn.commit()
+        applied.append(version)
+    return applied
+
+
+def check_schema():
+    """Сверяет базу со схемой: возвращает (неприменённые миграции, недостающие индексы)"""
+    applied = get_applied_versions()
+    pending = [version for version, _ in list_migrations() if version not in applied]
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND indexname = ANY(%s)",
+                (list(REQUIRED_INDEXES),)
+            )
+            present = {row['indexname'] for row in cur.fetchall()}
+    missing = [(name, table) for name, table in REQUIRED_INDEXES.items() if name not in present]
+    return pending, missing
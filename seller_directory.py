@@ -0,0 +1,97 @@
+# seller_directory.py
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from config import SELLER_CACHE_TTL, SELLER_NEGATIVE_TTL
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+
+class SellerDirectory:
+    """Справочник продавцов в памяти процесса с поиском по id и telegram_id.
+
+    Таблица продавцов маленькая, поэтому загружается целиком и перечитывается
+    раз в ttl секунд или после invalidate(). Незнакомые telegram_id запоминаются
+    на negative_ttl секунд, чтобы посторонние пользователи не нагружали БД.
+    """
+
+    def __init__(self, ttl=300.0, negative_ttl=600.0, max_negative=10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_negative = max_negative
+        self._lock = threading.Lock()
+        self._state = None          # (продавцы по имени, {id: продавец}, {telegram_id: продавец})
+        self._loaded_at = 0.0
+        self._negative = OrderedDict()  # telegram_id -> время промаха
+
+    def _load(self):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT * FROM sellers ORDER BY name")
+                sellers = cur.fetchall()
+        self._state = (
+            sellers,
+            {s['id']: s for s in sellers},
+            {s['telegram_id']: s for s in sellers if s['telegram_id'] is not None}
+        )
+        self._loaded_at = time.monotonic()
+        logger.info(f"👥 Справочник продавцов загружен: {len(sellers)}")
+        return self._state
+
+    def _ensure_fresh(self):
+        state = self._state
+        if state is not None and time.monotonic() - self._loaded_at < self.ttl:
+            return state
+        with self._lock:
+            if self._state is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._state
+            return self._load()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = 0.0
+            self._negative.clear()
+
+    def get_by_telegram_id(self, telegram_id: int):
+        _, _, by_telegram = self._ensure_fresh()
+        seller = by_telegram.get(telegram_id)
+        if seller:
+            return dict(seller)
+
+        with self._lock:
+            missed_at = self._negative.get(telegram_id)
+            if missed_at is not None and time.monotonic() - missed_at < self.negative_ttl:
+                return None
+
+        # Продавца могли добавить после загрузки справочника — проверяем точечно
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM sellers WHERE telegram_id = %s", (telegram_id,))
+                exists = cur.fetchone() is not None
+        if exists:
+            self.invalidate()
+            _, _, by_telegram = self._ensure_fresh()
+            seller = by_telegram.get(telegram_id)
+            return dict(seller) if seller else None
+
+        with self._lock:
+            self._negative[telegram_id] = time.monotonic()
+            self._negative.move_to_end(telegram_id)
+            while len(self._negative) > self.max_negative:
+                self._negative.popitem(last=False)
+        return None
+
+    def get_by_id(self, seller_id: int):
+        _, by_id, _ = self._ensure_fresh()
+        seller = by_id.get(seller_id)
+        return dict(seller) if seller else None
+
+    def get_all(self):
+        sellers, _, _ = self._ensure_fresh()
+        return [dict(s) for s in sellers]
+
+
+sellers = SellerDirectory(ttl=SELLER_CACHE_TTL, negative_ttl=SELLER_NEGATIVE_TTL)
@@ -0,0 +1,279 @@
+# sender.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше — раньше
+PRIORITY_HIGH = 0    # ответы на действие пользователя
+PRIORITY_NORMAL = 1  # уведомления другим участникам
+PRIORITY_LOW = 2     # списки и рассылки
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst накопленных"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Через сколько секунд будет доступен токен (0 — доступен сейчас)"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+
+class _Message:
+    __slots__ = ('chat_id', 'text', 'kwargs', 'priority', 'seq', 'attempts', 'callback')
+
+    def __init__(self, chat_id, text, kwargs, priority, seq, callback):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.seq = seq
+        self.attempts = 0
+        self.callback = callback
+
+
+class MessageSender:
+    """Исходящие сообщения Telegram с ограничением скорости.
+
+    submit() не блокирует обработчик: сообщение ставится в очередь своего чата.
+    Отправители соблюдают общий лимит (global_rate в секунду) и лимит на чат
+    (chat_rate в секунду), сообщения одного чата уходят по порядку, из разных
+    чатов первыми уходят более приоритетные. На 429 чат ставится на паузу
+    на retry_after, сообщение отправляется повторно.
+    """
+
+    def __init__(self, bot, global_rate=30.0, chat_rate=1.0, chat_burst=3, workers=4,
+                 max_pending=10000, max_attempts=5):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}      # chat_id -> TokenBucket
+        self._queues = {}     # chat_id -> deque[_Message] ожидающих отправки
+        self._ready = []      # куча (priority, seq, chat_id): чаты, готовые к отправке
+        self._waiting = []    # куча (время, chat_id): чаты, ждущие своего лимита
+        self._busy = set()    # чаты, сообщение которых сейчас отправляется
+        self._pending = 0
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"sender-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, chat_id, text, priority=PRIORITY_NORMAL, callback=None, **kwargs) -> bool:
+        """Ставит сообщение в очередь. kwargs передаются в bot.send_message.
+        callback(ok, результат или исключение) вызывается после отправки или окончательной ошибки.
+        False — очередь переполнена или отправитель остановлен."""
+        with self._cond:
+            if self._closed or self._pending >= self.max_pending:
+                logger.warning(f"⚠️ Сообщение для {chat_id} не поставлено в очередь отправки")
+                return False
+            message = _Message(chat_id, text, kwargs, priority, next(self._seq), callback)
+            chat_queue = self._queues.get(chat_id)
+            if chat_queue is None:
+                chat_queue = self._queues[chat_id] = deque()
+            chat_queue.append(message)
+            self._pending += 1
+            if len(chat_queue) == 1 and chat_id not in self._busy:
+                self._schedule(chat_id)
+            self._cond.notify()
+            return True
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _schedule(self, chat_id):
+        """Ставит голову очереди чата в готовые или в ожидание лимита. Вызывать под self._cond."""
+        head = self._queues[chat_id][0]
+        now = time.monotonic()
+        wait = self._bucket(chat_id).wait_time(now)
+        if wait > 0:
+            heapq.heappush(self._waiting, (now + wait, chat_id))
+        else:
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _next(self):
+        """Ждёт и забирает следующее сообщение с учётом лимитов. None — отправитель остановлен."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._waiting and self._waiting[0][0] <= now:
+                    _, chat_id = heapq.heappop(self._waiting)
+                    self._schedule(chat_id)
+                if self._ready:
+                    global_wait = self._global.wait_time(now)
+                    if global_wait <= 0:
+                        _, _, chat_id = heapq.heappop(self._ready)
+                        message = self._queues[chat_id].popleft()
+                        self._global.take(now)
+                        self._bucket(chat_id).take(now)
+                        self._busy.add(chat_id)
+                        return message
+                    timeout = global_wait
+                elif self._closed and not self._pending:
+                    return None
+                elif self._waiting:
+                    timeout = self._waiting[0][0] - now
+                else:
+                    timeout = None
+                self._cond.wait(timeout)
+
+    def _done(self, message, requeue=False):
+        chat_id = message.chat_id
+        with self._cond:
+            self._busy.discard(chat_id)
+            chat_queue = self._queues[chat_id]
+            if requeue:
+                chat_queue.appendleft(message)
+            else:
+                self._pending -= 1
+            if chat_queue:
+                self._schedule(chat_id)
+            else:
+                del self._queues[chat_id]
+                if len(self._chats) > 1000:
+                    self._prune_buckets()
+            self._cond.notify_all()
+
+    def _prune_buckets(self):
+        """Забывает лимиты чатов без очереди, у которых ведро снова полное"""
+        now = time.monotonic()
+        for chat_id in [c for c, bucket in self._chats.items()
+                        if c not in self._queues and c not in self._busy and bucket.is_idle(now)]:
+            del self._chats[chat_id]
+
+    def _run(self):
+        while True:
+            message = self._next()
+            if message is None:
+                return
+            message.attempts += 1
+            try:
+                result = self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+            except ApiTelegramException as e:
+                if e.error_code == 429 and message.attempts < self.max_attempts:
+                    retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                    logger.warning(f"⏳ Лимит Telegram для чата {message.chat_id}, повтор через {retry_after} с")
+                    with self._cond:
+                        self._bucket(message.chat_id).pause(retry_after)
+                        self.retried += 1
+                    self._done(message, requeue=True)
+                    continue
+                self._finish(message, False, e)
+                continue
+            except Exception as e:
+                if message.attempts < self.max_attempts:
+                    # Сетевая ошибка: пауза чата растёт с каждой попыткой
+                    with self._cond:
+                        self._bucket(message.chat_id).pause(2 ** message.attempts)
+                        self.retried += 1
+                    self._done(message, requeue=True)
+                    continue
+                self._finish(message, False, e)
+                continue
+            self._finish(message, True, result)
+
+    def _finish(self, message, ok, result):
+        with self._cond:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+        if not ok:
+            logger.error(f"❌ Не удалось отправить сообщение в чат {message.chat_id}: {result}")
+        self._done(message)
+        if message.callback:
+            try:
+                message.callback(ok, result)
+            except Exception as e:
+                logger.exception(f"Ошибка в обработчике результата отправки: {e}")
+
+    def shutdown(self, timeout=10.0):
+        """Дожидается отправки очереди не дольше timeout секунд"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if self._pending:
+            logger.warning(f"⚠️ Отправитель остановлен, не отправлено сообщений: {self._pending}")
+
+    def stats(self):
+        with self._cond:
+            return {
+                'pending': self._pending,
+                'chats': len(self._queues),
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+            }
+
+
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_sender(bot):
+    """Общий отправитель процесса, создаётся при первом обращении"""
+    global _sender
+    if _sender is None:
+        with _sender_lock:
+            if _sender is None:
+                from config import SEND_GLOBAL_RATE, SEND_CHAT_RATE, SEND_WORKERS
+                _sender = MessageSender(
+                    bot,
+                    global_rate=SEND_GLOBAL_RATE,
+                    chat_rate=SEND_CHAT_RATE,
+                    workers=SEND_WORKERS
+                )
+    return _sender
+
+
+def shutdown_sender(timeout=10.0):
+    if _sender is not None:
+        _sender.shutdown(timeout)
@@ -0,0 +1,369 @@
+# sessions.py
+"""Хранилище пошаговых сессий пользователей (продажа, фасовка, перемещение, закупка, правка заказа).
+
+Сессия живёт ttl секунд с последнего обращения. В памяти хранится не больше max_size
+сессий всех видов, самые давние вытесняются. Бэкенд выбирается в config.SESSION_BACKEND:
+memory (по умолчанию, сессии теряются при перезапуске), sqlite (файл) или postgres
+(таблица bot_sessions, общая для нескольких процессов). Изменённую сессию нужно
+сохранить через store.save(), иначе в sqlite/postgres изменения не попадут.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return {'__decimal__': str(value)}
+    raise TypeError(f"Не сериализуется в сессию: {type(value).__name__}")
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1 and '__decimal__' in obj:
+        return Decimal(obj['__decimal__'])
+    return obj
+
+
+def dumps(data):
+    return json.dumps(data, default=_json_default, ensure_ascii=False)
+
+
+def loads(raw):
+    if not isinstance(raw, str):
+        # JSONB из psycopg2 уже разобран; прогоняем через json ради Decimal
+        raw = json.dumps(raw)
+    return json.loads(raw, object_hook=_json_object_hook)
+
+
+class Session:
+    """Сессия с фиксированным набором полей (__slots__) и доступом как к словарю.
+
+    Поля из INT_KEYED — словари с ключами variant_id; при разборе из JSON ключи
+    снова становятся int.
+    """
+    __slots__ = ()
+    DEFAULTS = {}
+    INT_KEYED = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            if name in values:
+                value = values.pop(name)
+            else:
+                default = self.DEFAULTS.get(name)
+                value = default() if callable(default) else default
+            setattr(self, name, value)
+        if values:
+            raise TypeError(f"{type(self).__name__}: неизвестные поля {', '.join(values)}")
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        data = {k: v for k, v in data.items() if k in cls.__slots__}
+        for name in cls.INT_KEYED:
+            if data.get(name):
+                data[name] = {int(k): v for k, v in data[name].items()}
+        return cls(**data)
+
+
+class CartSession(Session):
+    """Выбор позиций по вариантам: продажа, фасовка, перемещение"""
+    __slots__ = ('seller_id', 'chat_id', 'items', 'current_product', 'current_variant',
+                 'product_name', 'variant_name')
+    DEFAULTS = {'items': dict}
+    INT_KEYED = ('items',)
+
+
+class PurchaseSession(Session):
+    __slots__ = ('chat_id', 'message_id', 'items', 'current_product', 'purchase_price')
+    DEFAULTS = {'items': list}
+
+
+class EditSession(Session):
+    """Правка заказа; selected_items: (product_id, variant_id) -> количество"""
+    __slots__ = ('order_number', 'seller_id', 'order_id', 'chat_id', 'message_id',
+                 'selected_items', 'current_product', 'current_variant')
+    DEFAULTS = {'selected_items': dict}
+
+    def to_dict(self):
+        data = super().to_dict()
+        data['selected_items'] = {f"{pid}:{vid}": qty for (pid, vid), qty in self.selected_items.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        session = super().from_dict(data)
+        session.selected_items = {
+            tuple(int(part) for part in key.split(':')): qty
+            for key, qty in (session.selected_items or {}).items()
+        }
+        return session
+
+
+class MemoryBackend:
+    """Сессии в памяти процесса: LRU с ограничением размера"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()  # (вид, user_id) -> (истекает, сессия)
+        self._lock = threading.Lock()
+
+    def load(self, kind, user_id, session_cls, ttl):
+        key = (kind, user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._data[key]
+                return None
+            self._data[key] = (now + ttl, entry[1])
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def save(self, kind, user_id, session, ttl):
+        key = (kind, user_id)
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (now + ttl, session)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                (old_kind, old_user), _ = self._data.popitem(last=False)
+                logger.info(f"🧹 Сессия {old_kind} пользователя {old_user} вытеснена (лимит {self.max_size})")
+
+    def delete(self, kind, user_id):
+        with self._lock:
+            entry = self._data.pop((kind, user_id), None)
+        return entry[1] if entry is not None and entry[0] > time.monotonic() else None
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (expires, _) in self._data.items() if expires <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def count(self):
+        with self._lock:
+            return len(self._data)
+
+
+class SQLiteBackend:
+    """Сессии в файле SQLite: переживают перезапуск одного процесса"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS bot_sessions (
+                    kind       TEXT NOT NULL,
+                    user_id    INTEGER NOT NULL,
+                    data       TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (kind, user_id)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_bot_sessions_expires ON bot_sessions (expires_at)")
+        return self._conn
+
+    def load(self, kind, user_id, session_cls, ttl):
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT data FROM bot_sessions WHERE kind = ? AND user_id = ? AND expires_at > ?",
+                (kind, user_id, now)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE bot_sessions SET expires_at = ? WHERE kind = ? AND user_id = ?",
+                (now + ttl, kind, user_id)
+            )
+        return session_cls.from_dict(loads(row[0]))
+
+    def save(self, kind, user_id, session, ttl):
+        with self._lock:
+            self._db().execute("""
+                INSERT INTO bot_sessions (kind, user_id, data, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (kind, user_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+            """, (kind, user_id, dumps(session.to_dict()), time.time() + ttl))
+
+    def delete(self, kind, user_id):
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT data FROM bot_sessions WHERE kind = ? AND user_id = ? AND expires_at > ?",
+                (kind, user_id, time.time())
+            ).fetchone()
+            db.execute("DELETE FROM bot_sessions WHERE kind = ? AND user_id = ?", (kind, user_id))
+        return loads(row[0]) if row is not None else None
+
+    def purge_expired(self):
+        with self._lock:
+            return self._db().execute("DELETE FROM bot_sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def count(self):
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM bot_sessions").fetchone()[0]
+
+
+class PostgresBackend:
+    """Сессии в таблице bot_sessions: общие для всех процессов бота"""
+
+    def load(self, kind, user_id, session_cls, ttl):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE bot_sessions SET expires_at = NOW() + make_interval(secs => %s)
+                    WHERE kind = %s AND user_id = %s AND expires_at > NOW()
+                    RETURNING data
+                """, (ttl, kind, user_id))
+                row = cur.fetchone()
+                conn.commit()
+        return session_cls.from_dict(loads(row['data'])) if row else None
+
+    def save(self, kind, user_id, session, ttl):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO bot_sessions (kind, user_id, data, expires_at)
+                    VALUES (%s, %s, %s::jsonb, NOW() + make_interval(secs => %s))
+                    ON CONFLICT (kind, user_id) DO UPDATE
+                    SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at
+                """, (kind, user_id, dumps(session.to_dict()), ttl))
+                conn.commit()
+
+    def delete(self, kind, user_id):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM bot_sessions WHERE kind = %s AND user_id = %s
+                    RETURNING data, expires_at > NOW() AS alive
+                """, (kind, user_id))
+                row = cur.fetchone()
+                conn.commit()
+        return loads(row['data']) if row and row['alive'] else None
+
+    def purge_expired(self):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM bot_sessions WHERE expires_at <= NOW()")
+                conn.commit()
+                return cur.rowcount
+
+    def count(self):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) AS n FROM bot_sessions")
+                return cur.fetchone()['n']
+
+
+class SessionStore:
+    """Сессии одного вида (kind) поверх общего бэкенда.
+
+    get() продлевает жизнь сессии, save() записывает её целиком, pop() удаляет и
+    возвращает. Просроченные сессии вычищаются раз в purge_every сохранений.
+    """
+
+    def __init__(self, kind, session_cls, backend=None, ttl=3600, purge_every=200):
+        self.kind = kind
+        self.session_cls = session_cls
+        self._backend = backend
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        """Бэкенд, заданный явно, или общий из настроек (выбирается при первом обращении)"""
+        return self._backend or get_backend()
+
+    def get(self, user_id):
+        return self.backend.load(self.kind, user_id, self.session_cls, self.ttl)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def start(self, user_id, **values):
+        """Создаёт новую сессию пользователя (прежняя, если была, заменяется)"""
+        session = self.session_cls(**values)
+        self.save(user_id, session)
+        return session
+
+    def save(self, user_id, session):
+        self.backend.save(self.kind, user_id, session, self.ttl)
+        with self._lock:
+            self._saves += 1
+            purge = self._saves >= self.purge_every
+            if purge:
+                self._saves = 0
+        if purge:
+            removed = self.backend.purge_expired()
+            if removed:
+                logger.info(f"🧹 Удалено просроченных сессий: {removed}")
+
+    def pop(self, user_id, default=None):
+        data = self.backend.delete(self.kind, user_id)
+        if data is None:
+            return default
+        return data if isinstance(data, Session) else self.session_cls.from_dict(data)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                from config import SESSION_BACKEND, SESSION_MAX, SESSION_SQLITE_PATH
+                if SESSION_BACKEND == 'postgres':
+                    _backend = PostgresBackend()
+                elif SESSION_BACKEND == 'sqlite':
+                    _backend = SQLiteBackend(SESSION_SQLITE_PATH)
+                else:
+                    _backend = MemoryBackend(SESSION_MAX)
+                logger.info(f"🗂 Хранилище сессий: {SESSION_BACKEND}")
+    return _backend
+
+
+def session_store(kind, session_cls):
+    """Хранилище сессий вида kind на настроенном бэкенде"""
+    from config import SESSION_TTL
+    return SessionStore(kind, session_cls, ttl=SESSION_TTL)
@@ -1,21 +1,52 @@
+import atexit
+import hmac
 import logging
 import telebot
 from flask import Flask, request, jsonify
 
-from config import BOT_TOKEN, PORT, WEBHOOK_URL, ADMIN_ID
+from config import (
+    BOT_TOKEN, PORT, ADMIN_ID, STATS_TOKEN,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DRAIN_TIMEOUT,
+    WEBHOOK_DEDUPE_SIZE, WEBHOOK_DEDUPE_SHARED, WEBHOOK_SHARED_QUEUE, DB_POOL_NEEDED
+)
 from handlers import register_all_handlers
-from database import get_db_connection
-from models import get_order_by_number, get_seller_by_id
-from telebot import types
+from database import close_pool
+from dispatcher import UpdateDispatcher
+from dedupe import UpdateDeduplicator
+from sender import shutdown_sender
+from outbox import get_relay, stop_relay
+from models import (
+    get_order_by_number, get_orders_by_numbers, get_seller_by_id, enqueue_notifications
+)
+from notifications import order_completed_notification
+from webhook_setup import set_webhook_once
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-bot = telebot.TeleBot(BOT_TOKEN)
+# Обработчики выполняются в потоках диспетчера, собственный пул потоков telebot не нужен
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
 app = Flask(__name__)
 
 # Регистрируем все обработчики
 register_all_handlers(bot)
+dispatcher = UpdateDispatcher(
+    bot, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE, shared_queue=WEBHOOK_SHARED_QUEUE,
+    pool_needed=DB_POOL_NEEDED
+)
+outbox_relay = get_relay(bot)
+deduplicator = UpdateDeduplicator(capacity=WEBHOOK_DEDUPE_SIZE, shared=WEBHOOK_DEDUPE_SHARED)
+
+@atexit.register
+def shutdown():
+    # Дорабатываем очередь обновлений, досылаем уведомления и только потом закрываем пул
+    dispatcher.shutdown(WEBHOOK_DRAIN_TIMEOUT)
+    stop_relay()
+    shutdown_sender()
+    close_pool()
+
+# Сколько заказов принимает /api/orders-completed за один запрос
+MAX_ORDERS_PER_BATCH = 500
 
 # Эндпоинт для уведомлений из основного бота
 @app.route('/api/order-completed', methods=['POST'])
@@ -30,61 +61,94 @@ def order_completed():
             return jsonify({'error': 'Order not found'}), 404
         if order.get('stock_processed'):
             return jsonify({'status': 'already_processed'}), 200
-        seller_id = order['seller_id']
-        with get_db_connection() as conn:
-            with conn.cursor() as cur:
-                cur.execute("SELECT telegram_id FROM sellers WHERE id = %s", (seller_id,))
-                seller = cur.fetchone()
-                if not seller:
-                    return jsonify({'error': 'Seller not found'}), 404
-                seller_tg = seller['telegram_id']
-        # Формируем текст с учётом вариантов
-        items_text_lines = []
-        for item in order['items']:
-            if item.get('variantName'):
-                items_text_lines.append(f"• {item['name']} ({item['variantName']}): {item['quantity']} шт")
-            else:
-                items_text_lines.append(f"• {item['name']}: {item['quantity']} шт")
-        items_text = "\n".join(items_text_lines)
-
-        markup = types.InlineKeyboardMarkup()
-        markup.row(
-            types.InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_{order_number}"),
-            types.InlineKeyboardButton("✏️ Редактировать", callback_data=f"edit_{order_number}")
-        )
-        try:
-            bot.send_message(
-                seller_tg,
-                f"📦 *Заказ {order_number} завершён!*\n\n"
-                f"{items_text}\n\n"
-                "Зафиксируйте продажу:",
-                parse_mode='Markdown',
-                reply_markup=markup
-            )
-            logger.info(f"Уведомление о заказе {order_number} отправлено продавцу {seller_tg}")
-        except Exception as e:
-            logger.error(f"Ошибка отправки продавцу: {e}")
-            return jsonify({'error': 'Failed to notify seller'}), 500
+        seller = get_seller_by_id(order['seller_id'])
+        if not seller:
+            return jsonify({'error': 'Seller not found'}), 404
+        seller_tg = seller['telegram_id']
+        if not seller_tg:
+            return jsonify({'error': 'Seller has no Telegram account'}), 404
+        enqueue_notifications([order_completed_notification(order, seller_tg)])
+        outbox_relay.wake()
+        logger.info(f"Уведомление о заказе {order_number} для продавца {seller_tg} поставлено в outbox")
         return jsonify({'status': 'ok'})
     except Exception as e:
         logger.exception("Ошибка в /api/order-completed")
         return jsonify({'error': str(e)}), 500
 
+# Пакетный вариант: {"order_numbers": [...]} или {"orders": [{"order_number": ...}, ...]}
+@app.route('/api/orders-completed', methods=['POST'])
+def orders_completed():
+    try:
+        data = request.get_json(silent=True) or {}
+        numbers = data.get('order_numbers')
+        if numbers is None and isinstance(data.get('orders'), list):
+            numbers = [o.get('order_number') for o in data['orders'] if isinstance(o, dict)]
+        if not isinstance(numbers, list) or not numbers:
+            return jsonify({'error': 'Missing order_numbers'}), 400
+        # Убираем повторы, сохраняя порядок
+        numbers = list(dict.fromkeys(str(n) for n in numbers if n))
+        if len(numbers) > MAX_ORDERS_PER_BATCH:
+            return jsonify({'error': f'Too many orders, max {MAX_ORDERS_PER_BATCH}'}), 413
+
+        orders = get_orders_by_numbers(numbers)
+        result = {'queued': [], 'already_processed': [], 'not_found': [], 'seller_not_found': []}
+        notifications = []
+        for number in numbers:
+            order = orders.get(number)
+            if not order:
+                result['not_found'].append(number)
+            elif order.get('stock_processed'):
+                result['already_processed'].append(number)
+            elif not order['seller_telegram_id']:
+                result['seller_not_found'].append(number)
+            else:
+                notifications.append(order_completed_notification(order, order['seller_telegram_id']))
+                result['queued'].append(number)
+
+        enqueue_notifications(notifications)
+        if notifications:
+            outbox_relay.wake()
+        logger.info(f"📦 Пакет завершённых заказов: {len(numbers)}, уведомлений в outbox {len(notifications)}")
+        return jsonify(dict(result, status='ok'))
+    except Exception as e:
+        logger.exception("Ошибка в /api/orders-completed")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    if request.headers.get('content-type') == 'application/json':
-        json_string = request.get_data().decode('utf-8')
-        update = telebot.types.Update.de_json(json_string)
-        bot.process_new_updates([update])
+    if request.headers.get('content-type') != 'application/json':
+        return 'Bad Request', 400
+    try:
+        payload = request.get_data().decode('utf-8')
+        update = telebot.types.Update.de_json(payload)
+    except Exception as e:
+        logger.warning(f"Некорректное обновление от Telegram: {e}")
+        return 'Bad Request', 400
+    if update is None:
+        return 'Bad Request', 400
+    # Повторная доставка того же обновления: подтверждаем, но не обрабатываем
+    if deduplicator.is_duplicate(update.update_id):
+        logger.info(f"🔁 Обновление {update.update_id} уже принято, пропускаем")
         return ''
-    return 'Bad Request', 400
+    # Отвечаем сразу, обработка идёт в потоках диспетчера
+    if not dispatcher.submit(update, payload):
+        deduplicator.forget(update.update_id)
+        return 'Service Unavailable', 503
+    return ''
+
+@app.route('/dispatcher-stats')
+def dispatcher_stats():
+    # Внутреннее состояние очередей: только с токеном из STATS_TOKEN
+    token = request.headers.get('X-Stats-Token', '')
+    if not STATS_TOKEN or not hmac.compare_digest(token.encode(), STATS_TOKEN.encode()):
+        return 'Not Found', 404
+    return jsonify(dict(dispatcher.stats(), duplicates=deduplicator.duplicates))
 
 @app.route('/')
 def index():
     return '🤖 Складской бот работает'
 
 if __name__ == '__main__':
-    bot.remove_webhook()
-    bot.set_webhook(url=WEBHOOK_URL)
-    logger.info(f"Webhook set to {WEBHOOK_URL}")
+    # Под gunicorn webhook ставит gunicorn.conf.py (on_starting), здесь — однопроцессный запуск
+    set_webhook_once()
     app.run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,126 @@
+# stock_cache.py
+import logging
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import psycopg2
+
+from config import DATABASE_URL, STOCK_CACHE_TTL, STOCK_CACHE_MAX_SELLERS, STOCK_CACHE_SHARED
+from database import get_db_connection, in_transaction
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'stock_changed'
+
+
+class StockCache:
+    """Остатки продавцов в памяти процесса: seller_id -> {variant_id: количество}.
+
+    Остатки продавца загружаются одним запросом при первом чтении. Функции models,
+    меняющие seller_stock, после фиксации транзакции сбрасывают запись продавца, и
+    следующее чтение берёт остатки из БД: порядок обработчиков on_commit не совпадает
+    с порядком фиксаций, поэтому записывать в кэш значения из RETURNING нельзя.
+    Внутри transaction() кэш не используется — там читаются незафиксированные данные
+    текущей транзакции. Запись старше ttl секунд перечитывается (страховка от правок
+    мимо models), в памяти держится не больше max_sellers продавцов. При shared=True
+    изменение сопровождается pg_notify, и остальные процессы сбрасывают остатки
+    этого продавца.
+    """
+
+    def __init__(self, ttl=300.0, max_sellers=1000, shared=False):
+        self.ttl = ttl
+        self.max_sellers = max_sellers
+        self.shared = shared
+        self.token = uuid.uuid4().hex[:12]  # отличает свои уведомления от чужих
+        self._lock = threading.Lock()
+        self._stocks = OrderedDict()  # seller_id -> (время загрузки, {variant_id: количество})
+        self._changes = 0             # растёт при каждом изменении, чтобы не сохранить устаревшую загрузку
+        self._listener = None
+
+    def _read(self, seller_id):
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT variant_id, quantity FROM seller_stock WHERE seller_id = %s", (seller_id,))
+                return {row['variant_id']: row['quantity'] for row in cur.fetchall()}
+
+    def _load(self, seller_id):
+        with self._lock:
+            changes = self._changes
+        stock = self._read(seller_id)
+        with self._lock:
+            if changes == self._changes:
+                self._stocks[seller_id] = (time.monotonic(), stock)
+                self._stocks.move_to_end(seller_id)
+                while len(self._stocks) > self.max_sellers:
+                    self._stocks.popitem(last=False)
+        return stock
+
+    def quantities(self, seller_id):
+        """{variant_id: количество} продавца; вариантов без строки в seller_stock нет"""
+        if in_transaction():
+            return self._read(seller_id)
+        if self.shared and self._listener is None:
+            self._start_listener()
+        with self._lock:
+            entry = self._stocks.get(seller_id)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._stocks.move_to_end(seller_id)
+                return dict(entry[1])
+        return dict(self._load(seller_id))
+
+    def quantity(self, seller_id, variant_id):
+        return self.quantities(seller_id).get(variant_id, 0)
+
+    def invalidate(self, seller_id=None):
+        """Сбрасывает остатки продавца (или всех), следующее чтение пойдёт в БД"""
+        with self._lock:
+            self._changes += 1
+            if seller_id is None:
+                self._stocks.clear()
+            else:
+                self._stocks.pop(seller_id, None)
+
+    def notify(self, cur, seller_id):
+        """Сообщает другим процессам об изменении; вызывать в транзакции изменения"""
+        if self.shared:
+            cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, f"{self.token}:{seller_id}"))
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, name="stock-cache-listener", daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(DATABASE_URL)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Пока слушателя не было, уведомления могли потеряться
+                self.invalidate()
+                logger.info("👂 Кэш остатков слушает изменения других процессов")
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        token, _, seller_id = notify.payload.partition(':')
+                        if token != self.token and seller_id.isdigit():
+                            self.invalidate(int(seller_id))
+            except Exception as e:
+                logger.warning(f"⚠️ Слушатель изменений остатков отключился: {e}, переподключение через 5 с")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+
+stock_cache = StockCache(ttl=STOCK_CACHE_TTL, max_sellers=STOCK_CACHE_MAX_SELLERS, shared=STOCK_CACHE_SHARED)
@@ -0,0 +1,42 @@
+# webhook_setup.py
+import logging
+
+import telebot
+
+from config import BOT_TOKEN, WEBHOOK_URL, WEBHOOK_MAX_CONNECTIONS
+from database import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+# Константа для pg_try_advisory_lock: webhook регистрирует только один процесс
+WEBHOOK_LOCK_ID = 741852964
+
+
+def set_webhook_once(force=False) -> bool:
+    """Регистрирует WEBHOOK_URL в Telegram, если этим сейчас не занят другой процесс.
+    Если webhook уже указывает на WEBHOOK_URL с тем же max_connections, повторно
+    не ставит (очередь недоставленных обновлений сохраняется), force=True — поставить
+    заново. При нескольких процессах max_connections должен быть 1
+    (config.WEBHOOK_MAX_CONNECTIONS): иначе Telegram шлёт обновления чата
+    параллельно, и они могут попасть в chat_updates не по порядку.
+    True — webhook зарегистрирован этим вызовом или уже был на месте."""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS locked", (WEBHOOK_LOCK_ID,))
+            if not cur.fetchone()['locked']:
+                logger.info("⏭ Webhook регистрирует другой процесс")
+                return False
+        conn.commit()
+        try:
+            bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+            info = bot.get_webhook_info()
+            if not force and info.url == WEBHOOK_URL and info.max_connections == WEBHOOK_MAX_CONNECTIONS:
+                logger.info(f"Webhook уже установлен: {WEBHOOK_URL}")
+                return True
+            bot.set_webhook(url=WEBHOOK_URL, max_connections=WEBHOOK_MAX_CONNECTIONS)
+            logger.info(f"Webhook set to {WEBHOOK_URL} (max_connections={WEBHOOK_MAX_CONNECTIONS})")
+            return True
+        finally:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_unlock(%s)", (WEBHOOK_LOCK_ID,))
+            conn.commit()
@@ -0,0 +1,5 @@
+# wsgi.py
+"""Точка входа для WSGI-сервера: gunicorn -c gunicorn.conf.py wsgi:app"""
+from stock_bot import app
+
+__all__ = ['app']